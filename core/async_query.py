@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+from qgis.core import QgsRectangle
+
+from .query import Query, QueryCancelled, mergeMeta
+from .utilities.tools import splitBbox
+
+try:
+    from ..settings.config import Config
+except ValueError:
+    from settings.config import Config
+except ImportError:
+    from settings.config import Config
+
+
+class AsyncQuery:
+    """
+    asyncio counterpart of Query that sends many queries concurrently.
+
+    The downloads run in threads through Query.streamGet, so they share the cache, transport and endpoints of Query.
+    At most maxConcurrent queries run at a time and results are returned in the order they complete,
+    so parsing can start as soon as the first query is done.
+    Cancelling stops the running downloads between two elements and closes their connections.
+    """
+    def __init__(self, maxConcurrent:int = None):
+        if maxConcurrent is None:
+            maxConcurrent = Query.MAX_WORKERS * len(Query.ENDPOINTS)
+        self.maxConcurrent:int = maxConcurrent
+        self.__cancelled = threading.Event()
+
+    @staticmethod
+    def featureQueries(bbox:QgsRectangle, config:Config, outGeom:bool = False) -> dict:
+        """ Returns one query string per feature of config, keyed by feature. """
+        return {feature: Query.configQueryString(bbox, config, outGeom=outGeom, features=[feature]) for feature in config.features}
+
+    @staticmethod
+    def tileQueries(bbox:QgsRectangle, config:Config, tileSize:float = None) -> dict:
+        """ Returns one query string per tile of bbox, keyed by the tile index. """
+        tiles = splitBbox(bbox, tileSize if tileSize is not None else Query.TILE_SIZE)
+        return {i: Query.configQueryString(tile, config) for i, tile in enumerate(tiles)}
+
+    def cancel(self) -> None:
+        """ Stops all running and waiting queries. Safe to call from any thread. """
+        self.__cancelled.set()
+
+    def __download(self, queryString:str, meta:dict) -> list:
+        """ Downloads and decodes queryString, stopping between two elements if cancelled. meta receives the timestamp of the response. """
+        elements = []
+        stream = Query.streamGet(queryString, meta=meta, isCanceled=self.__cancelled.is_set)
+        try:
+            for element in stream:
+                if self.__cancelled.is_set():
+                    raise QueryCancelled()
+                elements.append(element)
+        finally:
+            stream.close() # Closes the connection when stopped early
+        return elements
+
+    async def fetch(self, key, queryString:str, semaphore:asyncio.Semaphore, meta:dict = None) -> tuple:
+        """ Returns (key, records) for queryString once a slot in semaphore is free, see asCompleted for meta. """
+        async with semaphore:
+            if self.__cancelled.is_set():
+                raise asyncio.CancelledError()
+            loop = asyncio.get_running_loop()
+            queryMeta = {}
+            try:
+                elements = await loop.run_in_executor(None, self.__download, queryString, queryMeta)
+            except QueryCancelled:
+                raise asyncio.CancelledError()
+            # Merged in the event loop, so the queries do not update meta at the same time
+            mergeMeta(meta, queryMeta)
+            return key, elements
+
+    async def asCompleted(self, queries:dict, meta:dict = None):
+        """
+        Sends all queries concurrently and yields the results as they complete.
+
+        param val:
+            queries: dictionary with any key and query strings as values, e.g. from featureQueries or tileQueries
+            meta: optional dictionary that receives "timestamp_osm_base", the time of the oldest data of the responses
+        ret val:
+            async generator of (key, records) tuples, where records is a list of core.stream records
+            that can be passed to Parser.parse.
+        """
+        self.__cancelled.clear()
+        semaphore = asyncio.Semaphore(self.maxConcurrent)
+        tasks = [asyncio.ensure_future(self.fetch(key, queryString, semaphore, meta)) for key, queryString in queries.items()]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # Reached when the consumer stops early, is cancelled or a query fails.
+            self.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self, queries:dict, onResult, isCanceled = None, meta:dict = None) -> None:
+        """
+        Blocking helper that runs all queries in a new event loop and calls onResult(key, records) for every result as it completes.
+        isCanceled is an optional function, e.g. QgsTask.isCanceled, that is polled to cancel the queries.
+        meta receives the timestamp of the oldest response, see asCompleted.
+        """
+        async def watch():
+            while True:
+                if isCanceled():
+                    self.cancel()
+                    return
+                await asyncio.sleep(0.5)
+
+        async def consume():
+            watcher = asyncio.ensure_future(watch()) if isCanceled is not None else None
+            try:
+                async for key, elements in self.asCompleted(queries, meta):
+                    if self.__cancelled.is_set():
+                        raise QueryCancelled()
+                    onResult(key, elements)
+            except asyncio.CancelledError:
+                raise QueryCancelled()
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+        asyncio.run(consume())
@@ -0,0 +1,168 @@
+"""
+Disk cache of overpass responses, used by core.query.Query.
+
+Responses are stored gzip compressed under the hash of the normalized query string. A response that is being
+streamed is written next to its entry and only replaces it once it has been read to the end, see CacheWriter.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+
+class ResponseCache:
+    """
+    Stores overpass responses gzip compressed on disk, keyed by the normalized query string. 
+    Entries older than ttl seconds are treated as missing and the least recently used entries 
+    are evicted when the total size of the cache exceeds maxSize bytes. 
+    """
+    def __init__(self, directory:str = None, ttl:int = 86400, maxSize:int = 1073741824):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "osm_2_imm", "cache")
+        self.directory:str = directory
+        self.ttl:int = ttl
+        self.maxSize:int = maxSize
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def normalize(queryString:str) -> str:
+        """ Collapses all whitespace so that differently indented queries share the same entry. """
+        return ' '.join(queryString.split())
+
+    def path(self, queryString:str) -> str:
+        """ Returns the path of the cache file for queryString. """
+        key = hashlib.sha256(self.normalize(queryString).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".json.gz")
+
+    def get(self, queryString:str) -> bytes:
+        """ 
+        Returns the cached response for queryString or None if it is missing or expired. 
+        """
+        path = self.path(queryString)
+        try:
+            written = os.path.getmtime(path)
+            if time.time() - written > self.ttl:
+                os.remove(path)
+                return None
+            with gzip.open(path, "rb") as file:
+                data = file.read()
+            # The access time marks the entry as recently used, the modification time is kept for the ttl. 
+            os.utime(path, (time.time(), written))
+        except (FileNotFoundError, OSError, EOFError):
+            return None
+        return data
+
+    def open(self, queryString:str):
+        """ 
+        Returns the cached response for queryString as a readable file object, or None if it is missing or expired. 
+        """
+        path = self.path(queryString)
+        try:
+            written = os.path.getmtime(path)
+            if time.time() - written > self.ttl:
+                os.remove(path)
+                return None
+            os.utime(path, (time.time(), written))
+            return gzip.open(path, "rb")
+        except (FileNotFoundError, OSError):
+            return None
+
+    def writer(self, queryString:str) -> "CacheWriter":
+        """ 
+        Returns a CacheWriter that stores the response of queryString while it is being read. 
+        """
+        return CacheWriter(self, queryString)
+
+    def put(self, queryString:str, data:bytes) -> None:
+        """ 
+        Stores data as the response of queryString and evicts old entries if the cache is full. 
+        """
+        path = self.path(queryString)
+        tmpPath = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with gzip.open(tmpPath, "wb", compresslevel=6) as file:
+            file.write(data)
+        os.replace(tmpPath, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """ 
+        Removes expired entries and then the least recently used entries until the cache is smaller than maxSize. 
+        """
+        entries = []
+        totalSize = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json.gz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError: # Removed by another thread
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            totalSize += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+
+    def clear(self) -> None:
+        """ Removes every entry from the cache. """
+        for name in os.listdir(self.directory):
+            if name.endswith(".json.gz"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class CacheWriter:
+    """
+    Writes a response to the cache piece by piece. 
+    The entry only becomes visible to readers when commit is called, discard throws away what has been written. 
+    """
+    def __init__(self, cache:ResponseCache, queryString:str):
+        self.cache:ResponseCache = cache
+        self.path:str = cache.path(queryString)
+        self.tmpPath:str = f"{self.path}.{os.getpid()}.{id(self)}.tmp"
+        self.file = gzip.open(self.tmpPath, "wb", compresslevel=6)
+
+    def write(self, data:bytes) -> None:
+        self.file.write(data)
+
+    def commit(self) -> None:
+        self.file.close()
+        os.replace(self.tmpPath, self.path)
+        self.cache.evict()
+
+    def discard(self) -> None:
+        self.file.close()
+        try:
+            os.remove(self.tmpPath)
+        except FileNotFoundError:
+            pass
+
+
+class TeeReader:
+    """
+    Wraps a readable file object and passes everything read from it on to a CacheWriter. 
+    """
+    def __init__(self, stream, writer:CacheWriter):
+        self.stream = stream
+        self.writer:CacheWriter = writer
+
+    def read(self, size:int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self.writer.write(data)
+        return data
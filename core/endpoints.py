@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+
+from .scheduler import Scheduler, RetryBudgetExceeded, QueryCancelled
+from .transport import Transport
+
+
+class Endpoint:
+    """
+    An overpass instance together with its scheduler and health statistics.
+    Latency and error rate are exponentially weighted moving averages, so recent requests count the most.
+    """
+    ALPHA = 0.3 # Weight of the latest request in the moving averages
+
+    def __init__(self, url:str, scheduler:Scheduler):
+        self.url:str = url
+        self.scheduler:Scheduler = scheduler
+        self.latency:float = 1.0 # Seconds until the response headers arrive
+        self.errorRate:float = 0.0
+        self.inFlight:int = 0
+        self.requests:int = 0
+        self.failures:int = 0
+        self.consecutiveFailures:int = 0
+        self.cooldownUntil:float = 0
+
+    def score(self) -> float:
+        """ Expected cost of sending one more request to the endpoint, lower is better. """
+        return (self.inFlight + 1) * self.latency * (1 + 4 * self.errorRate)
+
+    def record(self, success:bool, seconds:float) -> None:
+        """ Updates the statistics with the outcome of a request. """
+        self.requests += 1
+        if success:
+            self.latency = (1 - self.ALPHA) * self.latency + self.ALPHA * seconds
+            self.errorRate = (1 - self.ALPHA) * self.errorRate
+            self.consecutiveFailures = 0
+        else:
+            self.errorRate = (1 - self.ALPHA) * self.errorRate + self.ALPHA
+            self.failures += 1
+            self.consecutiveFailures += 1
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "latency": self.latency,
+            "errorRate": self.errorRate,
+            "inFlight": self.inFlight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "coolingDown": max(0, self.cooldownUntil - time.time()),
+            "scheduler": self.scheduler.stats(),
+        }
+
+
+class EndpointPool:
+    """
+    Distributes requests over several overpass instances.
+
+    Every request goes to the endpoint with the lowest score, so concurrent requests such as tiles spread over
+    all endpoints, and faster, healthier endpoints get more of them. An endpoint that fails, or reports no free
+    slot, cools down and the request fails over to the next endpoint. When every endpoint is cooling down the
+    request waits for the first one to become available again.
+    """
+    CANCEL_POLL = 0.5 # Seconds between two checks for cancellation while waiting for an endpoint
+
+    def __init__(self, urls:list, transport:Transport, retryOn:tuple = (), failOn:tuple = (OSError,), maxRetries:int = 8):
+        if len(urls) == 0:
+            raise ValueError("EndpointPool needs at least one endpoint url")
+        self.transport:Transport = transport
+        self.retryOn:tuple = retryOn
+        self.failOn:tuple = tuple(retryOn) + tuple(failOn)
+        self.maxRetries:int = maxRetries
+        self.endpoints:list = [Endpoint(url, Scheduler(transport, Scheduler.statusUrlFor(url))) for url in urls]
+        self.__queueDepth:int = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    @property
+    def queueDepth(self) -> int:
+        """ Number of requests currently waiting for an endpoint. """
+        return self.__queueDepth
+
+    def stats(self) -> list:
+        """ Returns the health statistics of every endpoint. """
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    def acquire(self) -> tuple:
+        """
+        Chooses the endpoint for the next request.
+        ret val:
+            tuple (endpoint, wait) where wait is the number of seconds to wait before sending the request.
+        """
+        now = time.time()
+        with self.__lock:
+            ready = [endpoint for endpoint in self.endpoints if endpoint.cooldownUntil <= now]
+            random.shuffle(ready) # Spreads ties between endpoints that have not been used yet
+            ready.sort(key=lambda endpoint: endpoint.score())
+
+        for endpoint in ready:
+            wait = endpoint.scheduler.slotWait()
+            if wait == 0:
+                return endpoint, 0
+            self.coolDown(endpoint, now + wait)
+
+        with self.__lock:
+            endpoint = min(self.endpoints, key=lambda endpoint: endpoint.cooldownUntil)
+            return endpoint, max(0, endpoint.cooldownUntil - now)
+
+    def coolDown(self, endpoint:Endpoint, until:float) -> None:
+        """ Sends no requests to endpoint until the time until. """
+        with self.__lock:
+            endpoint.cooldownUntil = until
+
+    def wait(self, seconds:float, isCanceled = None) -> None:
+        """ Waits seconds for an endpoint, raises QueryCancelled as soon as isCanceled returns True. """
+        if isCanceled is None:
+            time.sleep(seconds)
+            return
+        until = time.time() + seconds
+        while not isCanceled():
+            remaining = until - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.CANCEL_POLL))
+        raise QueryCancelled()
+
+    def run(self, request, isCanceled = None):
+        """
+        Calls request with the url of the best endpoint and fails over to other endpoints on errors.
+
+        param val:
+            request: function taking an endpoint url and sending the request to it
+            isCanceled: optional function returning True when the request should not be sent, e.g. QgsTask.isCanceled. 
+                It is checked while waiting for an endpoint and before every attempt. 
+        ret val:
+            the return value of request
+        raises:
+            RetryBudgetExceeded when request has failed maxRetries + 1 times over all endpoints.
+            QueryCancelled when isCanceled returns True before the request has been answered. 
+            Exceptions not in retryOn or failOn are raised directly.
+        """
+        with self.__lock:
+            self.__queueDepth += 1
+        try:
+            attempt = 0
+            while True:
+                endpoint, wait = self.acquire()
+                scheduler = endpoint.scheduler
+                if wait > 0:
+                    print(f"All overpass endpoints busy, waiting {wait:.0f}s")
+                    scheduler.enqueue()
+                    try:
+                        self.wait(wait, isCanceled)
+                    finally:
+                        scheduler.dequeue()
+                if isCanceled is not None and isCanceled():
+                    raise QueryCancelled()
+                scheduler.recordSent(wait)
+
+                with self.__lock:
+                    endpoint.inFlight += 1
+                tic = time.time()
+                try:
+                    res = request(endpoint.url)
+                    endpoint.record(True, time.time() - tic)
+                    return res
+                except self.failOn as e:
+                    endpoint.record(False, time.time() - tic)
+                    self.coolDown(endpoint, time.time() + scheduler.backoff(endpoint.consecutiveFailures - 1))
+                    if attempt >= self.maxRetries:
+                        raise RetryBudgetExceeded(attempt + 1, e) from e
+                    print(f"{type(e).__name__} from {endpoint.url}, failing over")
+                    scheduler.recordRetry()
+                    attempt += 1
+                finally:
+                    with self.__lock:
+                        endpoint.inFlight -= 1
+        finally:
+            with self.__lock:
+                self.__queueDepth -= 1
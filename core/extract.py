@@ -0,0 +1,157 @@
+import bz2
+import gzip
+import xml.etree.ElementTree as ET
+from array import array
+
+from qgis.core import QgsRectangle
+
+from .stream import Node, Way, Relation, Member, TagTable
+
+try:
+    import osmium
+except ImportError: # pyosmium is only needed for .osm.pbf extracts
+    osmium = None
+
+
+class Extract:
+    """
+    Reads OSM data from a local extract instead of querying overpass.
+    Supports OSM XML (.osm, .osm.gz, .osm.bz2) with the standard library and .osm.pbf with pyosmium.
+    """
+    OSMIUM_TYPES = {"n": "node", "w": "way", "r": "relation"}
+
+    @classmethod
+    def bboxGet(cls, path:str, bbox:QgsRectangle):
+        """
+        Reads every node, way and relation inside bbox from the extract at path.
+        Like the overpass queries, ways and relations crossing the border of bbox are complete:
+        all their member ways and nodes are included even if they are outside bbox.
+
+        param val:
+            path: path to the extract
+            bbox: the area to read in wgs84 coordinates
+        ret val:
+            generator of Node, Way and Relation records from core.stream, nodes before ways before relations.
+            It can be passed to Parser.parse like the result of Query.streamGet.
+        """
+        xMin, yMin, xMax, yMax = bbox.xMinimum(), bbox.yMinimum(), bbox.xMaximum(), bbox.yMaximum()
+
+        # First pass: find the objects touching bbox.
+        print("Reading extract, pass 1/3", end="\r")
+        insideNodes = set()
+        keptWays = set()
+        keptRelations = set()
+        neededNodes = set()
+        for element in cls.read(path):
+            elementType = type(element)
+            if elementType is Node:
+                if xMin <= element.lon <= xMax and yMin <= element.lat <= yMax:
+                    insideNodes.add(element.id)
+            elif elementType is Way:
+                if any(nodeId in insideNodes for nodeId in element.nodeIds):
+                    keptWays.add(element.id)
+                    neededNodes.update(element.nodeIds)
+            elif elementType is Relation:
+                for member in element.members:
+                    if (member.type == 'node' and member.ref in insideNodes) or (member.type == 'way' and member.ref in keptWays):
+                        keptRelations.add(element.id)
+                        break
+
+        # Second pass: completes the kept relations with the members outside bbox.
+        print("Reading extract, pass 2/3", end="\r")
+        memberNodes = set()
+        memberWays = set()
+        for element in cls.read(path):
+            if type(element) is not Relation:
+                continue
+            if element.id not in keptRelations:
+                continue
+            for member in element.members:
+                if member.type == 'node':
+                    memberNodes.add(member.ref)
+                elif member.type == 'way' and member.ref not in keptWays:
+                    memberWays.add(member.ref)
+        if len(memberWays) > 0:
+            for element in cls.read(path):
+                elementType = type(element)
+                if elementType is Relation:
+                    break
+                if elementType is Way and element.id in memberWays:
+                    neededNodes.update(element.nodeIds)
+        keptWays.update(memberWays)
+        neededNodes.update(memberNodes)
+        neededNodes.update(insideNodes)
+        del insideNodes, memberNodes, memberWays
+
+        # Third pass: yields the kept objects.
+        print("Reading extract, pass 3/3")
+        tagTable = TagTable()
+        for element in cls.read(path):
+            elementType = type(element)
+            if elementType is Node:
+                if element.id in neededNodes:
+                    yield element._replace(tags=tagTable(element.tags))
+            elif elementType is Way:
+                if element.id in keptWays:
+                    yield element._replace(tags=tagTable(element.tags))
+            elif elementType is Relation:
+                if element.id in keptRelations:
+                    yield element._replace(tags=tagTable(element.tags))
+
+    @classmethod
+    def read(cls, path:str):
+        """
+        Yields every node, way and relation in the extract at path as records, in the order of the file.
+        """
+        if path.endswith(".pbf"):
+            return cls.__readPbf(path)
+        return cls.__readXml(path)
+
+    @staticmethod
+    def __readXml(path:str):
+        if path.endswith(".gz"):
+            file = gzip.open(path, "rb")
+        elif path.endswith(".bz2"):
+            file = bz2.open(path, "rb")
+        else:
+            file = open(path, "rb")
+
+        with file:
+            context = ET.iterparse(file, events=("start", "end"))
+            _, root = next(context)
+            for event, elem in context:
+                if event != "end":
+                    continue
+                tag = elem.tag
+                if tag == "node":
+                    tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                    yield Node(int(elem.get("id")), tags, float(elem.get("lat")), float(elem.get("lon")))
+                elif tag == "way":
+                    tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                    nodeIds = array('q', (int(nd.get("ref")) for nd in elem.iter("nd")))
+                    yield Way(int(elem.get("id")), tags, nodeIds)
+                elif tag == "relation":
+                    tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                    members = tuple(Member(m.get("type"), int(m.get("ref")), m.get("role", "")) for m in elem.iter("member"))
+                    yield Relation(int(elem.get("id")), tags, members)
+                else:
+                    continue
+                # Frees the parsed objects so memory does not grow with the file.
+                root.clear()
+
+    @classmethod
+    def __readPbf(cls, path:str):
+        if osmium is None:
+            raise ImportError("Reading .osm.pbf extracts requires pyosmium (pip install osmium)")
+
+        for obj in osmium.FileProcessor(path):
+            tags = {tag.k: tag.v for tag in obj.tags}
+            if obj.is_node():
+                if not obj.location.valid():
+                    continue
+                yield Node(obj.id, tags, obj.location.lat, obj.location.lon)
+            elif obj.is_way():
+                yield Way(obj.id, tags, array('q', (nodeRef.ref for nodeRef in obj.nodes)))
+            elif obj.is_relation():
+                members = tuple(Member(cls.OSMIUM_TYPES[m.type], m.ref, m.role) for m in obj.members)
+                yield Relation(obj.id, tags, members)
@@ -0,0 +1,84 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from qgis.core import QgsRectangle, QgsVectorLayer, QgsFeature, QgsFeatureRequest
+
+from .utilities.tools import getOsmBboxString
+
+
+class RefreshState:
+    """
+    Remembers, per bounding box, the time of the OSM data last written to an output location.
+    The state is stored as json next to the geopackages, so it follows the output if it is moved.
+    """
+    FILE_NAME = "osm_2_imm_state.json"
+    TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+    def __init__(self, outLoc:str):
+        self.path:str = os.path.join(outLoc, self.FILE_NAME)
+        try:
+            with open(self.path) as file:
+                self.state:dict = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+
+    def get(self, bbox:QgsRectangle) -> str:
+        """ Returns the timestamp of the data last written for bbox, or None if bbox has not been written. """
+        return self.state.get(getOsmBboxString(bbox))
+
+    def set(self, bbox:QgsRectangle, timestamp:str) -> None:
+        """ Stores timestamp as the time of the data written for bbox. """
+        self.state[getOsmBboxString(bbox)] = timestamp
+        with open(self.path, "w") as file:
+            json.dump(self.state, file, indent=2)
+
+    @classmethod
+    def now(cls, margin:timedelta = timedelta(hours=1)) -> str:
+        """
+        Returns the current time minus margin as a timestamp.
+        Used when the time of the data is unknown; the margin covers the delay of the overpass database.
+        """
+        return (datetime.now(timezone.utc) - margin).strftime(cls.TIME_FORMAT)
+
+
+def patchLayer(lyr:QgsVectorLayer, newLyr:QgsVectorLayer, changedIds:set, currentIds:set) -> tuple:
+    """
+    Patches a saved layer in place by OSM type and id.
+    Features of changed objects are replaced by their features in newLyr, features of objects that
+    no longer exist or are no longer relevant are deleted.
+
+    param:
+        lyr: the layer in the geopackage to patch
+        newLyr: the layer parsed from the changed objects
+        changedIds: (type, id) of all objects in the refresh response, type is "node", "way" or "relation"
+        currentIds: (type, id) of all objects that are currently relevant, or None to skip deletions
+    ret: tuple (nDeleted, nAdded)
+    """
+    pr = lyr.dataProvider()
+    idIndex = lyr.fields().indexOf("OSM id")
+    typeIndex = lyr.fields().indexOf("OSM type")
+    if typeIndex == -1:
+        raise ValueError(f"layer {lyr.name()} has no OSM type field, run a full extraction instead of a refresh")
+
+    request = QgsFeatureRequest().setSubsetOfAttributes([idIndex, typeIndex]).setFlags(QgsFeatureRequest.NoGeometry)
+    toDelete = []
+    for f in lyr.getFeatures(request):
+        key = (f[typeIndex], f[idIndex])
+        if key in changedIds or (currentIds is not None and key not in currentIds):
+            toDelete.append(f.id())
+    pr.deleteFeatures(toDelete)
+
+    fields = lyr.fields()
+    newFeatures = []
+    for newF in newLyr.getFeatures():
+        f = QgsFeature(fields)
+        for field in newLyr.fields():
+            if fields.indexOf(field.name()) != -1:
+                f[field.name()] = newF[field.name()]
+        f.setGeometry(newF.geometry())
+        newFeatures.append(f)
+    pr.addFeatures(newFeatures)
+    lyr.updateExtents()
+
+    return len(toDelete), len(newFeatures)
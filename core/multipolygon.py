@@ -0,0 +1,179 @@
+"""
+Assembly of multipolygon relations from their member ways.
+
+Works on plain coordinate lists, (lon, lat) pairs, so the geometry is built in one step by the caller.
+Member ways are joined into closed rings by matching their end points, and every inner ring is
+assigned to the smallest outer ring that contains it, with a bounding box check before the exact one.
+"""
+
+
+def joinRings(ways:list) -> tuple:
+    """
+    Joins ways into closed rings by matching their end points. Ways may be reversed to fit.
+
+    param val:
+        ways: list of coordinate lists
+    ret val:
+        tuple (rings, nUnclosed) where rings is a list of closed coordinate lists, first point repeated last,
+        and nUnclosed is the number of open chains that were left over, e.g. when members are missing.
+    """
+    rings = []
+    chains = []
+    for coords in ways:
+        if len(coords) < 2:
+            continue
+        if coords[0] == coords[-1]:
+            if len(coords) >= 4:
+                rings.append(list(coords))
+            continue
+        chains.append(coords)
+
+    # End point -> indices of the open ways starting or ending there
+    ends = {}
+    for i, coords in enumerate(chains):
+        ends.setdefault(coords[0], []).append(i)
+        ends.setdefault(coords[-1], []).append(i)
+
+    used = [False] * len(chains)
+    nUnclosed = 0
+    for start in range(len(chains)):
+        if used[start]:
+            continue
+        used[start] = True
+        ring = list(chains[start])
+        while ring[0] != ring[-1]:
+            tail = ring[-1]
+            nextWay = None
+            for i in ends.get(tail, ()):
+                if not used[i]:
+                    nextWay = i
+                    break
+            if nextWay is None:
+                break
+            used[nextWay] = True
+            coords = chains[nextWay]
+            if coords[0] == tail:
+                ring.extend(coords[1:])
+            else:
+                ring.extend(reversed(coords[:-1]))
+
+        if ring[0] == ring[-1] and len(ring) >= 4:
+            rings.append(ring)
+        else:
+            nUnclosed += 1
+    return rings, nUnclosed
+
+
+def ringArea(ring:list) -> float:
+    """ 
+    Signed area of a closed ring with the shoelace formula, positive when counter clockwise. 
+    The points are taken relative to the first one, as GEOS does, so small rings at lon/lat far from (0, 0) keep their precision. 
+    """
+    if len(ring) == 0:
+        return 0.0
+    x0, y0 = ring[0]
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        area += (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+    return area / 2
+
+
+def ringCentroid(ring:list) -> tuple:
+    """ 
+    Returns the (lon, lat) of the centroid of the area of a closed ring, or of its first point if it has no area. 
+    Computed relative to the first point like ringArea. 
+    ring can also be a numpy array of shape (n, 2), e.g. from NodeStore.lonLat, which is computed with array operations. 
+    """
+    if hasattr(ring, "shape"):
+        return _arrayCentroid(ring)
+    x0, y0 = ring[0]
+    area = 0.0
+    cx = 0.0
+    cy = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        x1 -= x0
+        y1 -= y0
+        x2 -= x0
+        y2 -= y0
+        cross = x1 * y2 - x2 * y1
+        area += cross
+        cx += (x1 + x2) * cross
+        cy += (y1 + y2) * cross
+    if area == 0:
+        return tuple(ring[0])
+    return x0 + cx / (3 * area), y0 + cy / (3 * area)
+
+
+def _arrayCentroid(ring) -> tuple:
+    """ ringCentroid of a numpy array, without a python loop over the points. """
+    x0 = float(ring[0, 0])
+    y0 = float(ring[0, 1])
+    x = ring[:, 0] - x0
+    y = ring[:, 1] - y0
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    area = float(cross.sum())
+    if area == 0:
+        return x0, y0
+    cx = float(((x[:-1] + x[1:]) * cross).sum())
+    cy = float(((y[:-1] + y[1:]) * cross).sum())
+    return x0 + cx / (3 * area), y0 + cy / (3 * area)
+
+
+def ringBbox(ring:list) -> tuple:
+    """ Returns (xMin, yMin, xMax, yMax) of ring. """
+    xs = [x for x, _ in ring]
+    ys = [y for _, y in ring]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def pointInRing(point:tuple, ring:list) -> bool:
+    """ Even-odd ray casting test of point against a closed ring. """
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y):
+            if x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+    return inside
+
+
+def ringInRing(inner:list, outer:list) -> bool:
+    """ Returns True if inner lies inside outer, tested with a vertex of inner that is not on outer. """
+    shared = set(outer)
+    for point in inner:
+        if point not in shared:
+            return pointInRing(point, outer)
+    return False # Same ring
+
+
+def assemble(outerWays:list, innerWays:list) -> tuple:
+    """
+    Builds the polygons of a multipolygon relation.
+
+    param val:
+        outerWays: coordinate lists of the outer members, and of members without a role
+        innerWays: coordinate lists of the inner members
+    ret val:
+        tuple (polygons, nUnclosed) where polygons is a list of polygons, each a list of rings with the
+        outer ring first, and nUnclosed is the number of rings that could not be closed.
+    """
+    outers, nOuterUnclosed = joinRings(outerWays)
+    inners, nInnerUnclosed = joinRings(innerWays)
+
+    # Smallest first, so an inner ring goes to the innermost outer ring containing it
+    outers.sort(key=lambda ring: abs(ringArea(ring)))
+    bboxes = [ringBbox(ring) for ring in outers]
+    holes = [[] for _ in outers]
+
+    for inner in inners:
+        xMin, yMin, xMax, yMax = ringBbox(inner)
+        for i, outer in enumerate(outers):
+            oxMin, oyMin, oxMax, oyMax = bboxes[i]
+            if xMin < oxMin or yMin < oyMin or xMax > oxMax or yMax > oyMax:
+                continue
+            if ringInRing(inner, outer):
+                holes[i].append(inner)
+                break
+
+    polygons = [[outer] + holes[i] for i, outer in enumerate(outers)]
+    return polygons, nOuterUnclosed + nInnerUnclosed
@@ -0,0 +1,161 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError: # numpy ships with QGIS, the dictionary index is only used without it
+    np = None
+
+
+class NodeStore:
+    """
+    Compact store of node coordinates by OSM id, used by Parser instead of a dictionary of QgsPointXY.
+
+    Ids and coordinates are appended to typed arrays. With numpy they are turned into a sorted int64 id array
+    and float64 lon and lat arrays on the first lookup, and ways are resolved with one searchsorted per way.
+    Without numpy a dictionary maps the ids to positions in the arrays.
+    Nodes can be added after a lookup, they are merged into the sorted arrays on the next one.
+    """
+    def __init__(self, useNumpy:bool = True):
+        self.__numpy:bool = useNumpy and np is not None
+        # Nodes added since the last lookup
+        self.__newIds = array('q')
+        self.__newLons = array('d')
+        self.__newLats = array('d')
+        if self.__numpy:
+            self.__ids = np.empty(0, dtype=np.int64)
+            self.__lons = np.empty(0, dtype=np.float64)
+            self.__lats = np.empty(0, dtype=np.float64)
+        else:
+            self.__index:dict = {}
+
+    def __len__(self) -> int:
+        if self.__numpy:
+            return len(self.__ids) + len(self.__newIds)
+        return len(self.__index)
+
+    def __contains__(self, osmId:int) -> bool:
+        if self.__numpy:
+            self.__merge()
+            i = np.searchsorted(self.__ids, osmId)
+            return bool(i < len(self.__ids) and self.__ids[i] == osmId)
+        return osmId in self.__index
+
+    def add(self, osmId:int, lon:float, lat:float) -> None:
+        """ Stores the position of a node. """
+        if not self.__numpy:
+            self.__index[osmId] = len(self.__newLons)
+        self.__newIds.append(osmId)
+        self.__newLons.append(lon)
+        self.__newLats.append(lat)
+
+    def __merge(self) -> None:
+        """ Moves the nodes added since the last lookup into the sorted arrays. """
+        if len(self.__newIds) == 0:
+            return
+        ids = np.concatenate((self.__ids, np.frombuffer(self.__newIds, dtype=np.int64)))
+        lons = np.concatenate((self.__lons, np.frombuffer(self.__newLons, dtype=np.float64)))
+        lats = np.concatenate((self.__lats, np.frombuffer(self.__newLats, dtype=np.float64)))
+        self.__newIds = array('q')
+        self.__newLons = array('d')
+        self.__newLats = array('d')
+
+        if len(ids) > 1 and not np.all(ids[1:] >= ids[:-1]): # Overpass and extracts usually return nodes sorted by id
+            order = np.argsort(ids, kind='stable')
+            ids, lons, lats = ids[order], lons[order], lats[order]
+        self.__ids, self.__lons, self.__lats = ids, lons, lats
+
+    def point(self, osmId:int) -> tuple:
+        """ Returns (lon, lat) of the node osmId, raises KeyError if it is not stored. """
+        if self.__numpy:
+            self.__merge()
+            i = np.searchsorted(self.__ids, osmId)
+            if i == len(self.__ids) or self.__ids[i] != osmId:
+                raise KeyError(osmId)
+            return float(self.__lons[i]), float(self.__lats[i])
+        i = self.__index[osmId]
+        return self.__newLons[i], self.__newLats[i]
+
+    def coords(self, osmIds:list) -> list:
+        """ Returns a list of (lon, lat) of the nodes osmIds, e.g. the nodes of a way. Raises KeyError if a node is not stored. """
+        if not self.__numpy:
+            index, lons, lats = self.__index, self.__newLons, self.__newLats
+            return [(lons[i], lats[i]) for i in map(index.__getitem__, osmIds)]
+        i = self.__positions(osmIds)
+        return list(zip(self.__lons[i].tolist(), self.__lats[i].tolist()))
+
+    def lonLat(self, osmIds:list):
+        """ 
+        Like coords, but returns a numpy array of shape (n, 2) when numpy is used, 
+        which core.wkb writes without going through python floats. 
+        """
+        if not self.__numpy:
+            return self.coords(osmIds)
+        i = self.__positions(osmIds)
+        return np.column_stack((self.__lons[i], self.__lats[i]))
+
+    def __positions(self, osmIds:list):
+        """ Returns the positions of osmIds in the sorted arrays, raises KeyError if a node is not stored. """
+        self.__merge()
+        wanted = np.asarray(osmIds, dtype=np.int64)
+        if len(self.__ids) == 0:
+            if len(wanted) > 0:
+                raise KeyError(int(wanted[0]))
+            return wanted
+        i = np.searchsorted(self.__ids, wanted)
+        i[i == len(self.__ids)] = 0 # Out of range, fails the check below unless the id matches
+        found = self.__ids[i] == wanted
+        if not np.all(found):
+            raise KeyError(int(wanted[~found][0]))
+        return i
+
+
+class WayStore:
+    """
+    Node ids of the ways that relations refer to, with the coordinates of a way resolved on first use.
+
+    With needed, a Counter of the number of references to every way from the relations that will be parsed, 
+    only those ways are kept, and a way and its coordinates are dropped once release has been called for every reference. 
+    Without needed, e.g. when the response is streamed and the relations are not known yet, the node ids of every way are kept 
+    and the coordinates are resolved every time they are asked for. 
+    """
+    def __init__(self, nodes:NodeStore, needed:dict = None):
+        """
+        param val:
+            nodes: the NodeStore the node ids are resolved with
+            needed: optional Counter of references per way id
+        """
+        self.nodes:NodeStore = nodes
+        self.needed:dict = needed
+        self.__nodeIds:dict = {}
+        self.__coords:dict = {}
+
+    def __len__(self) -> int:
+        return len(self.__nodeIds)
+
+    def add(self, way) -> None:
+        """ Keeps the node ids of way if a relation may refer to it. Ways with inline coordinates are not kept. """
+        if way.coords is None and (self.needed is None or way.id in self.needed):
+            self.__nodeIds[way.id] = array('q', way.nodeIds)
+
+    def coords(self, wayId:int) -> list:
+        """ Returns the (lon, lat) of the nodes of the way wayId, raises KeyError if the way is not kept. """
+        try:
+            return self.__coords[wayId]
+        except KeyError:
+            pass
+        coords = self.nodes.coords(self.__nodeIds[wayId])
+        if self.needed is not None:
+            self.__coords[wayId] = coords
+        return coords
+
+    def release(self, wayId:int) -> None:
+        """ Called once for every reference to wayId when it has been used, drops the way after the last one. """
+        if self.needed is None:
+            return
+        count = self.needed.get(wayId, 0) - 1
+        if count > 0:
+            self.needed[wayId] = count
+            return
+        self.needed.pop(wayId, None)
+        self.__nodeIds.pop(wayId, None)
+        self.__coords.pop(wayId, None)
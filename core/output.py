@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+
+from qgis.core import (QgsCoordinateTransformContext,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer)
+
+from .utilities.tools import getGroupNameFromFeature, getLayerNameFromFeature
+
+
+class GeoPackageOutput:
+    """
+    Writes the layers of a run to one geopackage per feature group in outLoc, with one layer per feature.
+
+    Layers can be saved whole with saveLayer, or streamed with addFeatures while they are parsed, so they never
+    have to be kept in memory. A geopackage only works with one writer at a time, so streamed features are written
+    to a geopackage per feature in a temporary directory first, and copied into the group geopackages by finish.
+    """
+    def __init__(self, outLoc:str, transformContext:QgsCoordinateTransformContext):
+        self.outLoc:str = outLoc
+        self.transformContext:QgsCoordinateTransformContext = transformContext
+        self.createdGroups:list = []
+        self.writers:dict = {} # QgsVectorFileWriter of every streamed feature
+        self.partialPaths:dict = {}
+        self.__tempDir:str = None
+
+    def path(self, feature:str) -> str:
+        """ Returns the path of the geopackage of the group of feature. """
+        return os.path.join(self.outLoc, getGroupNameFromFeature(feature)+'.gpkg')
+
+    def saveOptions(self, feature:str) -> QgsVectorFileWriter.SaveVectorOptions:
+        """ Returns the options for writing the layer of feature, the first layer of a group overwrites its geopackage. """
+        groupName = getGroupNameFromFeature(feature)
+        saveOptions = QgsVectorFileWriter.SaveVectorOptions()
+        if groupName not in self.createdGroups:
+            self.createdGroups.append(groupName)
+            saveOptions.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+        else:
+            saveOptions.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        saveOptions.driverName = "GPKG"
+        saveOptions.layerName = getLayerNameFromFeature(feature)
+        return saveOptions
+
+    def saveLayer(self, feature:str, vl:QgsVectorLayer) -> str:
+        """
+        Saves vl as the layer of feature in the geopackage of its group and returns the path of the geopackage.
+        """
+        gpkgPath = self.path(feature)
+        err = QgsVectorFileWriter.writeAsVectorFormatV2(vl, gpkgPath, self.transformContext, self.saveOptions(feature))
+        if err[0] != QgsVectorFileWriter.NoError:
+            print(f"layer {feature} could not be saved to {gpkgPath}: {err[1]}")
+        return gpkgPath
+
+    def addFeatures(self, feature:str, lyr:QgsVectorLayer, feats:list) -> bool:
+        """
+        Streams feats to the layer of feature. lyr is the empty memory layer of feature, its fields, geometry type
+        and crs are used to create the layer on the first call.
+        """
+        writer = self.writers.get(feature)
+        if writer is None:
+            writer = self.__createWriter(feature, lyr)
+        return writer.addFeatures(feats)
+
+    def hasFeatures(self, feature:str) -> bool:
+        """ Returns True if features of feature have been streamed. """
+        return feature in self.writers or feature in self.partialPaths
+
+    def __createWriter(self, feature:str, lyr:QgsVectorLayer) -> QgsVectorFileWriter:
+        if self.__tempDir is None:
+            # In outLoc, so the copies in finish stay on the same disk
+            self.__tempDir = tempfile.mkdtemp(prefix=".osm_2_imm_", dir=self.outLoc)
+        path = os.path.join(self.__tempDir, getLayerNameFromFeature(feature)+'.gpkg')
+
+        saveOptions = QgsVectorFileWriter.SaveVectorOptions()
+        saveOptions.driverName = "GPKG"
+        saveOptions.layerName = getLayerNameFromFeature(feature)
+        writer = QgsVectorFileWriter.create(path, lyr.fields(), lyr.wkbType(), lyr.crs(), self.transformContext, saveOptions)
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise OSError(f"could not create {path}: {writer.errorMessage()}")
+
+        self.writers[feature] = writer
+        self.partialPaths[feature] = path
+        return writer
+
+    def __closeWriters(self) -> None:
+        # Deleting a QgsVectorFileWriter commits and closes its file
+        for feature in list(self.writers.keys()):
+            del self.writers[feature]
+
+    def finish(self) -> list:
+        """
+        Copies the streamed layers into the geopackages of their groups and removes the temporary files.
+        Returns the paths of the geopackages written.
+        """
+        self.__closeWriters()
+        paths = []
+        for feature, partialPath in self.partialPaths.items():
+            name = getLayerNameFromFeature(feature)
+            vl = QgsVectorLayer(partialPath+f"|layername={name}", name, "ogr")
+            paths.append(self.saveLayer(feature, vl))
+            del vl # Releases the file before it is removed
+        self.discard()
+        return paths
+
+    def discard(self) -> None:
+        """ Closes the streamed layers and removes their temporary files without copying them, e.g. when the run is cancelled. """
+        self.__closeWriters()
+        self.partialPaths = {}
+        if self.__tempDir is not None:
+            shutil.rmtree(self.__tempDir, ignore_errors=True)
+            self.__tempDir = None
@@ -0,0 +1,145 @@
+"""
+Building the geometries of parsed ways and relations in a pool of worker processes.
+
+Parser collects the relevant ways and relations with their coordinates as jobs, the jobs are split into
+chunks of consecutive objects and every worker returns the features of its chunk as attributes and WKB.
+The workers only use the standard library, the QGIS layers are filled by Parser in the main process.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import wkb
+from .multipolygon import assemble, ringCentroid
+
+MIN_JOBS = 2000 # Fewer jobs are built in the main process, starting the workers would take longer
+CHUNKS_PER_PROCESS = 4 # More chunks than processes evens out chunks with large relations
+
+_SPEC:dict = None # Set in every worker by initWorker
+
+
+def pythonExecutable() -> str:
+    """
+    Returns the python interpreter the workers are started with.
+    Inside QGIS sys.executable is the QGIS application, so the interpreter next to the python library is used instead.
+    """
+    executable = sys.executable
+    if os.path.basename(executable).lower().startswith("python"):
+        return executable
+    version = f"python{sys.version_info.major}.{sys.version_info.minor}"
+    candidates = [
+        os.path.join(sys.exec_prefix, "python.exe"),
+        os.path.join(sys.exec_prefix, "bin", version),
+        os.path.join(sys.exec_prefix, "bin", "python3"),
+    ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which(version) or shutil.which("python3") or executable
+
+
+def workerSpec(config) -> dict:
+    """ Returns the parts of config the workers need, without anything from QGIS so it can be sent to them. """
+    return {
+        "polygonRules": config.polygonRules,
+        "features": {feature: (config.configJson[feature]['outputGeom'], tuple(config.configJson[feature]['outputTags'])) for feature in config.features},
+    }
+
+
+def initWorker(spec:dict) -> None:
+    global _SPEC
+    _SPEC = spec
+
+
+def isPolygon(tags:dict, coords:list) -> bool:
+    """ Same as Parser.checkForPolygon, with the rules of the worker spec. """
+    if coords[0] != coords[-1] or tags.get('area') == 'no':
+        return False
+    rules = _SPEC["polygonRules"]
+    for key, value in tags.items():
+        if key in rules:
+            isAll, whitelist, blacklist = rules[key]
+            if isAll or value in whitelist or (blacklist is not None and value not in blacklist):
+                return True
+    return False
+
+
+def buildWay(tags:dict, coords:list, outputGeom:str) -> tuple:
+    """ Returns (wkb, merge) for a way, see parseChunk. """
+    if isPolygon(tags, coords):
+        if outputGeom == 'point':
+            return wkb.point(ringCentroid(coords)), False
+        return wkb.polygon([coords]), False
+    return wkb.lineString(coords), False
+
+
+def buildRelation(members:tuple, outputGeom:str) -> tuple:
+    """ Returns (wkb, merge) for a relation, see parseChunk. """
+    if outputGeom == 'point':
+        points = [coords[0] for memberType, _, coords in members if memberType == 'node' and coords is not None]
+        return wkb.multiPoint(points), False
+    lines = [coords for memberType, _, coords in members if memberType == 'way' and coords is not None]
+    if outputGeom == 'line':
+        return wkb.multiLineString(lines), True
+    outerWays = [coords for memberType, role, coords in members if memberType == 'way' and coords is not None and role != 'inner']
+    innerWays = [coords for memberType, role, coords in members if memberType == 'way' and coords is not None and role == 'inner']
+    polygons, _ = assemble(outerWays, innerWays)
+    if len(polygons) == 0:
+        return None, False
+    return wkb.multiPolygon(polygons), False
+
+
+def parseChunk(jobs:list) -> list:
+    """
+    Builds the features of a chunk of jobs.
+
+    param val:
+        jobs: list of ('way', id, tags, features, coords) and ('relation', id, tags, features, members) tuples,
+            where members is a tuple of (type, role, coords) and coords is None for missing members
+    ret val:
+        list of (feature, prefix, osmId, attributes, wkb, merge) tuples. prefix is the statistics prefix,
+        wkb is None if no geometry could be built and merge is True if the lines should be merged.
+    """
+    records = []
+    for elementType, osmId, tags, features, data in jobs:
+        for feature in features:
+            outputGeom, outputTags = _SPEC["features"][feature]
+            attributes = [osmId, elementType] + [tags.get(tag) for tag in outputTags]
+            if elementType == 'way':
+                geomWkb, merge = buildWay(tags, data, outputGeom)
+                records.append((feature, 'way', osmId, attributes, geomWkb, merge))
+            else:
+                geomWkb, merge = buildRelation(data, outputGeom)
+                records.append((feature, 'rel', osmId, attributes, geomWkb, merge))
+    return records
+
+
+def split(jobs:list, nChunks:int) -> list:
+    """ Splits jobs into at most nChunks lists of consecutive jobs. """
+    size = max(1, -(-len(jobs) // nChunks))
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+def run(jobs:list, spec:dict, processes:int):
+    """
+    Builds the features of jobs in processes worker processes, or in this process if there are few jobs.
+    Yields the records of every chunk as it is done, see parseChunk.
+    Workers that have not started are cancelled when the generator is closed.
+    """
+    if processes <= 1 or len(jobs) < MIN_JOBS:
+        initWorker(spec)
+        yield parseChunk(jobs)
+        return
+
+    # Forking a process running Qt is not safe, the workers are started as new interpreters
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(pythonExecutable())
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=initWorker, initargs=(spec,))
+    try:
+        futures = [executor.submit(parseChunk, chunk) for chunk in split(jobs, processes * CHUNKS_PER_PROCESS)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,8 +1,5 @@
 #%%
 from qgis.core import ( QgsVectorLayer,
-                        QgsLineString,
-                        QgsMultiLineString,
-                        QgsPointXY,
                         QgsPoint,
                         QgsGeometry,
                         QgsField,
@@ -17,6 +14,14 @@ from qgis.PyQt.QtWidgets import QProgressDialog, QProgressBar
 
 
 from .utilities.tools import getGroupNameFromFeature, getLayerNameFromFeature
+from .stream import Node, Way, Relation, Member, OSM_TYPES, fromOverpyResult, fromOverpyRelation
+from .nodestore import NodeStore, WayStore
+from .multipolygon import assemble, ringCentroid
+from . import parallel
+from . import wkb
+
+from collections import Counter
+import os
 
 import overpy
 
@@ -25,18 +30,33 @@ try:
 except ValueError:
     from settings.config import Config
 
+class ParseCancelled(Exception):
+    """ Raised by Parser.parse when its feedback reports that the run has been cancelled. """
+
+
 class Parser:
-    def __init__(self, config:Config = Config(), outLoc:str = None):
+    FEEDBACK_INTERVAL = 1000 # Elements parsed between progress reports and cancellation checks
+    BATCH_SIZE = 5000 # Features buffered per layer before they are added to its data provider
+
+    def __init__(self, config:Config = None, outLoc:str = None):
         self.__hasOutLoc:bool = False
         self.outLoc:str = outLoc
         self.__hasProject:bool = False
         self.project:QgsProject = None
-        self.CONFIG:Config = config
+        # Loaded here rather than as the default argument, which would read the configuration on import
+        self.CONFIG:Config = config if config is not None else Config()
         self.__createdGroups:list = []
         self.fid = 0
 
         self.qgsLyrs:dict = {}
-        self.qgsFields:dict = {}
+        self.qgsFields:dict = {} # QgsFields of the layer of every feature, built once
+        self.qgsGeomTypes:dict = {} # Memory provider geometry type of the layer of every feature
+        self.onlyFeatures:set = None
+        self.feedback = None
+        self.parsedIds:set = None # (type, id, feature) of the objects added to the layers, only kept while merging, see parse
+        self.pending:dict = {} # Features waiting to be added, with the feature as key
+        self.processes:int = 1
+        self.output = None # core.output.GeoPackageOutput the features are streamed to
         
         self.createQgsLayers()
 
@@ -51,80 +71,121 @@ class Parser:
             self.__hasOutLoc = False
         self.outLoc = outLoc
     
+    def setFeedback(self, feedback):
+        """ 
+        feedback is an object with isCanceled() and parsed(count) methods, such as tasks.ExtractionTask. 
+        parse reports the number of parsed elements to it and stops with ParseCancelled when it is canceled. 
+        """
+        self.feedback = feedback
+
+    def setProcesses(self, processes:int):
+        """ 
+        Sets the number of worker processes that build the geometries of ways and relations, see core.parallel. 
+        1 parses in this process only, None uses one process per core. 
+        """
+        self.processes = processes if processes is not None else os.cpu_count()
+
+    def setOutput(self, output):
+        """ 
+        Streams the parsed features to output, a core.output.GeoPackageOutput, in batches instead of keeping them in the layers. 
+        Features that are buffered after parsing are still kept in their layers. None keeps all features in the layers. 
+        """
+        self.output = output
+
+    def isStreamed(self, feature:str) -> bool:
+        """ Returns True if the features of feature are written to the output instead of kept in its layer. """
+        return self.output is not None and feature not in self.CONFIG.bufferSettings
+
     def setProject(self, project:QgsProject):
         self.__hasProject = True
         self.project = project
 
     def createQgsLayers(self) -> None:
         """ 
-        creates QgsVectorLayers for each output feature.
+        creates new, empty QgsVectorLayers for each output feature.
         Creates the following properties:
             self.qgsLayers:  a dictionary with the layer names as keys and a QgsLayer as value
+        The dictionary is replaced, so layers returned by an earlier parse are not changed. 
+        The field schemas are built on the first call and reused. 
         """
+        if len(self.qgsFields) == 0:
+            self.createSchemas()
 
+        crs = QgsCoordinateReferenceSystem("EPSG:4326")
+        qgsLyrs = {}
         for feature in self.CONFIG.features:
             name = getLayerNameFromFeature(feature)
+            vl = QgsVectorLayer(self.qgsGeomTypes[feature], name, "memory")
+            vl.setCrs(crs)
+            vl.dataProvider().addAttributes(self.qgsFields[feature].toList())
+            vl.updateFields()
+
+            if not vl or not vl.isValid:
+                print(f"layer {feature} was not created")
+
+            qgsLyrs[feature] = vl
+        self.qgsLyrs = qgsLyrs
+
+
+    def createSchemas(self) -> None:
+        """ Builds the geometry type and fields of the layer of every feature from the configuration. """
+        for feature in self.CONFIG.features:
             outGeom = self.CONFIG.configJson[feature]['outputGeom']
             if outGeom == 'point':
-                vl = QgsVectorLayer("Point", name, "memory")
+                self.qgsGeomTypes[feature] = "Point"
             elif outGeom == 'line':
-                vl = QgsVectorLayer("LineString", name, "memory")
+                self.qgsGeomTypes[feature] = "LineString"
             elif outGeom == 'polygon':
                 if feature in self.CONFIG.bufferSettings.keys():
-                    vl = QgsVectorLayer("LineString", name, "memory")
+                    self.qgsGeomTypes[feature] = "LineString"
                 else:
-                    vl = QgsVectorLayer("Polygon", name, "memory")
-
-            crs = QgsCoordinateReferenceSystem("EPSG:4326")
-            vl.setCrs(crs)
-            pr = vl.dataProvider()
-            columns = [QgsField("OSM id", QVariant.Int)]
-            tags = [QgsField(tag, QVariant.String) for tag in self.CONFIG.configJson[feature]['outputTags']]
-            columns.extend(tags)
-            pr.addAttributes(columns)
-            vl.updateFields()
-
-            if not vl or not vl.isValid:
-                print(f"layer {feature} was not created")
+                    self.qgsGeomTypes[feature] = "Polygon"
 
-            self.qgsLyrs[feature] = vl
+            fields = QgsFields()
+            fields.append(QgsField("OSM id", QVariant.LongLong))
+            fields.append(QgsField("OSM type", QVariant.String))
+            for tag in self.CONFIG.configJson[feature]['outputTags']:
+                fields.append(QgsField(tag, QVariant.String))
+            self.qgsFields[feature] = fields
 
 
-    def isRelevant(self, osmFeat: overpy.Result, confFeature: dict) -> bool:
+    def reset(self) -> None:
         """
-        Checks if the tags of osmFeat are relevant for parsing.
-
-        params:
-            osmFeat - a overpy relation, way or node object which tags to check for relevance
-            confFeature - the attribute of CONFIG the osmFeat should be checked against
-        ret:
-            returns True if the feature is relevant
+        Starts a new run on the same configuration: the next parse fills new, empty layers, 
+        and objects parsed before are no longer skipped. Layers returned earlier are not changed. 
         """
-
-        relevant = False
-        for key in confFeature['inputTags'].keys():
-            try:
-                if osmFeat.tags[key] in confFeature['inputTags'][key]:
-                    relevant = True
-            except KeyError:
-                pass
-        return relevant
+        self.parsedIds = None
+        self.pending = {}
+        self.onlyFeatures = None
+        self.createQgsLayers()
 
 
     def getFeatures(self, obj:overpy.Result) -> list:
         """
         Gets the freatures that the obj is part of. 
+        Looks up every tag of obj in CONFIG.tagIndex, so the returned features are already relevant. 
 
         param obj: relation, way or node of an overpy result object. 
-        ret: list of the features the object is part relevant for according to config file. 
+        ret: list of the features the object is relevant for according to config file, in the order of CONFIG.features. 
         """
-        features = []
-        for tag in obj.tags.keys():
-            try: 
-                features.extend(self.CONFIG.reversedTags[tag])
-            except KeyError:
+        tagIndex = self.CONFIG.tagIndex
+        matched = None
+        for tag in obj.tags.items():
+            features = tagIndex.get(tag)
+            if features is None:
                 continue
-        return features
+            if matched is None:
+                matched = features
+            else:
+                matched = set(matched).union(features)
+
+        if matched is None:
+            return []
+        if self.onlyFeatures is not None:
+            matched = set(matched).intersection(self.onlyFeatures)
+        if isinstance(matched, tuple):
+            return list(matched)
+        return [feature for feature in self.CONFIG.features if feature in matched]
 
 
     def createQgsFeature(self, obj:overpy.Result, feature:str) -> QgsFeature:
@@ -145,18 +206,20 @@ class Parser:
         fields = self.qgsLyrs[feature].fields()
         f = QgsFeature(fields)
         f['OSM id'] = obj.id
+        f['OSM type'] = OSM_TYPES[type(obj)]
         for key in obj.tags.keys(): 
             if key in outTags:
                 f[key] = obj.tags[key]
         return f
 
 
-    def addQgsFeatures(self, lyr:QgsVectorLayer, feat:QgsFeature) -> bool:
+    def addQgsFeatures(self, lyr:QgsVectorLayer, feat:QgsFeature, updateExtents:bool = True) -> bool:
         """ 
         Helper functions that adds a feature to a layers data provider and updates the layer
         param: 
             lyr: a QgsVectorLayer to which the feature should be added
             feat: a list of QgsFeature objects to be added to the layer
+            updateExtents: set to False when adding many batches, and update the extent once after the last one
         ret: tuple (exitFlag: bool, nSuccess: int, nFailed: int)
             exitFlag: True if all features in feat was added successfully. 
             nSuccess: number of features added
@@ -169,311 +232,517 @@ class Parser:
             return False, 0, len(feat)
 
         pr = lyr.dataProvider()
-        countBefore = pr.featureCount()
-
-        res, lyrFeatures = pr.addFeatures(filteredFeat)
-        lyr.updateExtents()
+        res, _ = pr.addFeatures(filteredFeat)
+        if updateExtents:
+            lyr.updateExtents()
 
-        countAfter = pr.featureCount()
-        nSucsess = countAfter - countBefore
-        nFailed = len(lyrFeatures) - nSucsess
+        # Providers add either all or none of the features
+        nSucsess = len(filteredFeat) if res else 0
+        nFailed = len(feat) - nSucsess
 
         return res, nSucsess, nFailed
 
 
-
-    def mergeLineGeoms(self, *args:QgsGeometry)-> QgsGeometry:
+    def queueFeature(self, feature:str, feat:QgsFeature) -> bool:
         """
-        adds multiple polyline geometries into one geometry and tries to merges them.
+        Buffers feat to be added to the layer of feature in the next batch. 
+        Full batches are added at once, the rest by flush at the end of parse. 
 
-        param: 
-            type: QgsGeometry objects of linestring och polyline type
-            val: lines to be collected into one geometry. 
-        ret: 
-            type: QgsGeometry of linestring or multlinestring type
-            val: all input lines, merged to as few lines as possible. 
+        ret: False if the geometry of feat does not match the layer and feat was dropped, otherwise True. 
         """
-        mls = QgsMultiLineString()
-        for line in args:
-            mls.addGeometry(QgsLineString(line.asPolyline()))
-        return QgsGeometry(mls).mergeLines()
+        lyr = self.qgsLyrs[feature]
+        if feat.geometry().type() != lyr.geometryType():
+            return False
+
+        batch = self.pending.setdefault(feature, [])
+        batch.append(feat)
+        if len(batch) >= self.BATCH_SIZE:
+            self.flush(feature)
+        return True
+
+
+    def flush(self, feature:str = None) -> None:
+        """ Adds the buffered features of feature, or of all features, to their layers or streams them to the output. """
+        features = [feature] if feature is not None else list(self.pending.keys())
+        for feature in features:
+            batch = self.pending.pop(feature, [])
+            if len(batch) == 0:
+                continue
+            if self.isStreamed(feature):
+                success = self.output.addFeatures(feature, self.qgsLyrs[feature], batch)
+                nFailed = 0 if success else len(batch)
+            else:
+                success, _, nFailed = self.addQgsFeatures(self.qgsLyrs[feature], batch, updateExtents=False)
+            if not success:
+                print(f"{nFailed} features could not be added to {feature}")
+                self.failedLayers.append(feature)
+
+
+
+    def geometryFromWkb(self, data:bytes) -> QgsGeometry:
+        """ Creates a QgsGeometry from WKB written by core.wkb. This is the only place geometries of parsed objects enter QGIS. """
+        geom = QgsGeometry()
+        geom.fromWkb(data)
+        return geom
 
 
-    def checkForPolygon(self, osmFeat:overpy.Result, geom:QgsGeometry) -> bool:
+    def checkForPolygon(self, osmFeat:overpy.Result, coords) -> bool:
         """
         Checks if a way should be considered a polygon.
         
         params:
             osmFeat: the overpy way or relation that should is checked
-            geom: the QgsGeometry of the object that is being checked. 
+            coords: the (lon, lat) of the nodes of the object that is being checked. 
         
         returns true if it should be a polygon, otherwise false.
 
         logic is retrieved from https://wiki.openstreetmap.org/wiki/Overpass_turbo/Polygon_Features and is the same as overpass turbo
         uses polygon-features JSON which is developed by "tyrasd", available here: https://github.com/tyrasd/osm-polygon-features/blob/master/polygon-features.json 
         """
-        pl = geom.asPolyline()
-        if pl[0] == pl[-1]:
-            try: 
-                if osmFeat.tags['area'] == 'no':
-                    return False
-            except KeyError:
-                pass
-
-            for filter in self.CONFIG.polygonFeatures:
-                polygon = filter['polygon']
-                key = filter['key']
-                if polygon == 'all':
-                    if key in osmFeat.tags:
-                        return True # this is a polygon
-                elif polygon == 'whitelist':
-                    if key in osmFeat.tags:
-                        if osmFeat.tags[key] in filter['values']:
-                            return True # This is a polygon
-                elif polygon == 'blacklist':
-                    if key in osmFeat.tags:
-                        if osmFeat.tags[key] not in filter['values']:
-                            return True # This is a polygon
-        else: 
+        if tuple(coords[0]) != tuple(coords[-1]):
             return False
+        if osmFeat.tags.get('area') == 'no':
+            return False
+
+        # The rules are compiled per key by Config, so only the tags of the object are looked at
+        isPolygonTag = self.CONFIG.isPolygonTag
+        for key, value in osmFeat.tags.items():
+            if isPolygonTag(key, value):
+                return True # This is a polygon
+        return False
 
 
 
-    def parse(self, res:overpy.Result) -> dict:
+    def parse(self, res, features:list = None, merge:bool = False) -> dict:
         """
         parse parses osm response to dictionary containing QgsVectorLayers
         Each vector layer refers to one feature, specified by the key.
+        Calling parse again adds to the same layers, so per feature queries can be parsed one after the other. 
+        Results that share objects, such as overlapping tiles, are parsed with merge, see parseMany. 
+        Call reset first to parse into new layers. 
 
         params:
-            res is a overpy result object containing all objects from OSM. 
+            res is a overpy result object containing all objects from OSM, 
+            or an iterable of Node, Way and Relation records from core.stream with nodes before ways before relations, 
+            such as Query.streamGet. Records are parsed as they are read. 
+            features: only parse for these features, e.g. when res is the result of a query for these features only. Defaults to all. 
+            merge: True remembers the objects added to the layers, by every parse with merge since the last reset, 
+                and skips them when they are in res again. False does not keep them, so memory does not grow with the output. 
         ret:
             output is a dictionary of QgsVectorLayers
         """
+        self.onlyFeatures = set(features) if features is not None else None
+        if not merge:
+            self.parsedIds = None
+        elif self.parsedIds is None:
+            self.parsedIds = set()
+        # The relations are known before parsing starts unless res is streamed, 
+        # then only the ways the relevant relations refer to are kept for them. 
+        if isinstance(res, overpy.Result):
+            elements = fromOverpyResult(res)
+            needed = self.neededWays(fromOverpyRelation(relation) for relation in res.relations)
+        elif isinstance(res, (list, tuple)):
+            elements = res
+            needed = self.neededWays(element for element in res if type(element) is Relation)
+        else:
+            elements = res
+            needed = None
+
+        self.stats = {key: 0 for key in ['nodesParsed', 'nodeSuccess', 'nodeFailed', 'waysParsed', 'waySuccess', 'wayFailed', 'relsParsed', 'relSuccess', 'relFailed']}
+        self.failedLayers = []
+
+        nodeGeoms = NodeStore()
+        wayGeoms = WayStore(nodeGeoms, needed)
+        jobs = [] if self.processes > 1 else None # Ways and relations for the worker processes
+        current = None
+        try:
+            for count, element in enumerate(elements):
+                if self.feedback is not None and count % self.FEEDBACK_INTERVAL == 0:
+                    if self.feedback.isCanceled():
+                        raise ParseCancelled()
+                    self.feedback.parsed(count)
+                elementType = type(element)
+                if elementType is not current:
+                    current = elementType
+                    print(f"Parsing {elementType.__name__}s", end="\r")
+
+                if elementType is Node:
+                    self.parseNode(element, nodeGeoms)
+                elif elementType is Way:
+                    if jobs is None:
+                        self.parseWay(element, nodeGeoms, wayGeoms)
+                    else:
+                        self.collectWay(element, nodeGeoms, wayGeoms, jobs)
+                elif elementType is Relation:
+                    if jobs is None:
+                        self.parseRelation(element, nodeGeoms, wayGeoms)
+                    else:
+                        self.collectRelation(element, nodeGeoms, wayGeoms, jobs)
+
+            if jobs:
+                self.parseJobs(jobs)
+            self.buildCollected()
+            self.flush()
+            for lyr in self.qgsLyrs.values():
+                lyr.updateExtents()
+        finally:
+            self.pending = {}
+            if hasattr(elements, 'close'):
+                elements.close() # Stops the download of a stream that is cancelled
+
+        stats = self.stats
+        print(f"Statistics Nodes:\n\tnodes parsed: {stats['nodesParsed']}\n\tsuccess: {stats['nodeSuccess']}\n\tfailed: {stats['nodeFailed']}")
+        print(f"Statistics Ways:\n\tways parsed: {stats['waysParsed']}\n\tsuccess: {stats['waySuccess']}\n\tfailed: {stats['wayFailed']}")
+        print(f"Statistics Relations\n\trelations parsed: {stats['relsParsed']}\n\tsuccess: {stats['relSuccess']}\n\tfailed: {stats['relFailed']}")
+        print(f"Statistics Total\n\tparsed: {stats['nodesParsed']+stats['waysParsed']+stats['relsParsed']}\n\tsuccess: {stats['nodeSuccess']+stats['waySuccess']+stats['relSuccess']}\n\tfailed: {stats['nodeFailed']+stats['wayFailed']+stats['relFailed']}")
+        print(set(self.failedLayers))
+        return self.qgsLyrs
+
 
-        nodesParsed = 0
-        waysParsed = 0
-        relsParsed = 0
-        nodeSuccess = 0
-        nodeFailed = 0
-        waySuccess = 0
-        wayFailed = 0
-        relSuccess = 0
-        relFailed = 0
-        validNodes = 0
-
-        failedLayers = []
-
-        #layers = self.createQgsLayers()
-
-        print("Parsing Nodes", end="\r")
-        nodeGeoms = {}
-        nodeQgsFeatures = {}
-        for node in res.nodes:
-            nodeGeoms[node.id] = QgsPointXY(node.lon, node.lat)
-            if node.id == 5684222890:
-                print("Found the taxi!")
-
-            # try: 
-            #     if node.tags['natural'] != "tree":
-            #         continue
-            # except KeyError:
-            #     continue
-
-            features = self.getFeatures(node) #list of features the node is part of. 
-            if len(features) == 0:
+    def neededWays(self, relations) -> Counter:
+        """ Counts the references to every way from the relations that are relevant for any feature. """
+        needed = Counter()
+        for relation in relations:
+            if len(self.getFeatures(relation)) == 0:
                 continue
-            
-            for feature in features:
-                if not self.isRelevant(node,self.CONFIG.configJson[feature]):
-                    continue
-                
-                # print("parsing {} feature".format(feature))
+            for member in relation.members:
+                if member.type == 'way' and member.coords is None:
+                    needed[member.ref] += 1
+        return needed
 
-                qPointF = self.createQgsFeature(node, feature)
-                pointGeom = QgsGeometry.fromPointXY(nodeGeoms[node.id])
-                # pointGeom = QgsGeometry(QgsPoint(node.lon, node.lat))
 
-                qPointF.setGeometry(pointGeom)
+    def parseMany(self, results, merge:bool = False, features:list = None):
+        """
+        Parses a sequence of results, e.g. one per bounding box, with the same configuration and field schemas. 
 
-                geosValid = qPointF.geometry().isGeosValid()
-                qPointF.setGeometry(qPointF.geometry().centroid())
-                featureValid = qPointF.isValid()
+        params:
+            results: iterable of anything parse accepts
+            merge: False parses every result into its own new layers, 
+                True parses all results into the same new layers, objects in several results are added once. 
+            features: only parse for these features, see parse. 
+        ret:
+            with merge False a list with one dictionary of QgsVectorLayers per result, 
+            with merge True one dictionary of QgsVectorLayers. 
+        """
+        if merge:
+            self.reset()
+            for res in results:
+                self.parse(res, features, merge=True)
+            return self.qgsLyrs
 
-                # if feature not in nodeQgsFeatures.keys():
-                #     nodeQgsFeatures[feature] = []
-                # nodeQgsFeatures[feature].append(qPointF)
+        outputs = []
+        for res in results:
+            self.reset()
+            outputs.append(self.parse(res, features))
+        return outputs
 
-                success, _, _ = self.addQgsFeatures(self.qgsLyrs[feature], [qPointF])
-                if success:
-                    nodeSuccess += 1
-                else:
-                    nodeFailed += 1
-                    failedLayers.append(feature)
 
-            nodesParsed += 1
-        
-        # for feature in nodeQgsFeatures.keys():
-        #     success, nSuccess, nFalied = self.addQgsFeatures(self.qgsLyrs[feature], nodeQgsFeatures[feature])
-        #     if success:
-        #         nodeSuccess += nSuccess
-        #     else:
-        #         nodeFailed += nFalied
-        #         nodeSuccess += nSuccess
-        #         failedLayers.append(feature)
-    
-        print("Parsing Ways ", end="\r")
-        wayGeoms = {}
-        for way in res.ways:
-            points = [QgsPointXY(node.lon, node.lat) for node in way.nodes]
-            wayGeoms[way.id] = QgsGeometry.fromPolylineXY(points)
-
-            features = self.getFeatures(way)
-            if len(features) == 0:
+    def isParsed(self, elementType:str, osmId:int, feature:str) -> bool:
+        """ 
+        Returns True if the object was already added to the layer of feature, otherwise marks it as added. 
+        Always False when parse is not merging, the objects of one result are unique. 
+        """
+        if self.parsedIds is None:
+            return False
+        key = (elementType, osmId, feature)
+        if key in self.parsedIds:
+            return True
+        self.parsedIds.add(key)
+        return False
+
+
+    def countResult(self, success:bool, prefix:str, feature:str) -> None:
+        """ Updates the parse statistics with the outcome of adding one feature. """
+        if success:
+            self.stats[prefix+'Success'] += 1
+        else:
+            self.stats[prefix+'Failed'] += 1
+            self.failedLayers.append(feature)
+
+
+    def parseNode(self, node:Node, nodeGeoms:NodeStore) -> None:
+        """
+        Stores the position of node in nodeGeoms and adds it to the layers of the features it is relevant for. 
+        """
+        nodeGeoms.add(node.id, node.lon, node.lat)
+
+        features = self.getFeatures(node) #list of features the node is part of. 
+        if len(features) == 0:
+            return
+
+        pointWkb = wkb.point((node.lon, node.lat))
+        for feature in features:
+            if self.isParsed('node', node.id, feature):
                 continue
 
-            for feature in features: 
-                if not self.isRelevant(way,self.CONFIG.configJson[feature]):
-                    continue
+            qPointF = self.createQgsFeature(node, feature)
+            qPointF.setGeometry(self.geometryFromWkb(pointWkb))
 
-                qLineF = self.createQgsFeature(way, feature)
-                line = wayGeoms[way.id]
-                # print("3", line)
-                if self.checkForPolygon(way, line):
-                    pollyCollection = QgsGeometry.polygonize([line])
-                    outGeom = QgsGeometry.collectGeometry(pollyCollection.asGeometryCollection())
-                    if self.CONFIG.configJson[feature]['outputGeom'] == 'point':
-                        qLineF.setGeometry(outGeom.centroid())
-                    else:
-                        qLineF.setGeometry(QgsGeometry(outGeom))
+            success = self.queueFeature(feature, qPointF)
+            self.countResult(success, 'node', feature)
+
+        self.stats['nodesParsed'] += 1
+
+
+    def parseWay(self, way:Way, nodeGeoms:NodeStore, wayGeoms:WayStore) -> None:
+        """
+        Keeps way in wayGeoms for the relations that refer to it and adds it to the layers of the features it is relevant for. 
+        The geometry is only built if the way is relevant, from its inline coordinates or from nodeGeoms. 
+        Ways with nodes that are missing from nodeGeoms are counted as failed. 
+        """
+        wayGeoms.add(way)
+
+        features = self.getFeatures(way)
+        if len(features) == 0:
+            return
+
+        if way.coords is not None:
+            # Inline geometry (out geom), relations carry their own member coordinates. 
+            coords = way.coords
+        else:
+            try:
+                coords = nodeGeoms.lonLat(way.nodeIds)
+            except KeyError: # A node outside the extract, e.g. of a way that crosses its boundary
+                for feature in features:
+                    self.countResult(False, 'way', feature)
+                return
+        isPolygon = self.checkForPolygon(way, coords)
+
+        for feature in features: 
+            if self.isParsed('way', way.id, feature):
+                continue
+
+            qLineF = self.createQgsFeature(way, feature)
+            if isPolygon:
+                if self.CONFIG.configJson[feature]['outputGeom'] == 'point':
+                    geomWkb = wkb.point(ringCentroid(coords))
                 else:
-                        qLineF.setGeometry(line)
+                    geomWkb = wkb.polygon([coords])
+            else:
+                geomWkb = wkb.lineString(coords)
+            qLineF.setGeometry(self.geometryFromWkb(geomWkb))
+
+            success = self.queueFeature(feature, qLineF)
+            self.countResult(success, 'way', feature)
+
+        self.stats['waysParsed'] += 1
+
 
-                success = self.addQgsFeatures(self.qgsLyrs[feature], [qLineF])
-                if success:
-                    waySuccess += 1
+    def memberPoint(self, member:Member, nodeGeoms:NodeStore) -> tuple:
+        """ Returns the (lon, lat) of a node member from its inline coordinates or from nodeGeoms. """
+        if member.coords is not None:
+            return member.coords[0]
+        return nodeGeoms.point(member.ref)
+
+
+    def memberCoords(self, member:Member, wayGeoms:WayStore) -> list:
+        """ Returns the (lon, lat) of a way member from its inline coordinates or from wayGeoms, or None if the way is missing. """
+        if member.coords is not None:
+            return member.coords
+        try:
+            return wayGeoms.coords(member.ref)
+        except KeyError:
+            return None
+
+
+    def buildPolygons(self, relation:Relation, wayGeoms:WayStore) -> QgsGeometry:
+        """
+        Builds the multipolygon of relation by joining its member ways into rings, see core.multipolygon. 
+        Members without a role are treated as outer members. Returns None if no ring could be closed. 
+        """
+        outerWays = []
+        innerWays = []
+        for member in relation.members:
+            if member.type != 'way':
+                continue
+            coords = self.memberCoords(member, wayGeoms)
+            if coords is None:
+                continue
+            if member.role == "inner":
+                innerWays.append(coords)
+            else:
+                outerWays.append(coords)
+
+        polygons, nUnclosed = assemble(outerWays, innerWays)
+        if nUnclosed > 0:
+            print(f"relation {relation.id}: {nUnclosed} rings could not be closed")
+        if len(polygons) == 0:
+            return None
+        return self.geometryFromWkb(wkb.multiPolygon(polygons))
+
+
+    def collectWay(self, way:Way, nodeGeoms:NodeStore, wayGeoms:WayStore, jobs:list) -> None:
+        """ Like parseWay, but adds the way with its coordinates to jobs for the worker processes instead of building it. """
+        wayGeoms.add(way)
+
+        features = self.getFeatures(way)
+        if len(features) == 0:
+            return
+        features = tuple(feature for feature in features if not self.isParsed('way', way.id, feature))
+        if len(features) > 0:
+            try:
+                coords = way.coords if way.coords is not None else nodeGeoms.coords(way.nodeIds)
+            except KeyError: # A node outside the extract
+                for feature in features:
+                    self.countResult(False, 'way', feature)
+                return
+            jobs.append(('way', way.id, way.tags, features, coords))
+        self.stats['waysParsed'] += 1
+
+
+    def collectRelation(self, relation:Relation, nodeGeoms:NodeStore, wayGeoms:WayStore, jobs:list) -> None:
+        """ Like parseRelation, but adds the relation with the coordinates of its members to jobs for the worker processes. """
+        features = self.getFeatures(relation)
+        if len(features) == 0:
+            return
+        features = tuple(feature for feature in features if not self.isParsed('relation', relation.id, feature))
+        if len(features) > 0:
+            members = []
+            for member in relation.members:
+                if member.type == 'way':
+                    coords = self.memberCoords(member, wayGeoms)
+                elif member.type == 'node':
+                    try:
+                        coords = member.coords if member.coords is not None else (nodeGeoms.point(member.ref),)
+                    except KeyError:
+                        coords = None
                 else:
-                    wayFailed += 1
-                    failedLayers.append(feature)
-            
-            waysParsed += 1
-
-        print("Parsing Relations", end="\r")
-        iter = 0
-        for relation in res.relations: 
-            iter +=1
-            # print("parsing realtion",iter, "id =",relation.id)
-            features = self.getFeatures(relation)
-            if len(features) == 0:
+                    continue
+                members.append((member.type, member.role, coords))
+            jobs.append(('relation', relation.id, relation.tags, features, tuple(members)))
+
+        for member in relation.members:
+            if member.type == 'way' and member.coords is None:
+                wayGeoms.release(member.ref)
+        self.stats['relsParsed'] += 1
+
+
+    def buildCollected(self) -> None:
+        """ Called by parse before the last batches are flushed. Parser builds every geometry as it is parsed, engines that build them in bulk do it here. """
+
+
+    def parseJobs(self, jobs:list) -> None:
+        """ Builds the features of the collected ways and relations in worker processes and adds them to the layers. """
+        spec = parallel.workerSpec(self.CONFIG)
+        chunks = parallel.run(jobs, spec, self.processes)
+        try:
+            for records in chunks:
+                if self.feedback is not None and self.feedback.isCanceled():
+                    raise ParseCancelled()
+                self.addRecords(records)
+        finally:
+            chunks.close()
+
+
+    def addRecords(self, records:list) -> None:
+        """ Adds the features built by core.parallel.parseChunk to the layers. """
+        for feature, prefix, osmId, attributes, geomWkb, merge in records:
+            if geomWkb is None:
+                self.countResult(False, prefix, feature)
                 continue
+            geom = self.geometryFromWkb(geomWkb)
+            if merge:
+                geom = geom.mergeLines()
 
-            for feature in features: 
-                if not self.isRelevant(relation, self.CONFIG.configJson[feature]):
-                    continue
-                
-                qRelF = self.createQgsFeature(relation, feature)
+            f = QgsFeature(self.qgsLyrs[feature].fields())
+            f.setAttributes(attributes)
+            f.setGeometry(geom)
+            success = self.queueFeature(feature, f)
+            self.countResult(success, prefix, feature)
 
 
-                if self.CONFIG.configJson[feature]['outputGeom'] == 'point':
-                    p = []
-                    for member in relation.members:
-                        if member._type_value != 'node':
-                            continue
-                        p.append(nodeGeoms[member.ref])
-                    
-                    qRelF.setGeometry(QgsGeometry.fromMultiPointXY(p))
-
-                    
-                    self.addQgsFeatures(self.qgsLyrs[feature], [qRelF])
-
-
-                elif self.CONFIG.configJson[feature]['outputGeom'] == 'line':
-                    lines = []
-                    for member in relation.members:
-                        if member._type_value != 'way':
-                            continue
-                        lines.append(wayGeoms[member.ref])
-                    
-                    outGeom = self.mergeLineGeoms(*lines)
-                    qRelF.setGeometry(outGeom)
-                    self.addQgsFeatures(self.qgsLyrs[feature], [qRelF])
-
-                elif self.CONFIG.configJson[feature]['outputGeom'] == 'polygon':
-                    soloMembers = []
-                    innerMembers = []
-                    outerMembers = []
-                    for member in relation.members:
-                        if member._type_value != 'way':
-                            continue
-                        line = wayGeoms[member.ref]
-                        if member.role == "outer":
-                            outerMembers.append(line)
-                        elif member.role == "inner":
-                            innerMembers.append(line)
-                        else:
-                            soloMembers.append(line)
-                    
-                    soloPolyCollection = QgsGeometry.polygonize(soloMembers)
-                    innerPolyCollection = QgsGeometry.polygonize(innerMembers)
-                    outerPolyCollection = QgsGeometry.polygonize(outerMembers)
-
-                    soloMultiPoly = QgsGeometry.collectGeometry(soloPolyCollection.asGeometryCollection())
-                    innerMultiPoly = QgsGeometry.collectGeometry(innerPolyCollection.asGeometryCollection())
-                    outerMultiPoly = QgsGeometry.collectGeometry(outerPolyCollection.asGeometryCollection())
-
-                    if len(innerMembers) > 0: #If inner members, subtract these from outer members.
-                        holeMultiPoly = outerMultiPoly.difference(innerMultiPoly)
-                    elif len(outerMembers) > 0: #outer members but no inner members
-                        holeMultiPoly = outerMultiPoly
-                    else: # Neither inner nor outer. Making sure holePolyCollection is empty
-                        holeMultiPoly = outerMultiPoly
-
-                    outGeom = QgsGeometry.collectGeometry([holeMultiPoly,soloMultiPoly])
-
-                    qRelF.setGeometry(outGeom)
-                    success = self.addQgsFeatures(self.qgsLyrs[feature], [qRelF])
-                    if success:
-                        relSuccess += 1
-                    else:
-                        relFailed += 1
-                        failedLayers.append(feature)
-            
-            relsParsed += 1
+    def parseRelation(self, relation:Relation, nodeGeoms:NodeStore, wayGeoms:WayStore) -> None:
+        """
+        Builds the geometry of relation from the inline coordinates of its members or from nodeGeoms and wayGeoms 
+        and adds it to the layers of the features it is relevant for. 
+        """
+        features = self.getFeatures(relation)
+        if len(features) == 0:
+            return
 
-        print(f"Statistics Nodes:\n\tnodes parsed: {nodesParsed}\n\tsuccess: {nodeSuccess}\n\tfailed: {nodeFailed}\n\tvalid: {validNodes}")
-        print(f"Statistics Ways:\n\tways parsed: {waysParsed}\n\tsuccess: {waySuccess}\n\tfailed: {wayFailed}")
-        print(f"Statistics Relations\n\trelations parsed: {relsParsed}\n\tsuccess: {relSuccess}\n\tfailed: {relFailed}")
-        print(f"Statistics Total\n\tparsed: {nodesParsed+waysParsed+relsParsed}\n\tsuccess: {nodeSuccess+waySuccess+relSuccess}\n\tfailed: {nodeFailed+wayFailed+relFailed}")
-        print(set(failedLayers))
-        return self.qgsLyrs
+        for feature in features: 
+            if self.isParsed('relation', relation.id, feature):
+                continue
+            
+            qRelF = self.createQgsFeature(relation, feature)
+
+            if self.CONFIG.configJson[feature]['outputGeom'] == 'point':
+                p = []
+                for member in relation.members:
+                    if member.type != 'node':
+                        continue
+                    try:
+                        p.append(self.memberPoint(member, nodeGeoms))
+                    except KeyError: # Nodes outside the extract are left out like missing ways
+                        continue
+                if len(p) == 0:
+                    self.countResult(False, 'rel', feature)
+                    continue
+                
+                qRelF.setGeometry(self.geometryFromWkb(wkb.multiPoint(p)))
+                self.queueFeature(feature, qRelF)
+
+            elif self.CONFIG.configJson[feature]['outputGeom'] == 'line':
+                lines = []
+                for member in relation.members:
+                    if member.type != 'way':
+                        continue
+                    coords = self.memberCoords(member, wayGeoms)
+                    if coords is not None:
+                        lines.append(coords)
+                
+                outGeom = self.geometryFromWkb(wkb.multiLineString(lines)).mergeLines()
+                qRelF.setGeometry(outGeom)
+                self.queueFeature(feature, qRelF)
+
+            elif self.CONFIG.configJson[feature]['outputGeom'] == 'polygon':
+                outGeom = self.buildPolygons(relation, wayGeoms)
+                if outGeom is None:
+                    self.countResult(False, 'rel', feature)
+                    continue
 
+                qRelF.setGeometry(outGeom)
+                success = self.queueFeature(feature, qRelF)
+                self.countResult(success, 'rel', feature)
         
-    def buffer(self, layer: QgsVectorLayer, feature:str) -> QgsGeometry:
-        """
-        Buffer ads a buffer for the input feature based on a mapping setting the buffer radii for each tag value
+        for member in relation.members:
+            if member.type == 'way' and member.coords is None:
+                wayGeoms.release(member.ref)
+        self.stats['relsParsed'] += 1
+
         
-        param val: 
-            layer: the QgsVectorLayer object to be buffered. 
-            feature: The feature that is being buffered. Used to save the buffered layer and to find bufferring settings from CONFIG
-        ret val: a QgsGeometry of type polygon. 
-        """
+    def createBufferLayer(self, feature:str) -> QgsVectorLayer:
+        """ Returns an empty polygon layer in CONFIG.projectedCrs with the fields of feature, for its buffered features. """
         name = getLayerNameFromFeature(feature)
-        bufferScheme = self.CONFIG.bufferSettings[feature]
-
         vl = QgsVectorLayer("Polygon", name, "memory")
 
         crs = QgsCoordinateReferenceSystem(self.CONFIG.projectedCrs)
         vl.setCrs(crs)
         pr = vl.dataProvider()
-        columns = [QgsField("OSM id", QVariant.Int)]
+        columns = [QgsField("OSM id", QVariant.LongLong), QgsField("OSM type", QVariant.String)]
         tags = [QgsField(tag, QVariant.String) for tag in self.CONFIG.configJson[feature]['outputTags']]
         columns.extend(tags)
         pr.addAttributes(columns)
         vl.updateFields()
+        return vl
 
 
+    def buffer(self, layer: QgsVectorLayer, feature:str) -> QgsGeometry:
+        """
+        Buffer ads a buffer for the input feature based on a mapping setting the buffer radii for each tag value
+        
+        param val: 
+            layer: the QgsVectorLayer object to be buffered. 
+            feature: The feature that is being buffered. Used to save the buffered layer and to find bufferring settings from CONFIG
+        ret val: a QgsGeometry of type polygon. 
+        """
+        bufferScheme = self.CONFIG.bufferSettings[feature]
+        vl = self.createBufferLayer(feature)
+
         layer.startEditing()
         pr = layer.dataProvider()
 
+        bufferedFeatures = []
         for bufferKey in bufferScheme.keys():
             fieldindex = pr.fields().indexOf(bufferKey)
             for f in layer.getFeatures():
@@ -485,8 +754,9 @@ class Parser:
 
                 buffered = f.geometry().buffer(bufferVal,5)
                 f.setGeometry(buffered)
-                self.addQgsFeatures(vl,[f])
+                bufferedFeatures.append(f)
 
+        self.addQgsFeatures(vl, bufferedFeatures)
         return vl
 
 # %%
@@ -0,0 +1,260 @@
+#%%
+from qgis.core import QgsVectorLayer, QgsFeature, QgsRectangle
+
+from .parser_qgis import Parser
+from .stream import Node, Way, Relation, OSM_TYPES
+from .nodestore import NodeStore, WayStore
+from .multipolygon import assemble
+from . import vectorized
+from .vectorized import np, shapely
+
+try:
+    from ..settings.config import Config
+except ValueError:
+    from settings.config import Config
+
+
+class ShapelyParser(Parser):
+    """
+    Parser engine that builds the geometries with shapely 2 array operations instead of one PyQGIS call per feature.
+
+    Has the interface of Parser and fills the same layers. While parsing, the attributes and coordinates of every
+    relevant object are collected per feature and geometry type, at the end of parse every collection is built into
+    an array of geometries in one step and added to the layers as WKB, so QGIS is only used for the layers.
+    buffer works the same way on whole layers, and subtract cuts the features of a layer out of an area with an STRtree.
+    Worker processes are not used, building in bulk in this process is faster than sending the coordinates to them.
+    """
+    # Builds an array of geometries from a list of collected geometry data, per kind of geometry
+    BUILDERS = {
+        'point': vectorized.points,
+        'multiPoint': vectorized.multiPoints,
+        'line': vectorized.lineStrings,
+        'mergedLines': vectorized.mergedLines,
+        'polygon': vectorized.polygons,
+        'centroid': vectorized.centroids,
+        'multiPolygon': vectorized.multiPolygons,
+    }
+
+    def __init__(self, config:Config = None, outLoc:str = None):
+        vectorized.requireShapely()
+        self.collected:dict = {} # (feature, kind) -> lists of statistics prefixes, attributes and geometry data
+        super().__init__(config, outLoc)
+
+    def setProcesses(self, processes:int):
+        """ Geometries are built in bulk in this process, the number of worker processes is ignored. """
+        self.processes = 1
+
+    def reset(self) -> None:
+        self.collected = {}
+        super().reset()
+
+    def parse(self, res, features:list = None, merge:bool = False) -> dict:
+        """ See Parser.parse. """
+        self.collected = {}
+        try:
+            return super().parse(res, features, merge)
+        finally:
+            self.collected = {}
+
+
+    def collect(self, feature:str, kind:str, prefix:str, obj, data) -> None:
+        """ Keeps the attributes of obj for feature and the data of its geometry, built by BUILDERS[kind] in buildCollected. """
+        prefixes, attributes, geometries = self.collected.setdefault((feature, kind), ([], [], []))
+        tags = obj.tags
+        prefixes.append(prefix)
+        attributes.append([obj.id, OSM_TYPES[type(obj)]] + [tags.get(tag) for tag in self.CONFIG.configJson[feature]['outputTags']])
+        geometries.append(data)
+
+
+    def buildCollected(self) -> None:
+        """ Builds the collected geometries, one array per feature and kind, and adds them to the layers. """
+        for (feature, kind), (prefixes, attributes, geometries) in self.collected.items():
+            fields = self.qgsLyrs[feature].fields()
+            geoms = self.BUILDERS[kind](geometries)
+            for prefix, attrs, geomWkb in zip(prefixes, attributes, shapely.to_wkb(geoms, byte_order=1)):
+                f = QgsFeature(fields)
+                f.setAttributes(attrs)
+                f.setGeometry(self.geometryFromWkb(geomWkb))
+                success = self.queueFeature(feature, f)
+                self.countResult(success, prefix, feature)
+        self.collected = {}
+
+
+    def parseNode(self, node:Node, nodeGeoms:NodeStore) -> None:
+        """ Like Parser.parseNode, but collects the point for buildCollected. """
+        nodeGeoms.add(node.id, node.lon, node.lat)
+
+        features = self.getFeatures(node)
+        if len(features) == 0:
+            return
+
+        for feature in features:
+            if self.isParsed('node', node.id, feature):
+                continue
+            self.collect(feature, 'point', 'node', node, (node.lon, node.lat))
+
+        self.stats['nodesParsed'] += 1
+
+
+    def parseWay(self, way:Way, nodeGeoms:NodeStore, wayGeoms:WayStore) -> None:
+        """ Like Parser.parseWay, but collects the coordinates for buildCollected. Ways with missing nodes or too few nodes for their geometry fail. """
+        wayGeoms.add(way)
+
+        features = self.getFeatures(way)
+        if len(features) == 0:
+            return
+
+        try:
+            coords = way.coords if way.coords is not None else nodeGeoms.lonLat(way.nodeIds)
+        except KeyError: # A node outside the extract
+            for feature in features:
+                self.countResult(False, 'way', feature)
+            return
+        isPolygon = len(coords) >= 4 and self.checkForPolygon(way, coords)
+
+        for feature in features:
+            if self.isParsed('way', way.id, feature):
+                continue
+
+            if isPolygon:
+                kind = 'centroid' if self.CONFIG.configJson[feature]['outputGeom'] == 'point' else 'polygon'
+            elif len(coords) >= 2:
+                kind = 'line'
+            else:
+                self.countResult(False, 'way', feature)
+                continue
+            self.collect(feature, kind, 'way', way, coords)
+
+        self.stats['waysParsed'] += 1
+
+
+    def parseRelation(self, relation:Relation, nodeGeoms:NodeStore, wayGeoms:WayStore) -> None:
+        """
+        Like Parser.parseRelation, but collects the member coordinates for buildCollected.
+        Missing members are left out, relations without any usable member fail.
+        """
+        features = self.getFeatures(relation)
+        if len(features) == 0:
+            return
+
+        for feature in features:
+            if self.isParsed('relation', relation.id, feature):
+                continue
+
+            outputGeom = self.CONFIG.configJson[feature]['outputGeom']
+            if outputGeom == 'point':
+                kind = 'multiPoint'
+                data = []
+                for member in relation.members:
+                    if member.type != 'node':
+                        continue
+                    try:
+                        data.append(self.memberPoint(member, nodeGeoms))
+                    except KeyError:
+                        continue
+            elif outputGeom == 'line':
+                kind = 'mergedLines'
+                data = []
+                for member in relation.members:
+                    if member.type != 'way':
+                        continue
+                    coords = self.memberCoords(member, wayGeoms)
+                    if coords is not None and len(coords) >= 2:
+                        data.append(coords)
+            else:
+                kind = 'multiPolygon'
+                data = self.assemblePolygons(relation, wayGeoms)
+
+            if len(data) == 0:
+                self.countResult(False, 'rel', feature)
+                continue
+            self.collect(feature, kind, 'rel', relation, data)
+
+        for member in relation.members:
+            if member.type == 'way' and member.coords is None:
+                wayGeoms.release(member.ref)
+        self.stats['relsParsed'] += 1
+
+
+    def assemblePolygons(self, relation:Relation, wayGeoms:WayStore) -> list:
+        """ Like Parser.buildPolygons, but returns the polygons from core.multipolygon.assemble instead of a geometry. """
+        outerWays = []
+        innerWays = []
+        for member in relation.members:
+            if member.type != 'way':
+                continue
+            coords = self.memberCoords(member, wayGeoms)
+            if coords is None:
+                continue
+            if member.role == "inner":
+                innerWays.append(coords)
+            else:
+                outerWays.append(coords)
+
+        polygons, nUnclosed = assemble(outerWays, innerWays)
+        if nUnclosed > 0:
+            print(f"relation {relation.id}: {nUnclosed} rings could not be closed")
+        return polygons
+
+
+    def layerGeometries(self, layer:QgsVectorLayer) -> tuple:
+        """ Returns the features of layer and an array of their geometries, None for features without one. """
+        feats = list(layer.getFeatures())
+        geoms = shapely.from_wkb([bytes(f.geometry().asWkb()) for f in feats], on_invalid='ignore')
+        return feats, np.asarray(geoms, dtype=object)
+
+
+    def buffer(self, layer:QgsVectorLayer, feature:str) -> QgsVectorLayer:
+        """
+        Like Parser.buffer, but buffers all features of layer with one radius per feature in one step.
+
+        param val:
+            layer: the QgsVectorLayer object to be buffered, in CONFIG.projectedCrs.
+            feature: The feature that is being buffered, its buffer radii are looked up in CONFIG.bufferSettings
+        ret val: a polygon QgsVectorLayer with the buffered features
+        """
+        bufferScheme = self.CONFIG.bufferSettings[feature]
+        vl = self.createBufferLayer(feature)
+        feats, geoms = self.layerGeometries(layer)
+        if len(feats) == 0:
+            return vl
+
+        bufferedFeatures = []
+        for bufferKey, radii in bufferScheme.items():
+            fieldindex = layer.fields().indexOf(bufferKey)
+            if fieldindex < 0:
+                continue
+            distances = vectorized.radii([f.attributes()[fieldindex] for f in feats], radii)
+            selected = np.flatnonzero(~np.isnan(distances) & ~shapely.is_missing(geoms))
+            buffered = vectorized.buffered(geoms[selected], distances[selected])
+            for i, geomWkb in zip(selected, shapely.to_wkb(buffered, byte_order=1)):
+                f = QgsFeature(feats[i])
+                f.setGeometry(self.geometryFromWkb(geomWkb))
+                bufferedFeatures.append(f)
+
+        self.addQgsFeatures(vl, bufferedFeatures)
+        return vl
+
+
+    def subtract(self, layer:QgsVectorLayer, bbox:QgsRectangle) -> QgsVectorLayer:
+        """
+        Returns the parts of bbox that are not covered by the polygons of layer, as a polygon layer with one feature per part.
+        The polygons near bbox are found with an STRtree, see core.vectorized.subtract. bbox is in the crs of layer.
+        """
+        vl = QgsVectorLayer("Polygon", layer.name(), "memory")
+        vl.setCrs(layer.crs())
+
+        _, geoms = self.layerGeometries(layer)
+        geoms = geoms[~shapely.is_missing(geoms)]
+        area = shapely.box(bbox.xMinimum(), bbox.yMinimum(), bbox.xMaximum(), bbox.yMaximum())
+        rest = vectorized.subtract([area], geoms)[0] if len(geoms) > 0 else area
+
+        parts = shapely.get_parts(rest)
+        parts = parts[shapely.area(parts) > 0]
+        feats = []
+        for geomWkb in shapely.to_wkb(parts, byte_order=1):
+            f = QgsFeature()
+            f.setGeometry(self.geometryFromWkb(geomWkb))
+            feats.append(f)
+        self.addQgsFeatures(vl, feats)
+        return vl
@@ -0,0 +1,72 @@
+"""
+Plans the overpass statements for the features of the configuration, used by core.query.Query.
+
+Every input tag of the configuration is placed under the one selector that covers all element types
+the features need it for, and the tags of a selector are written as one union of tag filters.
+Only uses the standard library, a Config is read through its features and configJson.
+"""
+import re
+
+# Element types of the overpass selectors, used when planning queries from the configuration.
+GEOM_ELEMENTS = {"node": "n", "way": "w", "rel": "r", "nw": "nw", "nr": "nr", "wr": "wr", "nwr": "nwr"}
+# The parser creates points from nodes, closed ways and relations, and lines and polygons from ways and relations.
+OUTPUT_ELEMENTS = {"point": "nwr", "line": "wr", "polygon": "wr"}
+# Values that can be combined into a regular expression without escaping
+PLAIN_VALUE = re.compile(r"^[\w:\- ]+$")
+
+
+def unionTags(geom, tags = None, compact = False, filters = '', **kwargs):
+    """
+    Takes one or more list of tags as key = [values] or as a dictionary with {key = [values]} and returns a string to be used in Overpass QL query.
+    All tags must be of the same type specified in geom = "node", "way", "area" or "rel"
+    compact = True combines the values of a key into one regular expression statement when the values are plain words.
+    filters is appended to every statement, e.g. '(newer:"2022-07-08T00:00:00Z")'.
+    returns the union of the tags as string
+    """
+    if tags == None:
+        tags = kwargs
+
+    outString = '('
+    for tagKey in tags.keys():
+        values = tags[tagKey]
+        if compact and len(values) > 1 and all(PLAIN_VALUE.match(value) for value in values):
+            outString += '''{}["{}"~"^({})$"]{};'''.format(geom, tagKey, '|'.join(values), filters)
+            continue
+        for tagValue in values:
+            outString += '''{}["{}"="{}"]{};'''.format(geom, tagKey, tagValue, filters)
+    outString += ')'
+    return outString
+
+
+def planQuery(config, strictGeom:bool = False, features:list = None) -> dict:
+    """
+    Groups the input tags of every feature in config by the overpass selector needed to fetch them.
+    Every key-value pair is placed under exactly one selector, covering all element types any feature needs it for.
+
+    param val:
+        config: the Config to plan the query for
+        strictGeom: True uses the "inputGeom" of each feature. False uses every element type the parser
+            can turn into the "outputGeom" of the feature, which gives the same output as querying everything.
+        features: the features to plan for, defaults to all features of config
+    ret val:
+        dictionary with overpass selectors (node, way, rel, nw, nr, wr or nwr) as keys and {key: [values]} as values.
+    """
+    if features is None:
+        features = config.features
+    elements = {} # (key, value) -> set of element types
+    for feature in features:
+        confFeature = config.configJson[feature]
+        if strictGeom:
+            featureElements = GEOM_ELEMENTS[confFeature['inputGeom']]
+        else:
+            featureElements = OUTPUT_ELEMENTS[confFeature['outputGeom']]
+        for key, values in confFeature['inputTags'].items():
+            for value in values:
+                elements.setdefault((key, value), set()).update(featureElements)
+
+    groups = {}
+    for (key, value), types in elements.items():
+        selector = ''.join(t for t in "nwr" if t in types)
+        selector = {"n": "node", "w": "way", "r": "rel"}.get(selector, selector)
+        groups.setdefault(selector, {}).setdefault(key, []).append(value)
+    return groups
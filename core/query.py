@@ -1,34 +1,232 @@
 import overpy
-import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from .utilities.tools import getOsmBboxString
+from .utilities.tools import getOsmBboxString, splitBbox
+from .stream import Node, Way, Relation, iterElements
+from .transport import Transport
+from .endpoints import EndpointPool
+from .scheduler import QueryCancelled
+from .cache import ResponseCache, CacheWriter, TeeReader
+from . import plan
 
 from qgis.core import QgsRectangle
 
+try:
+    from ..settings.config import Config
+except ValueError:
+    from settings.config import Config
+except ImportError:
+    from settings.config import Config
+
+
+def mergeMeta(meta:dict, other:dict) -> None:
+    """ 
+    Adds the meta data of one of several responses, other, to meta. The oldest timestamp_osm_base is kept, 
+    so the data of every response is at least as new as the time in meta. 
+    """
+    if meta is None or "timestamp_osm_base" not in other:
+        return
+    osmBase = other["timestamp_osm_base"]
+    if "timestamp_osm_base" not in meta or osmBase < meta["timestamp_osm_base"]: # The timestamps sort as strings
+        meta["timestamp_osm_base"] = osmBase
+
+
 class Query:
     API = overpy.Overpass()
+    CACHE = ResponseCache() # Set to None to always query overpass
+    TRANSPORT = Transport()
+    RETRY_ON = (overpy.exception.OverpassTooManyRequests, overpy.exception.OverpassGatewayTimeout)
+    FAIL_ON = (OSError, overpy.exception.OverpassUnknownHTTPStatusCode) # Errors that move the query to another endpoint
+    ENDPOINTS = EndpointPool([API.url], TRANSPORT, RETRY_ON, FAIL_ON) # Replace with Query.setEndpoints
+    TILE_SIZE = 0.02 # Width and height of tiles in degrees, about 2 km. 
+    MAX_WORKERS = 2 # The public overpass instances allow two concurrent queries per ip. 
+    # Used by Query.estimate to turn object counts into response size and parse time. 
+    NODES_PER_WAY = 12 # Nodes added per way by the recursion (._;>;)
+    WAYS_PER_RELATION = 15 # Member ways added per relation by the recursion
+    BYTES_PER_ELEMENT = {"nodes": 110, "ways": 300, "relations": 900} # In the json response
+    PARSE_RATE = 25000 # Elements parsed per second
+    MAX_SINGLE_BYTES = 67108864 # Larger responses are tiled
+    MAX_TOTAL_BYTES = 4294967296 # Larger responses are refused
+
+    @classmethod
+    def setEndpoints(cls, urls:list) -> None:
+        """
+        Distributes the queries over the overpass instances in urls, e.g. a self hosted mirror and the public instance. 
+        urls are interpreter urls such as "https://overpass-api.de/api/interpreter". 
+        """
+        cls.ENDPOINTS = EndpointPool(list(urls), cls.TRANSPORT, cls.RETRY_ON, cls.FAIL_ON)
+
+    # Element types of the overpass selectors, see core.plan
+    GEOM_ELEMENTS = plan.GEOM_ELEMENTS
+    OUTPUT_ELEMENTS = plan.OUTPUT_ELEMENTS
 
     @staticmethod
-    def __unionTags(geom, tags = None, **kwargs):
-        """ 
-        Takes one or more list of tags as key = [values] or as a dictionary with {key = [values]} and returns a string to be used in Overpass QL query.
-        All tags must be of the same type specified in geom = "node", "way", "area" or "rel"
-        returns the union of the tags as string
+    def __unionTags(geom, tags = None, compact = False, filters = '', **kwargs):
+        """ See core.plan.unionTags. """
+        return plan.unionTags(geom, tags, compact, filters, **kwargs)
+
+    @classmethod
+    def planQuery(cls, config:Config, strictGeom:bool = False, features:list = None) -> dict:
+        """ See core.plan.planQuery. """
+        return plan.planQuery(config, strictGeom, features)
+
+    @classmethod
+    def configQueryString(cls, bbox:QgsRectangle, config:Config, strictGeom:bool = False, outGeom:bool = False, features:list = None) -> str:
+        """
+        Returns the query string for only the objects inside bbox that are relevant to the features of config 
+        (or to the given subset of features), together with the ways and nodes they are built from. 
+        outGeom = True instead returns the coordinates of ways and relation members inline (out geom), 
+        which needs core.stream records to be parsed, e.g. with Query.streamGet. 
+        The geometry is requested for the whole world, the global bbox would otherwise clip the ways that cross it. 
         """
+        groups = cls.planQuery(config, strictGeom, features)
+        union = ''.join(cls.__unionTags(geom, tags, compact=True)+';' for geom, tags in groups.items())
+        queryString = '''
+        [out:json]
+        [timeout:600]
+        [maxsize:1073741824]
+        [bbox:{}];
+        ({});
+        {}
+        '''.format(getOsmBboxString(bbox), union, "out geom(-90,-180,90,180);" if outGeom else "(._;>;);\n        out;")
+        return queryString
 
-        outString = '('
-        if tags == None:
-            for key in kwargs.keys():
-                for tag in kwargs[key]:
-                    outString += '''{}["{}"="{}"];'''.format(geom, key, tag)
-        else:
-            for tagKey in tags.keys():
-                for tagValue in tags[tagKey]:
-                    outString += '''{}["{}"="{}"];'''.format(geom, tagKey, tagValue)
-        outString += ')'
-        return outString
+    @classmethod
+    def configGet(cls, bbox:QgsRectangle, config:Config, printquery = False) -> overpy.Result:
+        """
+        Queries the objects inside bbox that are relevant to the features of config. 
+
+        param val:
+            bbox: the area to query in wgs84 coordinates
+            config: the Config whose features decide which tags to query
+            printquery: True will print the querystring sent to overpy. 
+        ret val: 
+            the result from overpass as an overpy.Result object.
+        """
+        queryString = cls.configQueryString(bbox, config)
+
+        if printquery:
+            print(queryString)
+
+        return cls.__query(queryString)
     
     
+    @classmethod
+    def estimate(cls, bbox:QgsRectangle, config:Config, isCanceled = None) -> dict:
+        """
+        Estimates the size of the configQueryString response for bbox with a cheap count query per tag group, 
+        and chooses how to fetch it. 
+
+        param val:
+            bbox: the area to query in wgs84 coordinates
+            config: the Config whose features decide which tags to query
+            isCanceled: optional function returning True when the run is cancelled, raises QueryCancelled when it does
+        ret val: 
+            dictionary with
+                counts: the number of matching nodes, ways and relations, summed over the tag groups
+                elements: estimated number of elements in the response, including the recursion
+                bytes: estimated size of the response
+                parseSeconds: estimated parse time
+                strategy: "single", "tiled" or "refuse"
+                tileSize: tile size in degrees giving responses of about MAX_SINGLE_BYTES, for the tiled strategy
+        """
+        groups = cls.planQuery(config)
+        statements = ''.join(cls.__unionTags(geom, tags, compact=True)+';out count;' for geom, tags in groups.items())
+        queryString = '''
+        [out:json]
+        [timeout:120]
+        [bbox:{}];
+        {}
+        '''.format(getOsmBboxString(bbox), statements)
+
+        # The counts are cached like the responses, so a run over a cached area does not wait for overpass
+        raw = cls.CACHE.get(queryString) if cls.CACHE is not None else None
+        if raw is None:
+            response = cls.__request(queryString, isCanceled)
+            raw = response.read()
+            response.close()
+            data = json.loads(raw)
+            if "runtime error" in data.get("remark", ""):
+                raise RuntimeError(f"overpass could not count the objects: {data['remark']}")
+            if cls.CACHE is not None:
+                cls.CACHE.put(queryString, raw)
+        else:
+            data = json.loads(raw)
+
+        counts = {"nodes": 0, "ways": 0, "relations": 0}
+        for element in data["elements"]:
+            if element.get("type") != "count":
+                continue
+            for key in counts.keys():
+                counts[key] += int(element["tags"].get(key, 0))
+
+        ways = counts["ways"] + counts["relations"] * cls.WAYS_PER_RELATION
+        nodes = counts["nodes"] + ways * cls.NODES_PER_WAY
+        elements = nodes + ways + counts["relations"]
+        size = nodes * cls.BYTES_PER_ELEMENT["nodes"] + ways * cls.BYTES_PER_ELEMENT["ways"] + counts["relations"] * cls.BYTES_PER_ELEMENT["relations"]
+
+        if size <= cls.MAX_SINGLE_BYTES:
+            strategy = "single"
+        elif size <= cls.MAX_TOTAL_BYTES:
+            strategy = "tiled"
+        else:
+            strategy = "refuse"
+        # Assumes objects are spread evenly over bbox. 
+        tileSize = max(bbox.width(), bbox.height()) * min(1, (cls.MAX_SINGLE_BYTES / max(size, 1)) ** 0.5)
+
+        estimate = {
+            "counts": counts,
+            "elements": elements,
+            "bytes": size,
+            "parseSeconds": elements / cls.PARSE_RATE,
+            "strategy": strategy,
+            "tileSize": tileSize,
+        }
+        print(f"Estimated {elements} elements, {size/1048576:.0f} MB, {elements / cls.PARSE_RATE:.0f}s parsing: {strategy}")
+        return estimate
+
+    @classmethod
+    def refreshQueryString(cls, bbox:QgsRectangle, config:Config, since:str) -> str:
+        """
+        Returns the query string for the objects inside bbox that changed after since, together with the ways and nodes they are built from. 
+        Changed means the relevant objects edited after since, and all ways and relations whose nodes or ways were moved after since. 
+
+        param val:
+            since: timestamp in the format "2022-07-08T00:00:00Z"
+        """
+        groups = cls.planQuery(config)
+        newer = '''(newer:"{}")'''.format(since)
+        union = ''.join(cls.__unionTags(geom, tags, compact=True, filters=newer)+';' for geom, tags in groups.items())
+        queryString = '''
+        [out:json]
+        [timeout:600]
+        [maxsize:1073741824]
+        [bbox:{}];
+        ({})->.edited;
+        node{}->.movedNodes;
+        way(bn.movedNodes)->.movedWays;
+        (rel(bn.movedNodes); rel(bw.movedWays);)->.movedRels;
+        (.edited; .movedWays; .movedRels;);
+        (._;>;);
+        out;
+        '''.format(getOsmBboxString(bbox), union, newer)
+        return queryString
+
+    @classmethod
+    def idsGet(cls, bbox:QgsRectangle, config:Config, isCanceled = None) -> set:
+        """
+        Returns (type, id) of all objects inside bbox that are currently relevant to the features of config, 
+        with type "node", "way" or "relation", since the ids of different types overlap. 
+        Only the ids are downloaded, which makes it cheap to find objects that were deleted or lost their tags. 
+        """
+        queryString = cls.configQueryString(bbox, config).replace("(._;>;);", "").replace("out;", "out ids;")
+        response = cls.__request(queryString, isCanceled)
+        data = json.loads(response.read())
+        response.close()
+        return {(element["type"], element["id"]) for element in data["elements"]}
+
     @classmethod
     def tagGet(cls, geom:str, tags:dict, bbox:str, printquery = False) -> overpy.Result:
         """
@@ -51,25 +249,112 @@ class Query:
         '''.format(getOsmBboxString(bbox), cls.__unionTags(geom, tags))
         if printquery:
             print(queryString)
-        while True:
-            try:
-                print("querying OSM", end="\r")
-                res = cls.API.query(queryString)
-                print("query completed sucsessfully")
-                break
-            except overpy.exception.OverpassTooManyRequests:
-                print("Too many requests, sleeping")
-                time.sleep(30)
-            except overpy.exception.OverpassGatewayTimeout:
-                print("Server load too high, sleeping 30s")
-                time.sleep(30)               
 
-        return res
+        return cls.__query(queryString)
+
+    @classmethod
+    def bboxGet(cls, bbox:QgsRectangle, printquery = False) -> overpy.Result:
+        """
+        Queries every node, way and relation inside bbox in one request. 
+
+        param val:
+            bbox: the area to query in wgs84 coordinates
+            printquery: True will print the querystring sent to overpy. 
+        ret val: 
+            the result from overpass as an overpy.Result object.
+        """
+        queryString = cls.bboxQueryString(bbox)
+
+        if printquery:
+            print(queryString)
+
+        return cls.__query(queryString)
+
+    @classmethod
+    def tiledGet(cls, bbox:QgsRectangle, queryBuilder = None, tileSize:float = None, maxWorkers:int = None, isCanceled = None, meta:dict = None) -> list:
+        """
+        Splits bbox into a grid of tiles, queries the tiles concurrently and merges the results. 
+        Elements that are part of several tiles are only kept once, based on their OSM id. 
+        The tiles are decoded straight into core.stream records, no overpy.Result is built. 
+
+        param val:
+            bbox: the area to query in wgs84 coordinates
+            queryBuilder: function taking a QgsRectangle and returning the query string for that tile. Defaults to Query.bboxQueryString
+            tileSize: the maximum width and height of a tile in degrees. Defaults to Query.TILE_SIZE
+            maxWorkers: the maximum number of concurrent queries. Defaults to Query.MAX_WORKERS per endpoint
+            isCanceled: optional function returning True when the download should stop, e.g. QgsTask.isCanceled. 
+                Raises QueryCancelled when it does. 
+            meta: optional dictionary that receives "timestamp_osm_base", the time of the oldest data of the tiles. 
+        ret val: 
+            list of the Node, Way and Relation records of all tiles, nodes before ways before relations. 
+            It can be passed to Parser.parse. 
+        """
+        if queryBuilder is None:
+            queryBuilder = cls.bboxQueryString
+        if tileSize is None:
+            tileSize = cls.TILE_SIZE
+        if maxWorkers is None:
+            maxWorkers = cls.MAX_WORKERS * len(cls.ENDPOINTS)
+
+        tiles = splitBbox(bbox, tileSize)
+        if len(tiles) == 1:
+            return cls.__records(queryBuilder(bbox), isCanceled, meta)
+
+        merged = {Node: [], Way: [], Relation: []}
+        seen = {Node: set(), Way: set(), Relation: set()}
+        # Set when a tile fails or the run is cancelled, stops the tiles that are being downloaded
+        stopped = threading.Event()
+        def tileCanceled():
+            return stopped.is_set() or (isCanceled is not None and isCanceled())
+
+        executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        try:
+            tileMetas = {}
+            for tile in tiles:
+                tileMeta = {}
+                tileMetas[executor.submit(cls.__records, queryBuilder(tile), tileCanceled, tileMeta)] = tileMeta
+            done = 0
+            for future in as_completed(tileMetas.keys()):
+                if isCanceled is not None and isCanceled():
+                    raise QueryCancelled()
+                for element in future.result():
+                    elementType = type(element)
+                    if element.id not in seen[elementType]:
+                        seen[elementType].add(element.id)
+                        merged[elementType].append(element)
+                mergeMeta(meta, tileMetas[future])
+                done += 1
+                print(f"tiles completed: {done}/{len(tiles)}", end="\r")
+        except BaseException:
+            # Tiles that have not started are dropped instead of downloaded before the error reaches the caller
+            stopped.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+        print("")
+        return merged[Node] + merged[Way] + merged[Relation]
 
     @classmethod
-    def bboxGet(cls, bbox:QgsRectangle, printquery = False):
+    def __records(cls, queryString:str, isCanceled = None, meta:dict = None) -> list:
+        """ 
+        Returns the records of queryString, read with streamGet, meta receives the timestamp of the response. 
+        The download stops with QueryCancelled when isCanceled returns True. 
         """
-        testing
+        records = []
+        stream = cls.streamGet(queryString, meta=meta, isCanceled=isCanceled)
+        try:
+            for element in stream:
+                if isCanceled is not None and len(records) % 1000 == 0 and isCanceled():
+                    raise QueryCancelled()
+                records.append(element)
+        finally:
+            stream.close()
+        return records
+
+    @staticmethod
+    def bboxQueryString(bbox:QgsRectangle) -> str:
+        """ 
+        Returns the query string for every node, way and relation inside bbox. 
         """
         queryString = '''
         [out:json]
@@ -79,23 +364,110 @@ class Query:
         (._;>;);
         out;
         '''.format(getOsmBboxString(bbox))
+        return queryString
+
+    @classmethod
+    def streamGet(cls, queryString:str, printquery = False, meta:dict = None, isCanceled = None):
+        """
+        Sends queryString to overpass and parses the response while it is downloaded. 
+        Cached responses are read from the cache and new responses are cached once completely read. 
 
+        param val:
+            queryString: an overpass query with json output
+            printquery: True will print the querystring. 
+            meta: optional dictionary that receives "timestamp_osm_base", the time of the data in the response. 
+                For a cached response this is the time of the cached data, not of the request. 
+            isCanceled: optional function returning True when the run is cancelled, stops waiting for an endpoint with QueryCancelled
+        ret val: 
+            generator of Node, Way and Relation records from core.stream, in the order of the response. 
+        """
         if printquery:
             print(queryString)
 
-        while True:
+        if cls.CACHE is not None:
+            cached = cls.CACHE.open(queryString)
+            if cached is not None:
+                print("query loaded from cache")
+                with cached:
+                    yield from iterElements(cached, meta=meta)
+                return
+
+        response = cls.__request(queryString, isCanceled)
+        writer = cls.CACHE.writer(queryString) if cls.CACHE is not None else None
+        complete = False
+        try:
+            stream = TeeReader(response, writer) if writer is not None else response
+            yield from iterElements(stream, meta=meta)
+            complete = True
+        finally:
+            response.close()
+            if writer is not None:
+                if complete:
+                    writer.commit()
+                else:
+                    writer.discard()
+
+    @classmethod
+    def __query(cls, queryString:str) -> overpy.Result:
+        """
+        Returns the result of queryString from the cache if available, 
+        otherwise sends it to overpass and caches the response. 
+        """
+        data = None
+        if cls.CACHE is not None:
+            data = cls.CACHE.get(queryString)
+            if data is not None:
+                print("query loaded from cache")
+
+        if data is None:
+            response = cls.__request(queryString)
+            chunks = []
             try:
-                print("querying OSM")
-                res = cls.API.query(queryString)
-                print("query completed sucsessfully")
-                break
-            except overpy.exception.OverpassTooManyRequests:
-                print("Too many requests, sleeping 30s")
-                time.sleep(30)
-            except overpy.exception.OverpassGatewayTimeout:
-                print("Server load too high, sleeping 30s")
-                time.sleep(30)
-        return res
+                while True:
+                    chunk = response.read(cls.TRANSPORT.chunkSize)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            finally:
+                response.close()
+            data = b"".join(chunks)
+            if cls.CACHE is not None:
+                cls.CACHE.put(queryString, data)
+
+        return cls.API.parse_json(data)
+
+    @classmethod
+    def __request(cls, queryString:str, isCanceled = None):
+        """
+        Sends queryString to the best overpass endpoint with a free slot, failing over to the other endpoints while they are busy. 
+        Returns the response as an open, readable file object. 
+        Raises scheduler.RetryBudgetExceeded if the endpoints stay busy, and QueryCancelled if isCanceled returns True before it is sent. 
+        """
+        print("querying OSM")
+        response = cls.ENDPOINTS.run(lambda url: cls.__open(queryString, url), isCanceled)
+        print("query accepted")
+        return response
+
+    @classmethod
+    def __open(cls, queryString:str, url:str):
+        """
+        Sends queryString to the overpass interpreter at url and returns the response if successful. 
+        Raises the same exceptions as overpy.Overpass.query for unsuccessful status codes. 
+        """
+        f = cls.TRANSPORT.post(url, queryString.encode("utf-8"))
+
+        if f.code == 200:
+            return f
+
+        response = f.read()
+        f.close()
+        if f.code == 400:
+            raise overpy.exception.OverpassBadRequest(queryString, msgs=[response.decode("utf-8", "replace")])
+        if f.code == 429:
+            raise overpy.exception.OverpassTooManyRequests()
+        if f.code == 504:
+            raise overpy.exception.OverpassGatewayTimeout()
+        raise overpy.exception.OverpassUnknownHTTPStatusCode(f.code)
 
     @classmethod
     def getQueryString(self, geom, tags, bbox):
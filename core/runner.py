@@ -3,7 +3,8 @@ import os
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning) #Suppresses future warnings
 
-from qgis.core import (QgsProject,
+from qgis.core import (QgsApplication,
+                    QgsProject,
                     QgsCoordinateReferenceSystem,
                     QgsCoordinateTransform,
                     QgsVectorLayer,
@@ -11,8 +12,6 @@ from qgis.core import (QgsProject,
                     QgsVectorFileWriter,
                     QgsRectangle
                     )
-from qgis.PyQt.QtWidgets import QProgressDialog, QProgressBar
-from qgis.PyQt.QtCore import Qt, QThread, pyqtSignal
 
 
 
@@ -23,7 +22,13 @@ except ValueError:
 except ImportError:
     from settings.config import Config
 from .query import Query
+from .stream import OSM_TYPES
+from .extract import Extract
+from .async_query import AsyncQuery
+from .incremental import RefreshState, patchLayer
 from .parser_qgis import Parser
+from .tasks import ExtractionTask, RefreshTask, RunAborted
+from .output import GeoPackageOutput
 
 from .utilities.tools import getGroupNameFromFeature, getLayerNameFromFeature
 
@@ -37,12 +42,25 @@ class Runner:
         self.project: QgsProject = QgsProject.instance()
         self.bbox:QgsRectangle = self.CONFIG.bbox_M
         self.outLoc = None
+        self.streaming:bool = False
+        self.outGeom:bool = False
+        self.perFeature:bool = False
+        self.extractPath:str = None
+        self.processes:int = 1
+        self.engine:str = "qgis"
         self.mainWindow = None
+        self.transformContext = None
         self.iface = iface
-        self.__createdGroups:list = []
+        self.output:GeoPackageOutput = None
+
+    def getTransformContext(self):
+        """ Returns the transform context copied when the run started, or the one of the project. """
+        if self.transformContext is not None:
+            return self.transformContext
+        return self.project.transformContext()
 
     def transformQLayer(self, qLayer:QgsVectorLayer, crsSrc:QgsCoordinateReferenceSystem, crsDest:QgsCoordinateReferenceSystem) -> QgsVectorLayer:
-        transformContext = self.project.transformContext()
+        transformContext = self.getTransformContext()
         xform = QgsCoordinateTransform(crsSrc, crsDest, transformContext)
         feats = []
         for f in qLayer.getFeatures():
@@ -72,21 +90,9 @@ class Runner:
         """
         Saves vl to a geopackage with the name of the first part of the feature name. 
         """
-
-        groupName = getGroupNameFromFeature(feature)
-        outName = groupName+'.gpkg'
-        gpkgPath = os.path.join(outLoc,outName)
-
-        saveOptions = QgsVectorFileWriter.SaveVectorOptions()
-        if groupName not in self.__createdGroups:
-            self.__createdGroups.append(groupName)
-            saveOptions.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
-        else:
-            saveOptions.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
-        saveOptions.driverName = "GPKG"
-        saveOptions.layerName = getLayerNameFromFeature(feature)
-        err = QgsVectorFileWriter.writeAsVectorFormatV2(vl, gpkgPath, self.project.transformContext(), saveOptions)
-        return gpkgPath
+        if self.output is None or self.output.outLoc != outLoc:
+            self.output = GeoPackageOutput(outLoc, self.getTransformContext())
+        return self.output.saveLayer(feature, vl)
 
     def createGroupMap(self, features: list)-> dict:
         """
@@ -103,11 +109,6 @@ class Runner:
                 groupMap[groupName] = [feature]
         return groupMap
 
-    def cancelRun(self, dialog):
-        dialog.setLabelText("Aborting...")
-        dialog.setValue(0)
-        return
-
     def setBbox(self, bbox):
         self.bbox = bbox
         # Returns itself for methodchaining
@@ -123,56 +124,161 @@ class Runner:
         # Returns itself for methodchaining
         return self
 
-    def qgsMain(self):
-        dialog = QProgressDialog("Runner Working","Cancel",0,100,self.iface.mainWindow())
-        dialog.setWindowModality(Qt.WindowModal)
-        dialog.setMinimumDuration(0)
-        dialog.setWindowTitle("Running OSM to IMM")
+    def setStreaming(self, streaming:bool):
+        """ 
+        True parses the response while it is downloaded in one request instead of fetching tiles into an overpy.Result. 
+        """
+        self.streaming = streaming
+        # Returns itself for methodchaining
+        return self
 
-        dialog.setLabelText("Starting processess")
-        dialog.setMinimumWidth(300)
-        dialog.show()
-        
-        dialog.setLabelText("Starting processess")
-        dialog.setValue(10)
-        time.sleep(1)
-        
-        groupMap = self.createGroupMap(self.CONFIG.features)        
+    def setOutGeom(self, outGeom:bool):
+        """ 
+        True requests way and relation member coordinates inline (out geom) instead of resolving every node. 
+        The response is then always streamed in one request. 
+        """
+        self.outGeom = outGeom
+        # Returns itself for methodchaining
+        return self
 
-        self.PARSER.setOutLoc(self.outLoc)
-        self.PARSER.setProject(self.project)
+    def setPerFeature(self, perFeature:bool):
+        """ 
+        True sends one query per feature concurrently and parses each result as soon as it arrives. 
+        """
+        self.perFeature = perFeature
+        # Returns itself for methodchaining
+        return self
 
-        if dialog.wasCanceled():
-            return
-        dialog.setLabelText("Querying Overpass")
-        dialog.setValue(25)
-        time.sleep(1)
+    def setExtract(self, extractPath:str):
+        """ 
+        Reads OSM data from the local .osm or .osm.pbf extract at extractPath instead of querying overpass. None queries overpass. 
+        """
+        self.extractPath = extractPath
+        # Returns itself for methodchaining
+        return self
 
-        res = Query.bboxGet(self.bbox)
-        
-        if dialog.wasCanceled():
-            return
-        dialog.setLabelText("Parsing")
-        dialog.setValue(50)
-        time.sleep(1)
+    def setProcesses(self, processes:int):
+        """ 
+        Number of worker processes that build the geometries while parsing, see Parser.setProcesses. None uses one per core. 
+        """
+        self.processes = processes
+        # Returns itself for methodchaining
+        return self
 
-        layers = self.PARSER.parse(res)
+    def setEngine(self, engine:str):
+        """ 
+        The parser engine, "qgis" builds the geometries with PyQGIS, see parser_qgis.Parser, 
+        "shapely" builds them in bulk with shapely 2, see parser_shapely.ShapelyParser. 
+        """
+        if engine not in ("qgis", "shapely"):
+            raise ValueError(f"unknown parser engine {engine}, use 'qgis' or 'shapely'")
+        self.engine = engine
+        # Returns itself for methodchaining
+        return self
 
-        if dialog.wasCanceled():
-            return
-        dialog.setLabelText("Preparing output")
-        dialog.setValue(75)
-        time.sleep(1)
+    def createParser(self) -> Parser:
+        """ Returns a new parser of the selected engine. """
+        if self.engine == "shapely":
+            # shapely is optional, it is only imported when the engine is used
+            from .parser_shapely import ShapelyParser
+            return ShapelyParser(self.CONFIG)
+        return Parser(self.CONFIG)
 
-        crsOsm = QgsCoordinateReferenceSystem("EPSG:4326")
-        crsProj = QgsCoordinateReferenceSystem(self.CONFIG.projectedCrs) 
-        voidGreyAreasTranformed = self.transformQLayer(layers['voidGreyAreas'], crsOsm, crsProj)
+    def qgsMain(self) -> ExtractionTask:
+        """
+        Starts the extraction for self.bbox as a background task in the QGIS task manager and returns the task. 
+        The layers are added to the project when the task is done. 
+        """
+        # QgsProject is not thread safe, the task uses a copy of the transform context. 
+        self.transformContext = self.project.transformContext()
+        task = ExtractionTask(self)
+        QgsApplication.taskManager().addTask(task)
+        return task
 
-        buffered = self.PARSER.buffer(voidGreyAreasTranformed, 'voidGreyAreas')
-        buffered = self.transformQLayer(buffered, crsProj, crsOsm)
+    def extract(self, task:ExtractionTask) -> dict:
+        """
+        Runs the query, parse, buffer and save stages and returns the output layers with the features as keys. 
+        Called by ExtractionTask in a background thread, task receives progress and is checked for cancellation. 
+        Raises RunAborted if the area can not be processed. 
+        """
+        parser = self.createParser()
+        parser.setOutLoc(self.outLoc)
+        parser.setFeedback(task)
+        parser.setProcesses(self.processes)
+        if self.outLoc is not None:
+            # Features are written to the geopackages while they are parsed instead of kept in memory. 
+            self.output = GeoPackageOutput(self.outLoc, self.getTransformContext())
+            parser.setOutput(self.output)
+        else:
+            self.output = None
+        try:
+            return self.__extract(task, parser)
+        except BaseException:
+            if self.output is not None:
+                self.output.discard()
+            raise
+
+    def __extract(self, task:ExtractionTask, parser:Parser) -> dict:
+        """ The stages of extract, see extract. """
+        task.setProgress(5)
+        meta = {} # Receives the time of the downloaded data, from the responses or the cache
+        if self.perFeature and self.extractPath is None:
+            engine = AsyncQuery()
+            queries = engine.featureQueries(self.bbox, self.CONFIG, self.outGeom)
+            engine.run(queries, lambda feature, elements: parser.parse(elements, features=[feature]), isCanceled=task.isCanceled, meta=meta)
+            layers = parser.qgsLyrs
+        else:
+            if self.extractPath is not None:
+                res = Extract.bboxGet(self.extractPath, self.bbox)
+            elif self.streaming or self.outGeom:
+                res = Query.streamGet(Query.configQueryString(self.bbox, self.CONFIG, outGeom=self.outGeom), meta=meta, isCanceled=task.isCanceled)
+            else:
+                estimate = Query.estimate(self.bbox, self.CONFIG, isCanceled=task.isCanceled)
+                if estimate["strategy"] == "refuse":
+                    raise RunAborted(f"The area contains too much data, about {estimate['bytes']/1048576:.0f} MB. Choose a smaller area.")
+                if estimate["strategy"] == "tiled":
+                    tileSize = estimate["tileSize"]
+                else:
+                    tileSize = max(self.bbox.width(), self.bbox.height()) # One request
+                task.setProgress(10)
+                res = Query.tiledGet(self.bbox, lambda tile: Query.configQueryString(tile, self.CONFIG), tileSize=tileSize, isCanceled=task.isCanceled, meta=meta)
+                task.totalElements = len(res)
+
+            task.setProgress(ExtractionTask.PARSE_START)
+            layers = parser.parse(res)
+
+        if task.isCanceled():
+            if self.output is not None:
+                self.output.discard()
+            return None
+        task.setProgress(ExtractionTask.PARSE_END)
+
+        layers = self.bufferLayers(parser, layers)
+
+        if self.outLoc is not None:
+            for feature in self.CONFIG.features:
+                # Streamed features are copied by finish, empty layers are saved so every layer exists
+                if not parser.isStreamed(feature) or not self.output.hasFeatures(feature):
+                    self.saveLayer(feature, layers[feature], self.outLoc)
+            self.output.finish()
+            if self.extractPath is None:
+                # now() only when no response had a timestamp, its margin covers the delay of the overpass database
+                RefreshState(self.outLoc).set(self.bbox, meta.get("timestamp_osm_base") or RefreshState.now())
+        else:
+            # Memory layers created in the task thread must belong to the main thread before they are added to the project. 
+            mainThread = QgsApplication.instance().thread()
+            for lyr in layers.values():
+                lyr.moveToThread(mainThread)
 
-        layers['voidGreyAreas'] = buffered
+        task.setProgress(100)
+        return layers
 
+    def addLayers(self, layers:dict) -> None:
+        """
+        Adds the output layers to the project in one group per feature group. 
+        Reads the layers from the geopackages if they were saved. Must run in the main thread. 
+        """
+        groupMap = self.createGroupMap(self.CONFIG.features)
         root = self.project.layerTreeRoot()
         
         for group in groupMap.keys():
@@ -181,7 +287,7 @@ class Runner:
                 
                 if self.outLoc is not None:
                     name = getLayerNameFromFeature(feature)
-                    gpkgPath = self.saveLayer(feature,layers[feature],self.outLoc)
+                    gpkgPath = os.path.join(self.outLoc, getGroupNameFromFeature(feature)+'.gpkg')
                     pathToLayer = gpkgPath+f"|layername={name}"
                     qVectorLayer = QgsVectorLayer(pathToLayer, name, "ogr")
                 else:
@@ -190,9 +296,108 @@ class Runner:
                 self.project.addMapLayer(qVectorLayer, False)
                 g.addLayer(qVectorLayer)
 
-        self.__createdGroups = []
+    def notify(self, title:str, message:str, level) -> None:
+        """ Shows message in the QGIS message bar, or prints it when running without an interface. """
+        if self.iface is not None:
+            self.iface.messageBar().pushMessage(title, message, level=level)
+        else:
+            print(f"{title}: {message}")
 
-        dialog.setValue(100)
+    def bufferLayers(self, parser:Parser, layers:dict) -> dict:
+        """
+        Replaces the voidGreyAreas lines in layers with their buffered polygons. 
+        """
+        crsOsm = QgsCoordinateReferenceSystem("EPSG:4326")
+        crsProj = QgsCoordinateReferenceSystem(self.CONFIG.projectedCrs) 
+        voidGreyAreasTranformed = self.transformQLayer(layers['voidGreyAreas'], crsOsm, crsProj)
+
+        buffered = parser.buffer(voidGreyAreasTranformed, 'voidGreyAreas')
+        buffered = self.transformQLayer(buffered, crsProj, crsOsm)
+
+        layers['voidGreyAreas'] = buffered
+        return layers
+
+    def refreshTask(self) -> ExtractionTask:
+        """
+        Starts refresh for self.bbox as a background task in the QGIS task manager and returns the task, like qgsMain. 
+        Starts a full extraction with qgsMain instead if the bbox has not been written to the output location before. 
+        """
+        if self.outLoc is None:
+            raise ValueError("refresh needs an output location, use setOutLoc")
+        if RefreshState(self.outLoc).get(self.bbox) is None:
+            print("No earlier run for this bbox, running a full extraction")
+            return self.qgsMain()
+
+        self.transformContext = self.project.transformContext()
+        task = RefreshTask(self)
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    def refresh(self, task:RefreshTask) -> dict:
+        """
+        Updates the geopackages in the output location with the objects inside the bbox that changed since they were written, 
+        using overpass newer queries, and patches the layers in place by OSM type and id. 
+        Called by RefreshTask in a background thread, task receives progress and is checked for cancellation. 
+        Nothing is patched if the run is cancelled before the changes are downloaded and parsed. 
+        ret val: 
+            (nDeleted, nAdded) per patched feature, or None if the run was cancelled
+        """
+        state = RefreshState(self.outLoc)
+        since = state.get(self.bbox)
+        task.setProgress(5)
+
+        savedLyrs = {}
+        for feature in self.CONFIG.features:
+            name = getLayerNameFromFeature(feature)
+            gpkgPath = os.path.join(self.outLoc, getGroupNameFromFeature(feature)+'.gpkg')
+            lyr = QgsVectorLayer(gpkgPath+f"|layername={name}", name, "ogr")
+            if not lyr.isValid():
+                print(f"layer {feature} was not found in {gpkgPath}, skipping")
+                continue
+            if lyr.fields().indexOf("OSM type") == -1:
+                # Checked before anything is patched, so the output is not left half refreshed
+                raise RunAborted(f"layer {feature} in {gpkgPath} has no OSM type field, run a full extraction instead of a refresh")
+            savedLyrs[feature] = lyr
+
+        print(f"Refreshing objects changed since {since}")
+        meta = {}
+        changedIds = set() # (type, id), the ids of nodes, ways and relations overlap
+        def collectIds(elements):
+            for element in elements:
+                changedIds.add((OSM_TYPES[type(element)], element.id))
+                yield element
+
+        parser = self.createParser()
+        parser.setFeedback(task)
+        res = Query.streamGet(Query.refreshQueryString(self.bbox, self.CONFIG, since), meta=meta, isCanceled=task.isCanceled)
+        task.setProgress(ExtractionTask.PARSE_START)
+        layers = parser.parse(collectIds(res))
+        if task.isCanceled():
+            return None
+        task.setProgress(ExtractionTask.PARSE_END)
+        layers = self.bufferLayers(parser, layers)
+        currentIds = Query.idsGet(self.bbox, self.CONFIG, isCanceled=task.isCanceled)
+        if task.isCanceled():
+            return None
+
+        patched = {}
+        for feature, lyr in savedLyrs.items():
+            patched[feature] = patchLayer(lyr, layers[feature], changedIds, currentIds)
+            print(f"{feature}: {patched[feature][0]} removed, {patched[feature][1]} added")
+
+        state.set(self.bbox, meta.get("timestamp_osm_base") or RefreshState.now())
+        task.setProgress(100)
+        return patched
+
+    def reloadLayers(self) -> None:
+        """ Reloads the layers of the project that are read from the output location, after they were patched by refresh. Must run in the main thread. """
+        outLoc = os.path.normcase(os.path.abspath(self.outLoc))
+        for lyr in self.project.mapLayers().values():
+            if lyr.providerType() != "ogr":
+                continue
+            path = os.path.normcase(os.path.abspath(lyr.source().split("|")[0]))
+            if os.path.dirname(path) == outLoc:
+                lyr.reload()
 
 
 
@@ -273,17 +478,6 @@ class Runner:
             #         print("Feature:", f.id(), f.attributes(), f.geometry().asWkt())
 
 
-class Worker(QThread):
-    trigged = pyqtSignal(int)
-    def __init__(self):
-        QThread.__init__(self)
-
-
-    def run(self):
-
-        string = self.triggered.emit(1)
-
-    
 # _______ Main program calls ______
 # main(CONFIG.bbox_S_D) # Run this line for Dakar 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import random
+import re
+import threading
+from collections import deque
+
+from .transport import Transport
+
+
+class QueryCancelled(Exception):
+    """ Raised when a query is stopped because its run has been cancelled. """
+
+
+class RetryBudgetExceeded(Exception):
+    """ Raised by EndpointPool.run when a request still fails after the retry budget is used up. """
+    def __init__(self, attempts:int, lastError:Exception):
+        self.attempts:int = attempts
+        self.lastError:Exception = lastError
+        super().__init__(f"Request failed {attempts} times, last error: {lastError!r}")
+
+
+class Scheduler:
+    """
+    Decides when requests may be sent to an overpass instance.
+
+    Before every attempt the /api/status page of the instance is read to find how long to wait for a free slot,
+    and failed attempts are delayed by a jittered exponential backoff, see core.endpoints.EndpointPool.run.
+    The requests sent, retried and waiting, and the time spent waiting, are recorded by the pool for monitoring.
+    """
+    RATE_LIMIT = re.compile(r"Rate limit: (\d+)")
+    AVAILABLE = re.compile(r"(\d+) slots? available now")
+    SLOT_AFTER = re.compile(r"Slot available after: \S+, in (-?\d+) seconds")
+
+    def __init__(self, transport:Transport, statusUrl:str, baseDelay:float = 5, maxDelay:float = 300, maxSlotWait:float = 600):
+        self.transport:Transport = transport
+        self.statusUrl:str = statusUrl
+        self.baseDelay:float = baseDelay
+        self.maxDelay:float = maxDelay
+        self.maxSlotWait:float = maxSlotWait
+        self.waitTimes:deque = deque(maxlen=1000) # Seconds waited before each sent request
+        self.requests:int = 0
+        self.retries:int = 0
+        self.__queueDepth:int = 0
+        self.__hasStatus:bool = True
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def statusUrlFor(interpreterUrl:str) -> str:
+        """ Returns the status page url of the instance with the given interpreter url. """
+        return interpreterUrl.rsplit("/", 1)[0] + "/status"
+
+    @property
+    def queueDepth(self) -> int:
+        """ Number of requests currently waiting for a slot or a retry. """
+        return self.__queueDepth
+
+    def enqueue(self) -> None:
+        """ Counts a request that waits for a slot of the instance. """
+        with self.__lock:
+            self.__queueDepth += 1
+
+    def dequeue(self) -> None:
+        """ Counts a request that is done waiting, see enqueue. """
+        with self.__lock:
+            self.__queueDepth -= 1
+
+    def recordSent(self, waited:float) -> None:
+        """ Counts a request sent to the instance after waiting waited seconds for it. """
+        with self.__lock:
+            self.requests += 1
+            self.waitTimes.append(waited)
+
+    def recordRetry(self) -> None:
+        """ Counts a request that failed on the instance and is sent again. """
+        with self.__lock:
+            self.retries += 1
+
+    def stats(self) -> dict:
+        """ Returns a summary of the requests handled by the scheduler. """
+        waits = list(self.waitTimes)
+        return {
+            "queueDepth": self.__queueDepth,
+            "requests": self.requests,
+            "retries": self.retries,
+            "totalWait": sum(waits),
+            "meanWait": sum(waits) / len(waits) if len(waits) > 0 else 0,
+            "maxWait": max(waits) if len(waits) > 0 else 0,
+        }
+
+    def status(self) -> dict:
+        """
+        Reads the status page of the instance.
+
+        ret val:
+            dictionary with rateLimit (0 for no limit), available (free slots now)
+            and slotWaits (seconds until each busy slot is free), or None if the status could not be read.
+        """
+        if not self.__hasStatus:
+            return None
+        try:
+            with self.transport.get(self.statusUrl) as response:
+                if response.status != 200:
+                    if response.status == 404: # Instances without a status page
+                        self.__hasStatus = False
+                    response.read()
+                    return None
+                text = response.read().decode("utf-8", "replace")
+        except OSError:
+            return None
+
+        rateLimit = self.RATE_LIMIT.search(text)
+        available = self.AVAILABLE.search(text)
+        return {
+            "rateLimit": int(rateLimit.group(1)) if rateLimit else 0,
+            "available": int(available.group(1)) if available else 0,
+            "slotWaits": [max(0, int(seconds)) for seconds in self.SLOT_AFTER.findall(text)],
+        }
+
+    def slotWait(self) -> float:
+        """ Returns the number of seconds until the instance has a free slot, 0 if one is free now or the status is unknown. """
+        status = self.status()
+        if status is None or status["rateLimit"] == 0 or status["available"] > 0:
+            return 0
+        if len(status["slotWaits"]) == 0:
+            return self.baseDelay
+        # One second margin since the server rounds the time down.
+        return min(min(status["slotWaits"]) + 1, self.maxSlotWait)
+
+    def backoff(self, attempt:int) -> float:
+        """ Returns the delay before retry number attempt, exponential with random jitter between half and all of the delay. """
+        delay = min(self.maxDelay, self.baseDelay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
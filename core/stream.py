@@ -0,0 +1,207 @@
+"""
+Incremental reading of overpass json responses.
+
+The elements of a response are decoded one at a time while the response is read,
+and yielded as compact records instead of building the full overpy.Result.
+The records are namedtuples, so they have no per instance dictionary. The node ids of a way are kept in
+an int64 array and elements with the same few tags share one interned tag dictionary, see TagTable.
+"""
+import codecs
+import json
+import re
+import sys
+from array import array
+from collections import OrderedDict, namedtuple
+
+Node = namedtuple("Node", ["id", "tags", "lat", "lon"])
+# coords holds (lon, lat) pairs when the response has complete inline geometry (out geom), otherwise None.
+Way = namedtuple("Way", ["id", "tags", "nodeIds", "coords"], defaults=(None,))
+Relation = namedtuple("Relation", ["id", "tags", "members"])
+Member = namedtuple("Member", ["type", "ref", "role", "coords"], defaults=(None,))
+# OSM type of every record type. Node, way and relation ids overlap, so objects are identified by (type, id).
+OSM_TYPES = {Node: "node", Way: "way", Relation: "relation"}
+
+CHUNK_SIZE = 1048576 # Bytes read from the response at a time
+_WHITESPACE = " \t\n\r"
+_OSM_BASE = re.compile(r'"timestamp_osm_base"\s*:\s*"([^"]+)"')
+EMPTY_TAGS = {} # Shared by all elements without tags, must not be modified
+
+
+class TagTable:
+    """
+    Interns the tags of elements while they are read.
+    Elements with the same tags, in the same order and at most MAX_TAGS of them, get the same dictionary,
+    e.g. every building=yes. Keys, and the values of shared tags, are interned strings.
+    The returned dictionaries are shared and must not be modified.
+
+    Only the MAX_SETS most recently used tag sets are kept, so tag sets that do not repeat, 
+    such as those of named objects, are dropped again and the table does not grow with the response. 
+    """
+    __slots__ = ("shared", "maxSets")
+    MAX_TAGS = 4 # Larger tag sets are nearly always unique, e.g. because of names or addresses
+    MAX_SETS = 4096
+
+    def __init__(self, maxSets:int = None):
+        self.shared:OrderedDict = OrderedDict() # Items of the shared dictionary -> the shared dictionary
+        self.maxSets:int = maxSets if maxSets is not None else self.MAX_SETS
+
+    def __len__(self) -> int:
+        return len(self.shared)
+
+    def __call__(self, tags:dict) -> dict:
+        if not tags:
+            return EMPTY_TAGS
+        if len(tags) > self.MAX_TAGS:
+            return {sys.intern(key): value for key, value in tags.items()}
+        items = tuple(tags.items())
+        shared = self.shared.get(items)
+        if shared is not None:
+            self.shared.move_to_end(items)
+            return shared
+
+        shared = {sys.intern(key): sys.intern(value) for key, value in items}
+        # Keyed by the interned strings, so the strings of tags are not kept alive next to them
+        self.shared[tuple(shared.items())] = shared
+        if len(self.shared) > self.maxSets:
+            self.shared.popitem(last=False)
+        return shared
+
+
+def fromElement(element:dict, tagTable:TagTable = None):
+    """
+    Converts one element of an overpass json response into a Node, Way or Relation record.
+    Returns None for other element types, such as areas or counts.
+    """
+    elementType = element.get("type")
+    tags = element.get("tags", EMPTY_TAGS)
+    if tagTable is not None:
+        tags = tagTable(tags)
+    if elementType == "node":
+        return Node(element["id"], tags, element["lat"], element["lon"])
+    if elementType == "way":
+        return Way(element["id"], tags, array('q', element.get("nodes", ())), _coords(element))
+    if elementType == "relation":
+        members = tuple(Member(m["type"], m["ref"], m.get("role", ""), _coords(m)) for m in element.get("members", ()))
+        return Relation(element["id"], tags, members)
+    return None
+
+
+def _coords(element:dict) -> tuple:
+    """
+    Returns the inline geometry of a way, relation member or node member as (lon, lat) pairs, or None.
+    Overpass writes null for the nodes it leaves out, a geometry with nulls is incomplete and also None.
+    """
+    if "geometry" in element:
+        geometry = element["geometry"]
+        if None in geometry:
+            return None
+        return tuple((p["lon"], p["lat"]) for p in geometry)
+    if "lat" in element:
+        return ((element["lon"], element["lat"]),)
+    return None
+
+
+def fromOverpyResult(res, tagTable:TagTable = None):
+    """
+    Yields the nodes, ways and relations of an overpy.Result as records, in that order.
+    """
+    if tagTable is None:
+        tagTable = TagTable()
+    for node in res.nodes:
+        yield Node(node.id, tagTable(node.tags), float(node.lat), float(node.lon))
+    for way in res.ways:
+        yield Way(way.id, tagTable(way.tags), array('q', way._node_ids))
+    for relation in res.relations:
+        yield fromOverpyRelation(relation, tagTable)
+
+
+def fromOverpyRelation(relation, tagTable:TagTable = None) -> Relation:
+    """ Converts an overpy.Relation into a Relation record. """
+    members = tuple(Member(m._type_value, m.ref, m.role) for m in relation.members)
+    tags = tagTable(relation.tags) if tagTable is not None else relation.tags
+    return Relation(relation.id, tags, members)
+
+
+def iterElements(stream, chunkSize:int = CHUNK_SIZE, meta:dict = None):
+    """
+    Reads an overpass json response from stream and yields its elements as records while it is being read.
+
+    :param stream: a binary file-like object with a read method, e.g. an http response or a gzip file.
+    :param chunkSize: number of bytes to read at a time.
+    :param meta: optional dictionary that receives "timestamp_osm_base", the time of the data in the response.
+
+    :return: Node, Way and Relation records in the order of the response.
+    :rtype: generator.
+    """
+    decoder = json.JSONDecoder()
+    tagTable = TagTable()
+    textDecoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            eof = True
+            buf = buf[pos:] + textDecoder.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + textDecoder.decode(chunk)
+        pos = 0
+
+    # Skips the header until the start of the elements array.
+    while True:
+        if meta is not None and "timestamp_osm_base" not in meta:
+            osmBase = _OSM_BASE.search(buf)
+            if osmBase:
+                meta["timestamp_osm_base"] = osmBase.group(1)
+        start = buf.find('"elements"', pos)
+        if start != -1:
+            bracket = buf.find("[", start)
+            if bracket != -1:
+                pos = bracket + 1
+                break
+        if eof:
+            raise ValueError("Response does not contain any elements")
+        # The header is only a few hundred bytes, it is kept whole until the elements start, 
+        # so the searches above also find matches that are split over several reads. 
+        fill()
+
+    while True:
+        while pos < len(buf) and (buf[pos] in _WHITESPACE or buf[pos] == ","):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("Response ended inside the elements array")
+            fill()
+            continue
+        if buf[pos] == "]":
+            pos += 1
+            break
+
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The element is not completely read yet.
+            if eof:
+                raise
+            fill()
+            continue
+        pos = end
+
+        record = fromElement(element, tagTable)
+        if record is not None:
+            yield record
+
+    # Overpass reports errors such as timeouts in a remark after the elements.
+    rest = buf[pos:]
+    buf = ""
+    pos = 0
+    while not eof:
+        fill()
+        rest += buf
+        buf = ""
+    if '"remark"' in rest and "runtime error" in rest:
+        remark = rest[rest.find('"remark"'):].split('"')[3]
+        raise RuntimeError(f"Overpass returned an incomplete response: {remark}")
@@ -0,0 +1,85 @@
+from qgis.core import QgsTask, QgsMessageLog, Qgis
+
+from .query import QueryCancelled
+from .parser_qgis import ParseCancelled
+from .utilities.tools import getOsmBboxString
+
+
+class RunAborted(Exception):
+    """ Raised by Runner.extract when the area can not be processed. The message is shown to the user. """
+
+
+class ExtractionTask(QgsTask):
+    """
+    Runs the query, parse, buffer and save stages of a Runner in the background with Runner.extract,
+    and adds the layers to the project when done.
+
+    Progress is reported from inside the download and parse loops and cancelling stops the run
+    mid download or mid parse. Several tasks can run at the same time.
+    """
+    DESCRIPTION = "OSM to IMM"
+    PARSE_START = 25 # Progress in percent when parsing starts
+    PARSE_END = 85 # Progress in percent when parsing is done
+
+    def __init__(self, runner):
+        super().__init__(f"{self.DESCRIPTION} ({getOsmBboxString(runner.bbox)})", QgsTask.CanCancel)
+        self.runner = runner
+        self.layers:dict = None
+        self.totalElements:int = None # Expected number of parsed elements, if known
+        self.exception:Exception = None
+
+    def work(self) -> dict:
+        """ The work of run, in a background thread. Returns None if the run was cancelled. """
+        return self.runner.extract(self)
+
+    def run(self) -> bool:
+        try:
+            self.layers = self.work()
+        except (QueryCancelled, ParseCancelled):
+            return False
+        except RunAborted as e:
+            self.exception = e
+            return False
+        except Exception as e:
+            self.exception = e
+            QgsMessageLog.logMessage(f"{type(e).__name__}: {e}", "OSM to IMM", Qgis.Critical)
+            return False
+        return self.layers is not None and not self.isCanceled()
+
+    def parsed(self, count:int) -> None:
+        """ Called by Parser.parse with the number of elements parsed so far. """
+        if self.totalElements:
+            share = min(1, count / self.totalElements)
+            self.setProgress(self.PARSE_START + share * (self.PARSE_END - self.PARSE_START))
+
+    def finished(self, result:bool) -> None:
+        """ Runs in the main thread once run has returned. """
+        if result:
+            self.runner.addLayers(self.layers)
+            self.runner.notify("OSM to IMM", "Layers added to the project", Qgis.Success)
+        elif self.isCanceled():
+            self.runner.notify("OSM to IMM", "Run cancelled", Qgis.Info)
+        elif self.exception is not None:
+            self.runner.notify("OSM to IMM error", str(self.exception), Qgis.Critical)
+
+
+class RefreshTask(ExtractionTask):
+    """
+    Runs Runner.refresh in the background, which patches the geopackages in the output location with the objects
+    that changed since they were written. Cancelling stops the run before the first layer is patched.
+    """
+    DESCRIPTION = "OSM to IMM refresh"
+
+    def work(self) -> dict:
+        """ Returns (nDeleted, nAdded) per patched feature, see Runner.refresh. """
+        return self.runner.refresh(self)
+
+    def finished(self, result:bool) -> None:
+        """ Runs in the main thread once run has returned. """
+        if result:
+            self.runner.reloadLayers()
+            nDeleted = sum(counts[0] for counts in self.layers.values())
+            nAdded = sum(counts[1] for counts in self.layers.values())
+            self.runner.notify("OSM to IMM", f"Layers refreshed, {nDeleted} features removed and {nAdded} added", Qgis.Success)
+        else:
+            super().finished(result)
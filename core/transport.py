@@ -0,0 +1,219 @@
+import base64
+import http.client
+import threading
+import zlib
+from urllib.parse import unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+
+class Response:
+    """
+    A response from Transport.post. The body is decompressed while it is read.
+    Reading the body to the end and closing the response returns the connection to the pool.
+    """
+    def __init__(self, transport:"Transport", key:tuple, conn:http.client.HTTPConnection, response:http.client.HTTPResponse):
+        self.transport:"Transport" = transport
+        self.key:tuple = key
+        self.conn:http.client.HTTPConnection = conn
+        self.response:http.client.HTTPResponse = response
+        self.status:int = response.status
+        self.code:int = response.status # Same name as urllib responses
+        self.headers = response.headers
+        self.__pending:bytes = b""
+        self.__finished:bool = False
+
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self.__decompressor = None
+        self.__deflate:bool = encoding == "deflate"
+
+    def getheader(self, name:str, default = None):
+        return self.response.getheader(name, default)
+
+    def __decompress(self, data:bytes) -> bytes:
+        try:
+            return self.__decompressor.decompress(data)
+        except zlib.error:
+            if not self.__deflate:
+                raise
+            # Some servers send raw deflate data without the zlib header.
+            self.__deflate = False
+            self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.__decompressor.decompress(data)
+
+    def read(self, size:int = -1) -> bytes:
+        """ Returns up to size decompressed bytes of the body, or all of the remaining body if size is negative. """
+        if self.__decompressor is None:
+            data = self.response.read() if size < 0 else self.response.read(size)
+            if not data or size < 0:
+                self.__finished = True
+            return data
+
+        chunkSize = size if size > 0 else self.transport.chunkSize
+        out = [self.__pending]
+        length = len(self.__pending)
+        while size < 0 or length < size:
+            raw = self.response.read(chunkSize)
+            if not raw:
+                out.append(self.__decompressor.flush())
+                self.__finished = True
+                break
+            data = self.__decompress(raw)
+            out.append(data)
+            length += len(data)
+        data = b"".join(out)
+        if size < 0:
+            self.__pending = b""
+            return data
+        self.__pending = data[size:]
+        return data[:size]
+
+    def close(self) -> None:
+        """ Returns the connection to the pool if the body was read completely, otherwise closes it. """
+        if self.conn is None:
+            return
+        if self.__finished and not self.response.will_close:
+            self.transport.release(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Transport:
+    """
+    Sends http requests over pooled keep-alive connections and asks for gzip or deflate compressed responses.
+    One Transport is safe to share between threads, every request uses its own connection.
+    Proxies are taken from the system settings like urllib does, HTTP_PROXY, HTTPS_PROXY and NO_PROXY.
+    https requests are tunneled through the proxy with CONNECT.
+    """
+    def __init__(self, connectTimeout:float = 30, readTimeout:float = 630, maxIdle:int = 8, chunkSize:int = 1048576):
+        self.connectTimeout:float = connectTimeout
+        self.readTimeout:float = readTimeout # Longer than the [timeout:600] setting of the queries
+        self.maxIdle:int = maxIdle
+        self.chunkSize:int = chunkSize
+        self.headers:dict = {
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            "User-Agent": "osm_2_imm QGIS plugin",
+        }
+        self.proxies:dict = getproxies() # Scheme -> proxy url
+        self.__idle:dict = {} # (scheme, host, port) -> list of idle connections
+        self.__lock = threading.Lock()
+
+    def post(self, url:str, body:bytes, headers:dict = None) -> Response:
+        """
+        Posts body to url and returns the response once the headers are received.
+        A pooled connection that was closed by the server is replaced by a new one and the request is sent again.
+        """
+        return self.request("POST", url, body, headers)
+
+    def get(self, url:str, headers:dict = None) -> Response:
+        """ Sends a GET request to url and returns the response once the headers are received. """
+        return self.request("GET", url, None, headers)
+
+    def request(self, method:str, url:str, body:bytes = None, headers:dict = None) -> Response:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        allHeaders = dict(self.headers)
+        if body is not None:
+            allHeaders["Content-Type"] = "application/x-www-form-urlencoded"
+        if headers is not None:
+            allHeaders.update(headers)
+
+        proxy = self.proxy(parts.scheme, parts.hostname)
+        if proxy is not None and parts.scheme == "http":
+            # Plain http goes to the proxy with the full url, https is tunneled, see acquire
+            path = parts._replace(fragment="").geturl()
+            allHeaders.update(proxy[2])
+
+        conn, reused = self.acquire(key, proxy=proxy)
+        try:
+            conn.request(method, path, body, allHeaders)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+            conn, _ = self.acquire(key, fresh=True, proxy=proxy)
+            try:
+                conn.request(method, path, body, allHeaders)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        return Response(self, key, conn, response)
+
+    def proxy(self, scheme:str, host:str) -> tuple:
+        """ 
+        Returns (host, port, headers) of the proxy for requests to host, where headers holds the proxy credentials, 
+        or None if host is reached directly, also when it is excluded by NO_PROXY. 
+        """
+        proxyUrl = self.proxies.get(scheme)
+        if not proxyUrl or proxy_bypass(host):
+            return None
+        if "://" not in proxyUrl:
+            proxyUrl = "http://" + proxyUrl
+        parts = urlsplit(proxyUrl)
+        headers = {}
+        if parts.username is not None:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        return parts.hostname, parts.port, headers
+
+    def acquire(self, key:tuple, fresh:bool = False, proxy:tuple = None) -> tuple:
+        """ 
+        Returns an idle connection for key, or a new one, and whether it was reused. 
+        New connections go through proxy, as returned by Transport.proxy, if it is given. 
+        """
+        if not fresh:
+            with self.__lock:
+                idle = self.__idle.get(key)
+                if idle:
+                    return idle.pop(), True
+
+        scheme, host, port = key
+        connectHost, connectPort = (host, port) if proxy is None else proxy[:2]
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(connectHost, connectPort, timeout=self.connectTimeout)
+            if proxy is not None:
+                conn.set_tunnel(host, port, headers=proxy[2])
+        else:
+            conn = http.client.HTTPConnection(connectHost, connectPort, timeout=self.connectTimeout)
+        conn.connect()
+        conn.sock.settimeout(self.readTimeout)
+        return conn, False
+
+    def release(self, key:tuple, conn:http.client.HTTPConnection) -> None:
+        """ Puts conn back into the pool, or closes it if the pool is full. """
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.maxIdle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """ Closes all idle connections. """
+        with self.__lock:
+            for idle in self.__idle.values():
+                for conn in idle:
+                    conn.close()
+            self.__idle = {}
@@ -1,3 +1,5 @@
+import math
+
 from qgis.core import QgsRectangle, QgsVectorLayer, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
 
 def camelCaseSplit(str):
@@ -63,4 +65,32 @@ def transformQLayer(project:QgsProject, qLayer:QgsVectorLayer, crsSrc:QgsCoordin
     pr.addFeatures(feats)
     vl.updateExtents()
 
-    return vl
\ No newline at end of file
+    return vl
+
+def splitBbox(qRect: QgsRectangle, tileSize: float) -> list:
+    """
+    Splits qRect into a grid of tiles no larger than tileSize x tileSize. 
+
+    :param qRect: the bounding box to split, in wgs84 coordinates. 
+    :type qRect: QgsRectangle. 
+    :param tileSize: the maximum width and height of a tile in degrees. 
+    :type tileSize: float. 
+
+    :return: the tiles, ordered row by row from the south west corner. 
+    :rtype: list of QgsRectangle. 
+    """
+    cols = max(1, math.ceil(qRect.width() / tileSize))
+    rows = max(1, math.ceil(qRect.height() / tileSize))
+    dx = qRect.width() / cols
+    dy = qRect.height() / rows
+
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            xMin = qRect.xMinimum() + col * dx
+            yMin = qRect.yMinimum() + row * dy
+            # Uses the outer edges of qRect for the last tiles to avoid gaps from rounding. 
+            xMax = qRect.xMaximum() if col == cols - 1 else xMin + dx
+            yMax = qRect.yMaximum() if row == rows - 1 else yMin + dy
+            tiles.append(QgsRectangle(xMin, yMin, xMax, yMax))
+    return tiles
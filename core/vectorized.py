@@ -0,0 +1,121 @@
+"""
+Geometry operations on arrays of shapely 2 geometries, used by the shapely parser engine, see core.parser_shapely.
+
+Coordinates are collected per geometry type while parsing and every array is built, buffered or overlaid
+with one call into GEOS instead of one call per feature. Coordinates are (lon, lat) pairs or numpy arrays
+of shape (n, 2), as taken by core.wkb. Only uses numpy and shapely, the QGIS layers are filled by the parser.
+"""
+try:
+    import numpy as np
+    import shapely
+except ImportError: # shapely is only needed for the shapely engine
+    np = None
+    shapely = None
+
+
+def available() -> bool:
+    """ Returns True if shapely 2 is installed. """
+    return shapely is not None and int(shapely.__version__.split(".")[0]) >= 2
+
+
+def requireShapely() -> None:
+    if not available():
+        raise ImportError("The shapely engine requires shapely 2 (pip install \"shapely>=2\")")
+
+
+def _flat(coordsList:list) -> tuple:
+    """ Returns the coordinates of coordsList as one array of shape (n, 2) and the position in coordsList of every point. """
+    if len(coordsList) == 0:
+        return np.empty((0, 2), dtype=np.float64), np.empty(0, dtype=np.intp)
+    lengths = [len(coords) for coords in coordsList]
+    flat = np.concatenate([np.asarray(coords, dtype=np.float64).reshape(-1, 2) for coords in coordsList])
+    return flat, np.repeat(np.arange(len(coordsList)), lengths)
+
+
+def points(coords:list):
+    """ Returns an array with a point at every coord. """
+    return shapely.points(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+
+
+def multiPoints(coordsList:list):
+    """ Returns an array with a multipoint for every list of coords, every list must have a point. """
+    flat, indices = _flat(coordsList)
+    return shapely.multipoints(shapely.points(flat), indices=indices)
+
+
+def lineStrings(coordsList:list):
+    """ Returns an array with a line through every list of coords, every list must have two points. """
+    flat, indices = _flat(coordsList)
+    return shapely.linestrings(flat, indices=indices)
+
+
+def mergedLines(linesList:list):
+    """
+    Returns an array with the lines of every entry of linesList, a list of coordinate lists, joined where they meet.
+    Lines that can not be joined into one are kept as a multiline, like QgsGeometry.mergeLines.
+    """
+    lines = [coords for entry in linesList for coords in entry]
+    indices = np.repeat(np.arange(len(linesList)), [len(entry) for entry in linesList])
+    return shapely.line_merge(shapely.multilinestrings(lineStrings(lines), indices=indices))
+
+
+def polygons(rings:list):
+    """ Returns an array with a polygon without holes for every closed ring. """
+    flat, indices = _flat(rings)
+    return shapely.polygons(shapely.linearrings(flat, indices=indices))
+
+
+def centroids(rings:list):
+    """ Returns an array with the centroid of the area of every closed ring. """
+    return shapely.centroid(polygons(rings))
+
+
+def multiPolygons(polygonsList:list):
+    """
+    Returns an array with a multipolygon for every entry of polygonsList, a list of polygons as returned
+    by core.multipolygon.assemble, each a list of rings with the outer ring first. Every entry must have a polygon.
+    """
+    rings = []
+    ringPolygons = [] # Position of the polygon of every ring
+    polygonGeoms = [] # Position of the multipolygon of every polygon
+    for i, entry in enumerate(polygonsList):
+        for polygonRings in entry:
+            ringPolygons.extend([len(polygonGeoms)] * len(polygonRings))
+            polygonGeoms.append(i)
+            rings.extend(polygonRings)
+    flat, indices = _flat(rings)
+    # With indices the first ring of every polygon is its shell and the others its holes
+    parts = shapely.polygons(shapely.linearrings(flat, indices=indices), indices=ringPolygons)
+    return shapely.multipolygons(parts, indices=polygonGeoms)
+
+
+def radii(values:list, scheme:dict):
+    """ Returns the buffer radius in scheme of every value, NaN for values without one. """
+    return np.array([scheme.get(value, np.nan) for value in values], dtype=np.float64)
+
+
+def buffered(geoms, distances, quadSegs:int = 5):
+    """ Returns geoms buffered by distances, one radius per geometry, with quadSegs segments per quarter circle. """
+    return shapely.buffer(geoms, distances, quad_segs=quadSegs)
+
+
+def subtract(areas, geoms):
+    """
+    Returns areas without the parts covered by geoms, one geometry per area.
+
+    The geometries that intersect an area are found with an STRtree and united before they are subtracted,
+    so an area is only compared with the geometries near it. Areas without any are returned unchanged.
+    """
+    areas = np.asarray(areas, dtype=object)
+    geoms = np.asarray(geoms, dtype=object)
+    tree = shapely.STRtree(geoms)
+    areaIndex, geomIndex = tree.query(areas, predicate="intersects")
+
+    covers = np.empty(len(areas), dtype=object)
+    for i in np.unique(areaIndex):
+        covers[i] = shapely.union_all(geoms[geomIndex[areaIndex == i]])
+    hit = ~shapely.is_missing(covers)
+
+    result = areas.copy()
+    result[hit] = shapely.difference(areas[hit], covers[hit])
+    return result
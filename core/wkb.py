@@ -0,0 +1,61 @@
+"""
+Well-known binary (WKB) encoding of point, line and polygon geometries from (lon, lat) coordinates,
+given as sequences of pairs or as numpy arrays of shape (n, 2).
+
+Only uses the standard library, so geometries can be built in worker processes without QGIS
+and handed to the main process as bytes, where QgsGeometry.fromWkb is the only step into QGIS.
+All geometries are two dimensional and little endian.
+"""
+import struct
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+
+_HEADER = struct.Struct("<BI")
+_COUNT = struct.Struct("<I")
+
+
+def _header(wkbType:int) -> bytes:
+    return _HEADER.pack(1, wkbType)
+
+
+def _coords(coords) -> bytes:
+    """ Returns the number of points followed by the points. """
+    if hasattr(coords, "tobytes"): # numpy array of shape (n, 2), e.g. from NodeStore.lonLat
+        return _COUNT.pack(len(coords)) + coords.astype("<f8", copy=False).tobytes()
+    flat = [c for point in coords for c in point]
+    return _COUNT.pack(len(flat) // 2) + struct.pack(f"<{len(flat)}d", *flat)
+
+
+def point(coord:tuple) -> bytes:
+    """ Returns the WKB of a point at coord, (lon, lat). """
+    return _header(POINT) + struct.pack("<2d", *coord)
+
+
+def multiPoint(coords) -> bytes:
+    """ Returns the WKB of a multipoint with a point at every coord. """
+    return _header(MULTIPOINT) + _COUNT.pack(len(coords)) + b"".join(point(coord) for coord in coords)
+
+
+def lineString(coords) -> bytes:
+    """ Returns the WKB of a line through coords. """
+    return _header(LINESTRING) + _coords(coords)
+
+
+def multiLineString(lines) -> bytes:
+    """ Returns the WKB of a multiline, lines is a list of coordinate lists. """
+    return _header(MULTILINESTRING) + _COUNT.pack(len(lines)) + b"".join(lineString(line) for line in lines)
+
+
+def polygon(rings) -> bytes:
+    """ Returns the WKB of a polygon, rings is a list of closed coordinate lists with the outer ring first. """
+    return _header(POLYGON) + _COUNT.pack(len(rings)) + b"".join(_coords(ring) for ring in rings)
+
+
+def multiPolygon(polygons) -> bytes:
+    """ Returns the WKB of a multipolygon, polygons is a list of polygons as taken by polygon. """
+    return _header(MULTIPOLYGON) + _COUNT.pack(len(polygons)) + b"".join(polygon(rings) for rings in polygons)
@@ -74,6 +74,9 @@ class Main:
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
 
+        # Running extraction tasks, python must keep a reference until QGIS is done with them
+        self.tasks = []
+
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
         """Get the translation for a string using Qt translation API.
@@ -248,6 +251,21 @@ class Main:
                 outLoc = None
             
             runner = Runner(self.iface)
-            runner.setProject(project).setBbox(bbox).setOutLoc(outLoc).qgsMain()
+            runner.setProject(project).setBbox(bbox).setOutLoc(outLoc)
+            if outLoc is not None and self.dlg.refresh.isChecked():
+                # Patches the saved layers with the changed objects, or runs a full extraction the first time
+                task = runner.refreshTask()
+            else:
+                task = runner.qgsMain()
+            # The task manager deletes a task once it is done, so the reference is dropped from its own signals 
+            # instead of asking an old task for its status later. 
+            self.tasks.append(task)
+            task.taskCompleted.connect(lambda: self.forgetTask(task))
+            task.taskTerminated.connect(lambda: self.forgetTask(task))
+
+    def forgetTask(self, task):
+        """Drops the reference to a task that is done, called from its taskCompleted and taskTerminated signals."""
+        if task in self.tasks:
+            self.tasks.remove(task)
 
 
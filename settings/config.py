@@ -16,12 +16,16 @@ class Config:
     :vartype sortedTags: Dict
     :ivar reversedTags: contains tags as keys and the features containing that tag as values in a list. 
     :vartype reversedTags: Dict
+    :ivar tagIndex: contains (key, value) pairs as keys and the features that (key, value) is an input tag of as values in a tuple. 
+    :vartype tagIndex: Dict
     :ivar features: Lists the different categories. 
     :vartype features: List
     :ivar configJson: the unedited configuration.json
     :vartype configJson: Dict
     :ivar polygonFeatures: the unedited polygon-features.json
     :vartype polygonFeatures: Dict
+    :ivar polygonRules: polygon-features.json compiled to a tuple (all, whitelist, blacklist) per osm key, see isPolygonTag
+    :vartype polygonRules: Dict
     :ivar bufferSettings: the unedited bufferingSettings.json
     :vartype polygonFeatures: Dict
     :ivar projectedCrs: epsg code for the projected reference system used
@@ -34,6 +38,7 @@ class Config:
     def __init__(self):
         self.sortedTags={} # dictionary that contains exactly one key for every osm key to be called and the list of osm values to that key as value
         self.reversedTags={}
+        self.tagIndex={}
         self.features=[] #list of the different layers. ex. voidGreyAreas or networkStreet
         self.__configurationFilePath = 'configuration.json'
         self.__bufferingSettingsFilePath = 'bufferingSettings.json'
@@ -45,12 +50,14 @@ class Config:
 
         with importlib.resources.open_text(static, self.__polygon_featuresFilePath) as file:
             self.polygonFeatures = json.load(file)
+        self.polygonRules = self.__compilePolygonRules(self.polygonFeatures)
 
         with importlib.resources.open_text(static, self.__bufferingSettingsFilePath) as file:
             self.bufferSettings = json.load(file)
 
         self.__sortTags()
         self.__reverseTags()
+        self.__indexTags()
         # Addign the CRS:s chosen
         self.projectedCrs = self.configJson["crs"]["projected"]
         self.outputCrs = self.configJson["crs"]["output"]
@@ -110,6 +117,47 @@ class Config:
             self.features.append(feature)
 
 
+    def __indexTags(self):
+        """ Compiles the input tags of all features into tagIndex, so the features of a tag is found with one lookup. """
+        index = {}
+        for feature in self.features:
+            for key, values in self.configJson[feature]['inputTags'].items():
+                for value in values:
+                    features = index.setdefault((key, value), [])
+                    if feature not in features:
+                        features.append(feature)
+        self.tagIndex = {pair: tuple(features) for pair, features in index.items()}
+
+    @staticmethod
+    def __compilePolygonRules(polygonFeatures:list) -> dict:
+        """
+        Compiles the rules of polygon-features.json into one rule per key. 
+        A rule is a tuple (all, whitelist, blacklist) where all is True if any value makes a polygon, 
+        whitelist is a set of values that make a polygon and blacklist is a set of values that do not, or None. 
+        Rules for the same key are combined so that a tag matches if it matches any of them. 
+        """
+        rules = {}
+        for rule in polygonFeatures:
+            isAll, whitelist, blacklist = rules.get(rule['key'], (False, frozenset(), None))
+            if rule['polygon'] == 'all':
+                isAll = True
+            elif rule['polygon'] == 'whitelist':
+                whitelist = whitelist.union(rule['values'])
+            elif rule['polygon'] == 'blacklist':
+                # Not in A or not in B is the same as not in both
+                values = frozenset(rule['values'])
+                blacklist = values if blacklist is None else blacklist.intersection(values)
+            rules[rule['key']] = (isAll, whitelist, blacklist)
+        return rules
+
+    def isPolygonTag(self, key:str, value:str) -> bool:
+        """ Returns True if the tag key=value makes a closed way a polygon according to polygon-features.json. """
+        try:
+            isAll, whitelist, blacklist = self.polygonRules[key]
+        except KeyError:
+            return False
+        return isAll or value in whitelist or (blacklist is not None and value not in blacklist)
+
     # Sorting tags and placing them in sorted tags.
     def __sortTags(self):
         for feature in self.layerDefenition.values():
@@ -0,0 +1,111 @@
+# coding=utf-8
+"""Tests the disk cache of overpass responses.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cache import ResponseCache, TeeReader
+
+QUERY = '[out:json]; node["amenity"="fountain"]; out;'
+RESPONSE = b'{"version": 0.6, "elements": [' + b'{"type": "node", "id": 1, "lat": 45.46, "lon": 9.19},' * 100 + b']}'
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Test expiry, eviction and streamed writes of ResponseCache."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.tmpDir.name, ttl=60)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def age(self, queryString:str, accessed:float, written:float = None) -> None:
+        """ Sets the access and modification time of the entry of queryString. """
+        path = self.cache.path(queryString)
+        os.utime(path, (accessed, os.path.getmtime(path) if written is None else written))
+
+    def test_normalized(self):
+        """Queries that only differ in whitespace share an entry."""
+        self.cache.put(QUERY, RESPONSE)
+        self.assertEqual(self.cache.get('\n    [out:json];\n    node["amenity"="fountain"];\n    out;\n    '), RESPONSE)
+
+    def test_ttl(self):
+        """Entries older than ttl are missing and removed, from get as well as from open."""
+        self.cache.put(QUERY, RESPONSE)
+        now = time.time()
+        self.age(QUERY, now, now - 30)
+        with self.cache.open(QUERY) as file:
+            self.assertEqual(file.read(), RESPONSE)
+
+        self.age(QUERY, now, now - 61)
+        self.assertIsNone(self.cache.get(QUERY))
+        self.assertFalse(os.path.exists(self.cache.path(QUERY)))
+
+        self.cache.put(QUERY, RESPONSE)
+        self.age(QUERY, now, now - 61)
+        self.assertIsNone(self.cache.open(QUERY))
+
+    def test_lru_eviction(self):
+        """The least recently used entries are evicted first until the cache fits in maxSize."""
+        queries = [f'[out:json];node({i});out;' for i in range(3)]
+        for query in queries:
+            self.cache.put(query, RESPONSE)
+        now = time.time()
+        for i, query in enumerate(queries):
+            self.age(query, now - 100 + i)
+        # Reading the oldest entry makes it the most recently used
+        self.assertEqual(self.cache.get(queries[0]), RESPONSE)
+
+        entrySize = os.path.getsize(self.cache.path(queries[0]))
+        self.cache.maxSize = 2 * entrySize
+        self.cache.evict()
+        self.assertEqual([os.path.exists(self.cache.path(query)) for query in queries], [True, False, True])
+
+        self.cache.maxSize = entrySize
+        self.cache.evict()
+        self.assertEqual([os.path.exists(self.cache.path(query)) for query in queries], [True, False, False])
+
+    def test_streamed(self):
+        """A response read to the end through a TeeReader is cached when the writer is committed."""
+        writer = self.cache.writer(QUERY)
+        stream = TeeReader(io.BytesIO(RESPONSE), writer)
+        while stream.read(7):
+            pass
+        self.assertIsNone(self.cache.get(QUERY)) # Not visible before commit
+        writer.commit()
+        self.assertEqual(self.cache.get(QUERY), RESPONSE)
+
+    def test_incomplete_discarded(self):
+        """A response that is not read to the end is discarded and leaves the cached entry as it was."""
+        self.cache.put(QUERY, b'{"elements": []}')
+        writer = self.cache.writer(QUERY)
+        stream = TeeReader(io.BytesIO(RESPONSE), writer)
+        stream.read(16)
+        writer.discard()
+
+        self.assertEqual(self.cache.get(QUERY), b'{"elements": []}')
+        self.assertEqual([name for name in os.listdir(self.tmpDir.name) if name.endswith(".tmp")], [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ResponseCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
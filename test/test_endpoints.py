@@ -0,0 +1,152 @@
+# coding=utf-8
+"""Tests the overpass endpoint pool against local stand-in servers.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.endpoints import EndpointPool
+from core.transport import Transport
+
+
+class Busy(Exception):
+    """Stand-in for overpy.exception.OverpassTooManyRequests."""
+
+
+def startServer(status):
+    """Starts an interpreter stand-in answering every query with status."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            # No status page, the pool falls back to its own bookkeeping.
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.server.hits += 1
+            body = b'{"elements": []}'
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class EndpointPoolTest(unittest.TestCase):
+    """Test failover and load distribution of EndpointPool."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.transport = Transport(connectTimeout=5, readTimeout=5)
+        self.servers = []
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.transport.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def url(self, status):
+        server = startServer(status)
+        self.servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/api/interpreter"
+
+    def request(self, url):
+        with self.transport.post(url, b"[out:json];out;") as response:
+            body = response.read()
+            if response.status == 429:
+                raise Busy()
+            return body
+
+    def test_failover(self):
+        """A busy endpoint cools down and the query is answered by the other one."""
+        pool = EndpointPool([self.url(429), self.url(200)], self.transport, retryOn=(Busy,))
+        for _ in range(4):
+            self.assertEqual(pool.run(self.request), b'{"elements": []}')
+
+        busy, healthy = pool.stats()
+        self.assertLessEqual(self.servers[0].hits, 1)
+        self.assertEqual(self.servers[1].hits, 4)
+        self.assertEqual(busy["failures"], self.servers[0].hits)
+        self.assertEqual(healthy["failures"], 0)
+        self.assertEqual(healthy["scheduler"]["requests"], 4)
+        self.assertEqual(busy["scheduler"]["retries"], self.servers[0].hits)
+        self.assertEqual(busy["scheduler"]["queueDepth"], 0)
+
+    def test_unreachable_endpoint(self):
+        """Connection errors count as failures and fail over."""
+        server = startServer(200)
+        port = server.server_port
+        server.server_close()
+        pool = EndpointPool([f"http://127.0.0.1:{port}/api/interpreter", self.url(200)], self.transport, retryOn=(Busy,))
+        for _ in range(3):
+            pool.run(self.request)
+        self.assertEqual(self.servers[0].hits, 3)
+
+    def test_distribution(self):
+        """Concurrent queries are spread over healthy endpoints."""
+        pool = EndpointPool([self.url(200), self.url(200)], self.transport, retryOn=(Busy,))
+        threads = [threading.Thread(target=pool.run, args=(self.request,)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.servers[0].hits + self.servers[1].hits, 20)
+        self.assertGreater(self.servers[0].hits, 0)
+        self.assertGreater(self.servers[1].hits, 0)
+
+    def test_cancel_wait(self):
+        """A request waiting for a busy endpoint stops when it is cancelled, without being sent."""
+        from core.scheduler import QueryCancelled
+        pool = EndpointPool([self.url(200)], self.transport, retryOn=(Busy,))
+        pool.CANCEL_POLL = 0.05
+        pool.coolDown(pool.endpoints[0], time.time() + 60)
+        cancelAt = time.time() + 0.2
+        with self.assertRaises(QueryCancelled):
+            pool.run(self.request, isCanceled=lambda: time.time() > cancelAt)
+        self.assertLess(time.time() - cancelAt, 1)
+        self.assertEqual(self.servers[0].hits, 0)
+        self.assertEqual(pool.stats()[0]["scheduler"]["queueDepth"], 0)
+
+    def test_retry_budget(self):
+        """The pool gives up once the retry budget is used."""
+        from core.scheduler import RetryBudgetExceeded
+        pool = EndpointPool([self.url(429)], self.transport, retryOn=(Busy,), maxRetries=1)
+        pool.endpoints[0].scheduler.baseDelay = 0.01
+        with self.assertRaises(RetryBudgetExceeded):
+            pool.run(self.request)
+        self.assertEqual(self.servers[0].hits, 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(EndpointPoolTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,154 @@
+# coding=utf-8
+"""Tests refreshing saved layers with the objects that changed since they were written.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import re
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from qgis.core import QgsApplication, QgsRectangle, QgsVectorLayer, QgsFeature, QgsField, QgsGeometry, QgsPointXY
+    from qgis.PyQt.QtCore import QVariant
+    from core.incremental import RefreshState, patchLayer
+    from core.utilities.tools import getOsmBboxString
+    QGIS = True
+except ImportError: # The tests need QGIS
+    QGIS = False
+
+try:
+    from core.query import Query
+    from settings.config import Config
+    OVERPY = QGIS
+except ImportError: # The query also needs overpy
+    OVERPY = False
+
+BBOX = (9.18, 45.45, 9.20, 45.47) # west, south, east, north
+
+
+def setUpModule():
+    global QGIS_APP
+    if QGIS and QgsApplication.instance() is None:
+        QGIS_APP = QgsApplication([], False)
+        QGIS_APP.initQgis()
+
+
+def pointLayer(rows:list, withType:bool = True) -> "QgsVectorLayer":
+    """ Returns a memory layer with a point feature for every (type, id, name) in rows. """
+    vl = QgsVectorLayer("Point?crs=EPSG:4326", "points", "memory")
+    fields = [QgsField("OSM id", QVariant.LongLong)]
+    if withType:
+        fields.append(QgsField("OSM type", QVariant.String))
+    fields.append(QgsField("name", QVariant.String))
+    vl.dataProvider().addAttributes(fields)
+    vl.updateFields()
+
+    feats = []
+    for i, (osmType, osmId, name) in enumerate(rows):
+        f = QgsFeature(vl.fields())
+        f.setAttributes([osmId, osmType, name] if withType else [osmId, name])
+        f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(9.19 + i / 1000, 45.46)))
+        feats.append(f)
+    vl.dataProvider().addFeatures(feats)
+    return vl
+
+
+@unittest.skipUnless(QGIS, "QGIS is not installed")
+class RefreshStateTest(unittest.TestCase):
+    """Test storing the time of the written data per bbox."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_per_bbox(self):
+        """The timestamp of a bbox is read back by a new state, other bboxes have none."""
+        bbox = QgsRectangle(*BBOX)
+        self.assertIsNone(RefreshState(self.tmpDir.name).get(bbox))
+        RefreshState(self.tmpDir.name).set(bbox, "2026-10-17T08:15:02Z")
+
+        state = RefreshState(self.tmpDir.name)
+        self.assertEqual(state.get(bbox), "2026-10-17T08:15:02Z")
+        self.assertIsNone(state.get(QgsRectangle(9.0, 45.0, 9.1, 45.1)))
+
+    def test_unreadable(self):
+        """A state file that is not json is treated as empty."""
+        with open(os.path.join(self.tmpDir.name, RefreshState.FILE_NAME), "w") as file:
+            file.write("{not json")
+        self.assertIsNone(RefreshState(self.tmpDir.name).get(QgsRectangle(*BBOX)))
+
+    def test_now(self):
+        """now is the current time minus the margin, in the format of overpass."""
+        now = datetime.strptime(RefreshState.now(), RefreshState.TIME_FORMAT).replace(tzinfo=timezone.utc)
+        self.assertAlmostEqual((datetime.now(timezone.utc) - now).total_seconds(), timedelta(hours=1).total_seconds(), delta=5)
+
+
+@unittest.skipUnless(QGIS, "QGIS is not installed")
+class PatchLayerTest(unittest.TestCase):
+    """Test patching a saved layer by OSM type and id."""
+
+    def features(self, lyr) -> list:
+        return sorted((f["OSM type"], f["OSM id"], f["name"]) for f in lyr.getFeatures())
+
+    def test_type_and_id(self):
+        """Changed and removed objects are replaced or deleted, objects of another type with the same id are kept."""
+        lyr = pointLayer([("node", 1, "Fontana"), ("way", 1, "Via Dante"), ("node", 2, "Duomo"), ("node", 3, "Edicola")])
+        newLyr = pointLayer([("node", 1, "Fontana di Piazza Castello")])
+        changedIds = {("node", 1)}
+        currentIds = {("node", 1), ("way", 1), ("node", 2)}
+
+        self.assertEqual(patchLayer(lyr, newLyr, changedIds, currentIds), (2, 1))
+        self.assertEqual(self.features(lyr), [("node", 1, "Fontana di Piazza Castello"), ("node", 2, "Duomo"), ("way", 1, "Via Dante")])
+
+    def test_without_current_ids(self):
+        """Without the current ids only the changed objects are replaced."""
+        lyr = pointLayer([("node", 1, "Fontana"), ("node", 3, "Edicola")])
+        self.assertEqual(patchLayer(lyr, pointLayer([]), {("way", 3)}, None), (0, 0))
+        self.assertEqual(len(self.features(lyr)), 2)
+
+    def test_no_type_field(self):
+        """Layers written before the OSM type field existed can not be patched."""
+        with self.assertRaises(ValueError):
+            patchLayer(pointLayer([(None, 1, "Fontana")], withType=False), pointLayer([]), {("node", 1)}, None)
+
+
+@unittest.skipUnless(OVERPY, "QGIS or overpy is not installed")
+class RefreshQueryStringTest(unittest.TestCase):
+    """Test the query for the objects changed since a time."""
+
+    def test_newer(self):
+        """Every relevant tag is filtered on newer, and ways and relations with moved nodes are included."""
+        bbox = QgsRectangle(*BBOX)
+        since = "2026-10-01T00:00:00Z"
+        queryString = Query.refreshQueryString(bbox, Config(), since)
+
+        self.assertIn(f"[bbox:{getOsmBboxString(bbox)}]", queryString)
+        statements = re.findall(r'\b(?:node|way|rel|nw|nr|wr|nwr)\["[^;]*;', queryString)
+        self.assertGreater(len(statements), 0)
+        for statement in statements:
+            self.assertTrue(statement.endswith(f'(newer:"{since}");'), statement)
+        self.assertIn(f'node(newer:"{since}")->.movedNodes;', queryString)
+        self.assertIn("way(bn.movedNodes)->.movedWays;", queryString)
+        self.assertIn("(._;>;);", queryString)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(RefreshStateTest), unittest.makeSuite(PatchLayerTest), unittest.makeSuite(RefreshQueryStringTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
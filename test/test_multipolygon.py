@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Tests the multipolygon ring assembly.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.multipolygon import assemble, joinRings, ringArea, ringCentroid
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class MultipolygonTest(unittest.TestCase):
+    """Test joining member ways into rings and nesting them."""
+
+    def test_split_ring(self):
+        """A ring split over several ways, some reversed, is joined into one ring."""
+        ways = [
+            [(0, 0), (4, 0)],
+            [(4, 4), (4, 0)], # reversed
+            [(4, 4), (0, 4), (0, 0)],
+        ]
+        rings, nUnclosed = joinRings(ways)
+        self.assertEqual(nUnclosed, 0)
+        self.assertEqual(len(rings), 1)
+        self.assertEqual(rings[0][0], rings[0][-1])
+        self.assertEqual(len(rings[0]), 5)
+
+    def test_unclosed(self):
+        """Chains that do not close, e.g. from missing members, are dropped."""
+        rings, nUnclosed = joinRings([[(0, 0), (1, 0)], [(1, 0), (1, 1)]])
+        self.assertEqual(rings, [])
+        self.assertEqual(nUnclosed, 1)
+
+    def test_holes(self):
+        """Inner rings go to the smallest outer ring containing them."""
+        big = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        small = [(20, 0), (22, 0), (22, 2), (20, 2), (20, 0)]
+        hole = [(2, 2), (3, 2), (3, 3), (2, 3), (2, 2)]
+        stray = [(50, 50), (51, 50), (51, 51), (50, 50)]
+        polygons, nUnclosed = assemble([big, small], [hole, stray])
+        self.assertEqual(nUnclosed, 0)
+        self.assertEqual(polygons, [[small], [big, hole]])
+
+    def test_centroid(self):
+        """The centroid of an area, and the first point of a ring without area."""
+        ring = [(0, 0), (4, 0), (4, 2), (0, 2), (0, 0)]
+        self.assertEqual(ringCentroid(ring), (2, 1))
+        self.assertEqual(ringCentroid([(1, 1), (2, 2), (1, 1)]), (1, 1))
+
+    def test_centroid_precision(self):
+        """A 10 m square in Milano has its centroid in its middle, to well below a millimetre."""
+        west, south = 9.19, 45.46
+        width, height = 0.000128, 0.00009 # About 10 m in both directions
+        square = [(west, south), (west + width, south), (west + width, south + height), (west, south + height), (west, south)]
+        rings = [square]
+        if np is not None:
+            rings.append(np.array(square))
+        for ring in rings:
+            x, y = ringCentroid(ring)
+            self.assertAlmostEqual(x, west + width / 2, places=10)
+            self.assertAlmostEqual(y, south + height / 2, places=10)
+        self.assertAlmostEqual(ringArea(square) / (width * height), 1, places=9)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_centroid_array(self):
+        """Numpy rings, as from NodeStore.lonLat, give the same centroid as lists."""
+        ring = [(9.18, 45.46), (9.19, 45.46), (9.195, 45.47), (9.18, 45.47), (9.18, 45.46)]
+        x, y = ringCentroid(np.array(ring))
+        ex, ey = ringCentroid(ring)
+        self.assertAlmostEqual(x, ex, places=9)
+        self.assertAlmostEqual(y, ey, places=9)
+        self.assertIsInstance(x, float)
+        self.assertEqual(ringCentroid(np.array([(1.0, 1.0), (2.0, 2.0), (1.0, 1.0)])), (1, 1))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(MultipolygonTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
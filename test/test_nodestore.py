@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Tests the node coordinate store.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import nodestore
+from collections import Counter
+
+from core.nodestore import NodeStore, WayStore
+from core.stream import Way
+
+
+class NodeStoreTest(unittest.TestCase):
+    """Test lookups in NodeStore with and without numpy."""
+
+    def check(self, store):
+        for osmId, lon, lat in [(30, 9.3, 45.3), (10, 9.1, 45.1), (20, 9.2, 45.2)]:
+            store.add(osmId, lon, lat)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.point(20), (9.2, 45.2))
+        self.assertEqual(store.coords([10, 30, 10]), [(9.1, 45.1), (9.3, 45.3), (9.1, 45.1)])
+        self.assertIn(30, store)
+        self.assertNotIn(40, store)
+        with self.assertRaises(KeyError):
+            store.coords([10, 40])
+        with self.assertRaises(KeyError):
+            store.point(5)
+
+        # Nodes added after a lookup
+        store.add(5, 9.0, 45.0)
+        self.assertEqual(store.coords([5, 30]), [(9.0, 45.0), (9.3, 45.3)])
+
+    def test_dictionary(self):
+        """Lookups through the dictionary index."""
+        self.check(NodeStore(useNumpy=False))
+
+    @unittest.skipIf(nodestore.np is None, "numpy is not installed")
+    def test_numpy(self):
+        """Lookups through the sorted arrays."""
+        self.check(NodeStore())
+
+
+class WayStoreTest(unittest.TestCase):
+    """Test that WayStore only keeps the ways relations need."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.nodes = NodeStore()
+        for osmId in range(1, 5):
+            self.nodes.add(osmId, float(osmId), 0.0)
+
+    def test_needed(self):
+        """Unreferenced ways are not kept and a way is dropped after its last reference."""
+        store = WayStore(self.nodes, Counter({10: 2}))
+        store.add(Way(10, {}, (1, 2)))
+        store.add(Way(11, {}, (3, 4)))
+        self.assertEqual(len(store), 1)
+
+        self.assertEqual(store.coords(10), [(1.0, 0.0), (2.0, 0.0)])
+        self.assertIs(store.coords(10), store.coords(10))
+        with self.assertRaises(KeyError):
+            store.coords(11)
+
+        store.release(10)
+        self.assertEqual(len(store), 1)
+        store.release(10)
+        self.assertEqual(len(store), 0)
+
+    def test_streamed(self):
+        """Without the references every way is kept."""
+        store = WayStore(self.nodes)
+        store.add(Way(10, {}, (1, 2)))
+        store.add(Way(11, {}, (3, 4)))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.coords(11), [(3.0, 0.0), (4.0, 0.0)])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(NodeStoreTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Tests building way and relation geometries in the worker processes.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import parallel
+
+SPEC = {
+    "polygonRules": {"building": (True, set(), None)},
+    "features": {"volumeBuildings": ("polygon", ("building",)), "usesActivities": ("point", ("building",))},
+}
+
+WEST, SOUTH = 9.19, 45.46
+WIDTH, HEIGHT = 0.000128, 0.00009 # About 10 m in both directions
+SQUARE = [(WEST, SOUTH), (WEST + WIDTH, SOUTH), (WEST + WIDTH, SOUTH + HEIGHT), (WEST, SOUTH + HEIGHT), (WEST, SOUTH)]
+
+
+class BuildWayTest(unittest.TestCase):
+    """Test the geometries built by parallel.buildWay."""
+
+    def setUp(self):
+        parallel.initWorker(SPEC)
+
+    def tearDown(self):
+        parallel.initWorker(None)
+
+    def test_centroid_precision(self):
+        """The centroid of a 10 m building in Milano is in its middle, to well below a millimetre."""
+        geomWkb, merge = parallel.buildWay({"building": "yes"}, SQUARE, "point")
+        self.assertFalse(merge)
+        self.assertEqual(struct.unpack("<I", geomWkb[1:5])[0], 1) # Point
+        x, y = struct.unpack("<2d", geomWkb[5:])
+        self.assertAlmostEqual(x, WEST + WIDTH / 2, places=10)
+        self.assertAlmostEqual(y, SOUTH + HEIGHT / 2, places=10)
+
+    def test_polygon_or_line(self):
+        """Closed ways with polygon tags become polygons, other ways lines."""
+        polygon, _ = parallel.buildWay({"building": "yes"}, SQUARE, "polygon")
+        self.assertEqual(struct.unpack("<I", polygon[1:5])[0], 3) # Polygon
+        line, _ = parallel.buildWay({"highway": "footway"}, SQUARE, "line")
+        self.assertEqual(struct.unpack("<I", line[1:5])[0], 2) # LineString
+
+    def test_parse_chunk(self):
+        """Every feature of a job gets a record with the OSM id and type first in its attributes."""
+        records = parallel.parseChunk([("way", 7, {"building": "yes"}, ("volumeBuildings", "usesActivities"), SQUARE)])
+        self.assertEqual([(feature, prefix, attributes) for feature, prefix, _, attributes, _, _ in records],
+                         [("volumeBuildings", "way", [7, "way", "yes"]), ("usesActivities", "way", [7, "way", "yes"])])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(BuildWayTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Tests planning the overpass statements of the configuration.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import json
+import os
+import re
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.plan import planQuery, unionTags
+
+CONFIGURATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "settings", "static", "configuration.json")
+
+
+def config(configJson:dict) -> SimpleNamespace:
+    """ Returns an object with the features and configJson of a Config for configJson. """
+    features = [feature for feature, value in configJson.items() if isinstance(value, dict) and 'inputTags' in value]
+    return SimpleNamespace(features=features, configJson=configJson)
+
+
+def pairs(groups:dict) -> list:
+    """ Returns every (key, value) pair of a plan, once for every selector it is placed under. """
+    return [(key, value) for tags in groups.values() for key, values in tags.items() for value in values]
+
+
+class PlanTest(unittest.TestCase):
+    """Test that planQuery and unionTags query every tag once, with the element types it is needed for."""
+
+    def setUp(self):
+        with open(CONFIGURATION, encoding="utf-8") as file:
+            self.config = config(json.load(file))
+
+    def test_pairs_once(self):
+        """Every key-value pair of the configuration is placed under exactly one selector."""
+        expected = {(key, value) for feature in self.config.features
+                    for key, values in self.config.configJson[feature]['inputTags'].items() for value in values}
+        for strictGeom in (False, True):
+            found = pairs(planQuery(self.config, strictGeom))
+            self.assertEqual(len(found), len(set(found)), f"strictGeom {strictGeom}")
+            self.assertEqual(set(found), expected, f"strictGeom {strictGeom}")
+
+    def test_shared_pair(self):
+        """A pair of features with different geometries is queried once with the element types of both."""
+        plan = planQuery(config({
+            "trees": {"inputGeom": "node", "outputGeom": "point", "inputTags": {"natural": ["tree", "wood"]}},
+            "woods": {"inputGeom": "way", "outputGeom": "polygon", "inputTags": {"natural": ["wood"], "landuse": ["forest"]}},
+            "rows": {"inputGeom": "way", "outputGeom": "line", "inputTags": {"natural": ["tree_row"]}},
+        }), strictGeom=True)
+        self.assertEqual(plan, {"node": {"natural": ["tree"]}, "nw": {"natural": ["wood"]}, "way": {"landuse": ["forest"], "natural": ["tree_row"]}})
+
+    def test_compact_plain_values(self):
+        """Only plain values are combined into a regular expression, others are matched exactly."""
+        union = unionTags("way", {"highway": ["primary", "motorway_link"], "name": ["Via Dante", "Corso (Como)"], "shop": ["bakery"]}, compact=True)
+        self.assertEqual(union, '(way["highway"~"^(primary|motorway_link)$"];way["name"="Via Dante"];way["name"="Corso (Como)"];way["shop"="bakery"];)')
+        self.assertNotIn("~", unionTags("way", {"highway": ["primary", "secondary"]}))
+
+        # The regular expressions of the configuration only contain plain values
+        for selector, tags in planQuery(self.config).items():
+            for pattern in re.findall(r'~"\^\((.*?)\)\$"', unionTags(selector, tags, compact=True)):
+                self.assertRegex(pattern, r"^[\w:\- |]+$")
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PlanTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
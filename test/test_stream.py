@@ -0,0 +1,142 @@
+# coding=utf-8
+"""Tests the incremental reading of overpass json responses.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.stream import Node, Way, Relation, TagTable, iterElements
+
+OSM_BASE = "2026-10-17T08:15:02Z"
+
+ELEMENTS = [
+    {"type": "node", "id": 1, "lat": 45.1, "lon": 9.1, "tags": {"name": "Piazza del Duomo", "amenity": "fountain"}},
+    {"type": "node", "id": 2, "lat": 45.2, "lon": 9.2},
+    {"type": "node", "id": 3, "lat": 45.3, "lon": 9.3, "tags": {"name": "Åkeröd 🌳", "natural": "tree"}},
+    {"type": "way", "id": 10, "nodes": [1, 2, 3, 1], "tags": {"building": "yes"}},
+    {"type": "relation", "id": 100, "members": [{"type": "way", "ref": 10, "role": "outer"}], "tags": {"type": "multipolygon"}},
+]
+
+
+def response(elements:list = ELEMENTS, remark:str = None) -> bytes:
+    """ Returns an overpass json response with the header overpass sends, which is longer than a small chunk. """
+    data = {
+        "version": 0.6,
+        "generator": "Overpass API 0.7.62.1 084b4234",
+        "osm3s": {
+            "timestamp_osm_base": OSM_BASE,
+            "copyright": "The data included in this document is from www.openstreetmap.org. The data is made available under ODbL.",
+        },
+        "elements": elements,
+    }
+    if remark is not None:
+        data["remark"] = remark
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+class StreamTest(unittest.TestCase):
+    """Test iterElements with responses read in chunks of different sizes."""
+
+    def read(self, data:bytes, chunkSize:int, meta:dict = None) -> list:
+        return list(iterElements(io.BytesIO(data), chunkSize=chunkSize, meta=meta))
+
+    def test_small_chunks(self):
+        """The same records are read whatever the chunk size."""
+        expected = self.read(response(), 1 << 20)
+        self.assertEqual([type(record) for record in expected], [Node, Node, Node, Way, Relation])
+        self.assertEqual(list(expected[3].nodeIds), [1, 2, 3, 1])
+        self.assertEqual(expected[4].members[0].ref, 10)
+        for chunkSize in (1, 2, 7, 64):
+            self.assertEqual(self.read(response(), chunkSize), expected, f"chunkSize {chunkSize}")
+
+    def test_multibyte_split(self):
+        """Characters of several bytes that are split between reads are decoded whole."""
+        data = response()
+        split = data.index("🌳".encode("utf-8")) + 1 # Inside the four bytes of the emoji
+        for chunkSize in (1, 3, split):
+            records = self.read(data, chunkSize)
+            self.assertEqual(records[2].tags["name"], "Åkeröd 🌳", f"chunkSize {chunkSize}")
+
+    def test_runtime_error_remark(self):
+        """A runtime error remark after the elements raises once the elements have been read."""
+        remark = "runtime error: Query timed out in \"query\" at line 3 after 26 seconds."
+        records = []
+        with self.assertRaises(RuntimeError) as raised:
+            for record in iterElements(io.BytesIO(response(remark=remark)), chunkSize=16):
+                records.append(record)
+        self.assertEqual(len(records), len(ELEMENTS))
+        self.assertIn("Query timed out", str(raised.exception))
+
+    def test_osm_base_across_chunks(self):
+        """The osm_base timestamp is found when the header is read in several chunks."""
+        for chunkSize in (1, 16, 64, 1 << 20):
+            meta = {}
+            self.read(response(), chunkSize, meta)
+            self.assertEqual(meta.get("timestamp_osm_base"), OSM_BASE, f"chunkSize {chunkSize}")
+
+    def test_incomplete_geometry(self):
+        """Inline geometry with null vertices is incomplete and not used."""
+        complete = [{"lat": 45.46, "lon": 9.19}, {"lat": 45.47, "lon": 9.19}]
+        incomplete = [{"lat": 45.46, "lon": 9.19}, None, {"lat": 45.47, "lon": 9.19}]
+        elements = [
+            {"type": "way", "id": 10, "nodes": [1, 2], "geometry": complete},
+            {"type": "way", "id": 11, "nodes": [1, 4, 2], "geometry": incomplete},
+            {"type": "relation", "id": 100, "members": [
+                {"type": "way", "ref": 10, "role": "outer", "geometry": complete},
+                {"type": "way", "ref": 11, "role": "outer", "geometry": incomplete},
+            ]},
+        ]
+        way, incompleteWay, relation = self.read(response(elements), 64)
+        self.assertEqual(way.coords, ((9.19, 45.46), (9.19, 45.47)))
+        self.assertIsNone(incompleteWay.coords)
+        self.assertEqual([member.coords is None for member in relation.members], [False, True])
+
+    def test_no_elements(self):
+        """A response without an elements array raises ValueError."""
+        with self.assertRaises(ValueError):
+            self.read(b'{"version": 0.6, "remark": "runtime error: out of memory"}', 8)
+
+
+class TagTableTest(unittest.TestCase):
+    """Test sharing and bounding of interned tag sets."""
+
+    def test_shared(self):
+        """Elements with the same few tags get the same dictionary, larger tag sets are not shared."""
+        table = TagTable()
+        tree = table({"natural": "tree"})
+        self.assertIs(table({"natural": "tree"}), tree)
+        self.assertEqual(tree, {"natural": "tree"})
+
+        tags = {f"key{i}": "value" for i in range(TagTable.MAX_TAGS + 1)}
+        self.assertIsNot(table(dict(tags)), table(dict(tags)))
+        self.assertEqual(len(table), 1)
+
+    def test_bounded(self):
+        """Tag sets that do not repeat are dropped, the recently used ones are kept."""
+        table = TagTable(maxSets=10)
+        tree = table({"natural": "tree"})
+        for i in range(100):
+            table({"name": f"Via {i}"})
+            self.assertIs(table({"natural": "tree"}), tree)
+        self.assertEqual(len(table), 10)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(StreamTest), unittest.makeSuite(TagTableTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Tests the shapely array operations of the shapely engine.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import vectorized
+from core.multipolygon import assemble
+
+if vectorized.available():
+    import numpy as np
+    import shapely
+
+
+@unittest.skipUnless(vectorized.available(), "shapely 2 is not installed")
+class VectorizedTest(unittest.TestCase):
+    """Test building, buffering and subtracting arrays of geometries."""
+
+    def test_lines_and_polygons(self):
+        """Every coordinate list becomes its own geometry, from lists and numpy arrays."""
+        lines = vectorized.lineStrings([[(0, 0), (1, 0)], np.array([[0, 1], [1, 1], [2, 1]])])
+        self.assertEqual(shapely.get_num_points(lines).tolist(), [2, 3])
+
+        square = [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+        polygons = vectorized.polygons([square, np.array(square) + 10])
+        self.assertEqual(shapely.area(polygons).tolist(), [4, 4])
+        centroids = vectorized.centroids([square])
+        self.assertEqual(shapely.get_coordinates(centroids).tolist(), [[1, 1]])
+
+    def test_multi_geometries(self):
+        """Multi geometries keep their parts apart, touching lines are merged."""
+        multiPoints = vectorized.multiPoints([[(0, 0)], [(1, 1), (2, 2)]])
+        self.assertEqual(shapely.get_num_geometries(multiPoints).tolist(), [1, 2])
+
+        merged = vectorized.mergedLines([[[(0, 0), (1, 0)], [(1, 0), (2, 0)]], [[(0, 0), (1, 0)], [(5, 5), (6, 6)]]])
+        self.assertEqual(shapely.get_type_id(merged).tolist(), [1, 5]) # LineString, MultiLineString
+
+    def test_multipolygon_holes(self):
+        """Polygons from assemble keep their holes, one multipolygon per relation."""
+        outer = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+        inner = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+        separate = [(20, 0), (21, 0), (21, 1), (20, 1), (20, 0)]
+        first, _ = assemble([outer, separate], [inner])
+        second, _ = assemble([separate], [])
+
+        geoms = vectorized.multiPolygons([first, second])
+        self.assertEqual(shapely.get_num_geometries(geoms).tolist(), [2, 1])
+        self.assertEqual(shapely.area(geoms).tolist(), [100 - 4 + 1, 1])
+
+    def test_buffer_radii(self):
+        """Every geometry is buffered by the radius of its tag value, values without one are NaN."""
+        radii = vectorized.radii(["primary", "unknown", "service"], {"primary": 2.0, "service": 1.0})
+        self.assertTrue(math.isnan(radii[1]))
+
+        keep = ~np.isnan(radii)
+        lines = vectorized.lineStrings([[(0, 0), (10, 0)]] * 3)
+        buffered = vectorized.buffered(lines[keep], radii[keep])
+        self.assertAlmostEqual(shapely.bounds(buffered)[0][1], -2)
+        self.assertAlmostEqual(shapely.bounds(buffered)[1][1], -1)
+
+    def test_subtract(self):
+        """Only the geometries that intersect an area are subtracted from it."""
+        areas = shapely.box([0, 100], [0, 100], [10, 110], [10, 110])
+        geoms = vectorized.polygons([[(0, 0), (5, 0), (5, 10), (0, 10), (0, 0)], [(50, 50), (60, 50), (60, 60), (50, 50)]])
+
+        result = vectorized.subtract(areas, geoms)
+        self.assertEqual(shapely.area(result).tolist(), [50, 100])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(VectorizedTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,55 @@
+# coding=utf-8
+"""Tests the WKB encoder.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'bing.hawk@telia.com'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2022, Leonard Hökby'
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import wkb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class WkbTest(unittest.TestCase):
+    """Test the byte layout of the encoded geometries."""
+
+    def test_point(self):
+        """A point is a header followed by two doubles."""
+        self.assertEqual(wkb.point((1.5, 2.5)), struct.pack("<BI2d", 1, wkb.POINT, 1.5, 2.5))
+
+    def test_polygon(self):
+        """Polygons hold the number of rings, each with its number of points."""
+        ring = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]
+        data = wkb.multiPolygon([[ring]])
+        self.assertEqual(struct.unpack_from("<BII", data), (1, wkb.MULTIPOLYGON, 1))
+        self.assertEqual(struct.unpack_from("<BIII", data, 9), (1, wkb.POLYGON, 1, 4))
+        self.assertEqual(len(data), 9 + 9 + 4 + 4 * 16)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_array(self):
+        """Arrays of coordinates give the same bytes as lists of pairs."""
+        coords = [(9.1, 45.1), (9.2, 45.2), (9.3, 45.1)]
+        self.assertEqual(wkb.lineString(np.array(coords)), wkb.lineString(coords))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(WkbTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -28,9 +28,7 @@ from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 from qgis.gui import QgsFileWidget
 
-from qgis.core import QgsRectangle, QgsCoordinateReferenceSystem, QgsProject
-
-from ..core.utilities.tools import transformQLayer
+from qgis.core import QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
 
 # This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -86,20 +84,22 @@ class MainDialog(QtWidgets.QDialog, FORM_CLASS):
             crsIn = layer.sourceCrs()
             crsProj = QgsCoordinateReferenceSystem("EPSG:3857") # Projected system
             crsOsm = QgsCoordinateReferenceSystem("EPSG:4326")
-            layerProjected = transformQLayer(self.project, layer, crsIn, crsProj)
-            layerOsm = transformQLayer(self.project, layer, crsIn, crsOsm)
-            bbox = layerOsm.extent()
-            area = layerProjected.extent().area()
+            # Only the extent is needed, transforming it avoids copying every feature of the layer twice. 
+            transformContext = self.project.transformContext()
+            bbox = QgsCoordinateTransform(crsIn, crsOsm, transformContext).transformBoundingBox(layer.extent())
+            area = QgsCoordinateTransform(crsIn, crsProj, transformContext).transformBoundingBox(layer.extent()).area()
 
         if area > 40000000:
-            areaMessage = f"""The area is to large, sorry {area/1000000}km^2. The tool can handle areas smaller than 40km^2"""
+            areaMessage = f"""The area is very large {area/1000000}km^2. It might be downloaded in several parts and take a long time. Do you wish to continue?"""
             msgBox = QtWidgets.QMessageBox()
-            msgBox.setIcon(QtWidgets.QMessageBox.Critical)
-            msgBox.addButton(QtWidgets.QMessageBox.Ok)
-            msgBox.setWindowTitle("Area message")
+            msgBox.setIcon(QtWidgets.QMessageBox.Warning)
+            msgBox.setStandardButtons(QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel)
+            msgBox.setWindowTitle("Area warning")
             msgBox.setText(areaMessage)
-            msgBox.exec()
-            # goVal = False
+            retVal = msgBox.exec()
+
+            if retVal == QtWidgets.QMessageBox.Cancel:
+                goVal = False
         elif area > 10000000:
             areaMessage = f"""The area is quite large {area/1000000}km^2, this might take a while. Do you wish to continue?"""
             msgBox = QtWidgets.QMessageBox()